@@ -7,14 +7,14 @@
 # 2. Delete Dupes
 # 3. Clean
 # 4. Store in file.
-import feedparser, logging, re
-from urllib.parse import urlparse
+import bloom, feedparser, feeds, hashlib, json, logging, normalize, os, requests, store
+from concurrent.futures import ThreadPoolExecutor
+from domainindex import DomainIndex
 
 class Mallector:
 
-    def __init__(self):
+    def __init__(self, domain_store=None):
         self.malfeeds = open('config/malware-feeds', 'r').read().splitlines()
-        self.potential_list = []
         self.potentials = None
         self.potentials_file = 'data/Potentials.txt'
         self.blk = None
@@ -23,51 +23,65 @@ class Mallector:
         self.analysis_file = 'data/Full-Analysis.txt'
         self.processed = None
         self.processed_file = 'data/Processed_file.txt'
+        self.index = DomainIndex([self.blk_file, self.processed_file])
+        self.queued = DomainIndex([self.potentials_file])  # Domains already waiting in Potentials.txt
+        self.blacklisted = DomainIndex([self.blk_file])
+        self.deduped = False
+        self.store = domain_store or store.Store()
+        self.feed_state = {}    # url -> ETag/Last-Modified of the last fetch
+        self.feed_state_file = 'data/feed-state.json'
+        self.fetch_workers = 8
+        self.seen_file = 'data/seen.bloom'
+        self.seen_capacity = 1000000
+        self.seen_error_rate = 0.001
+        self.seen = self.load_seen()    # Every domain ever processed or blacklisted. See bloom.py
+        self.filtered = 0
         logging.basicConfig(filename='logs/Mallector.log', level=logging.DEBUG, format='%(asctime)s %(message)s')
         return
     
+    def load_seen(self):
+        '''
+            Opens the filter of processed and blacklisted domains.
+            A new or full filter is rebuilt from the data files and the store.
+        '''
+        seen = bloom.BloomFilter(self.seen_file, self.seen_capacity, self.seen_error_rate)
+        if not (seen.created) and not (seen.full()):
+            return seen
+
+        capacity = max(self.seen_capacity, seen.capacity * 2 if (seen.full()) else 0)
+        seen.close()
+        return bloom.rebuild(self.seen_file, [self.blk_file, self.processed_file], self.store, capacity, self.seen_error_rate)
+
     def update_feeds(self):
         self.malfeeds = open('config/malware-feeds', 'r').read().splitlines()
         return
 
     def has_both(self, domain_string):
-        parse = urlparse(domain_string)
-        result = '/' in parse.path  # If / in parsed path, then it has both
-        return result
+        # Both a domain and a file on it
+        return len(normalize.split_uri(domain_string)) == 2
     
     def domain_splitter(self, domain_string):
-        uri_list = [domain_string]
-
-        # If domain parsed the string and has a 'netloc', the 'path' is the file location
-        if (urlparse(domain_string).netloc): 
-            page = urlparse(domain_string).netloc + urlparse(domain_string).path
-            uri_list.append(page)
-            return uri_list
-        
-        domain = re.match('^[^\/]*', domain_string).group()
-        uri_list.insert(0, domain)
-        return uri_list
+        '''
+            'http://evil.com/file.php' -> ['evil.com', 'evil.com/file.php']
+        '''
+        return normalize.split_uri(domain_string)
 
     def find_domain(self, domain_string):
 
-        # REGEX THE STRING THAT HAS DOMAIN IN IT HERE #
-        # Case 0: Domain is just an IP or something.com
-        # Domain Only
-        if ('/' not in domain_string):
-            domain = domain_string
+        # Case 1: Until space. 'textspeier.de (2017/12/04_18:50)'
+        # The domain is first, the date is second for MalwareDomainList
+        spacer = domain_string.split()
+        if not (spacer):
             return
+        uri_list = self.domain_splitter(spacer[0])
 
-        # Case 1: Until space. 'textspeier.de (2017/12/04_18:50)'
+        # Case 0: Domain is just an IP or something.com
         # Domain Only
-        if (' ' in domain_string):
-            spacer = domain_string.split()
-            domain = spacer[0]  # The domain is first, the date is second for MalwareDomainList
-            return domain
-        
+        if (len(uri_list) == 1):
+            return uri_list[0]
+
         # Case 2: String has both a file and domain in it.
-        # This should be the last case
-        if (self.has_both(domain_string)):
-            uri_list = self.domain_splitter(domain_string)
+        if (len(uri_list) == 2):
             return uri_list
         
         print("find_domain broke. Check log.")
@@ -75,78 +89,204 @@ class Mallector:
         return
     
     def malc0de_feed_parser(self, value_string):
-        value_list = value_string.split(' ')
-        domain_string = value_list[1][:-1]
-        return domain_string
+        match = feeds.MALC0DE_URL.search(value_string)
+        if (match):
+            return match.group(1)
+        return
+
+    def load_feed_state(self):
+        try:
+            with open(self.feed_state_file, 'r') as f:
+                self.feed_state = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logging.debug("{} is corrupt. Fetching every feed.".format(self.feed_state_file))
+        return
+
+    def save_feed_state(self):
+        temp_filename = self.feed_state_file + ".tmp"
+        with open(temp_filename, 'w') as f:
+            json.dump(self.feed_state, f)
+        os.replace(temp_filename, self.feed_state_file)
+        return
+
+    def fetch(self, line):
+        '''
+            Conditional GET of a feed.
+            Returns the parsed rss feed or the body of a text feed,
+            or None if the feed didn't change since the last fetch.
+        '''
+        url, feed_type, argument = feeds.feed_entry(line)
+        parser = feeds.parser_for(feed_type)
+        state = self.feed_state.get(url, {})
+
+        if (parser is None):
+            return
+
+        try:
+            if (parser.kind == 'rss'):
+                feed = feedparser.parse(url, etag=state.get('etag'), modified=state.get('modified'))
+                status = feed.get('status')
+                etag, modified = feed.get('etag'), feed.get('modified')
+
+            else:
+                headers = {}
+                if (state.get('etag')):
+                    headers['If-None-Match'] = state['etag']
+                if (state.get('modified')):
+                    headers['If-Modified-Since'] = state['modified']
+                response = requests.get(url, headers=headers, timeout=60)
+                feed = response.text
+                status = response.status_code
+                etag, modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+        except:
+            logging.exception("message")
+            return
+
+        if (status == 304):
+            logging.info("{} not modified.".format(url))
+            return
+
+        self.feed_state[url] = {'etag': etag, 'modified': modified}
+        return feed
+
+    def extract(self, line, feed):
+        '''
+            Yields every potentially malicious URI in a specific feed.
+        '''
+        url, feed_type, argument = feeds.feed_entry(line)
+
+        try:
+            domain_strings = list(feeds.parser_for(feed_type).parse(feed, argument))
+        except:
+            logging.debug("Could not parse {} as {}".format(url, feed_type))
+            logging.exception("message")
+            return
+
+        for domain_string in domain_strings:
+            result = self.find_domain(domain_string)
+
+            if (type(result) == str):
+                yield result
+
+            # Checks to see if domain_string reutrned a list containing
+            # a domain and a domain w/ a file.
+            # The list shouldn't be bigger than 2. If so somethign strange happened.
+            if (type(result) == list):
+
+                # Checks to see if list is bigger than 2. It shouldn't ever.
+                if (len(result) > 2):
+                    logging.debug("List bigger than 2: {}".format(result))
+
+                for item in result:
+                    yield item
 
     def collect(self, output_filename):
-        # Goes through all the feeds in the file "malware-feeds"
-        for i in range(0,len(self.malfeeds)):
-            url = self.malfeeds[i]
-            feed = feedparser.parse(url)
-
-            # Goes through all the potentially malicious URIs in a specific feed
-            for i in range(0,len(feed['items'])):
-
-                # SPECIFIC FOR //malc0de.com/rss/
-                if (url == 'http://malc0de.com/rss/'):
-                    value_string = feed['items'][i]['summary_detail']['value']
-                    domain_string = self.malc0de_feed_parser(value_string)
-                
-                if (url == 'https://cybercrime-tracker.net/rss.xml'):
-                    domain_string = feed['items'][i]['title']
-
-                result = self.find_domain(domain_string)
-
-                if (type(result) == str):
-                    self.potential_list.append(result)
-
-                # Checks to see if domain_string reutrned a list containing
-                # a domain and a domain w/ a file.
-                # The list shouldn't be bigger than 2. If so somethign strange happened.
-                if (type(result) == list):
-
-                    # Checks to see if list is bigger than 2. It shouldn't ever.
-                    if (len(result) > 2):
-                        logging.debug("List bigger than 2: {}".format(result))
-
-                    for i in range(0,len(result)):
-                        self.potential_list.append(result[i])
-        
-        # Removes dupes
-        self.potential_list = set(self.potential_list)
-        self.potential_list = list(self.potential_list)
-
-        # Remove any domains already collected.
-        out = open(output_filename, 'a')
-        for item in self.potential_list:
-            out.write("%s\n" % item)
-        out.close()
-        print("{} of pMaliciousDomains saved to {}".format(len(self.potential_list), output_filename))
+        '''
+            Fetches all the feeds in the file "malware-feeds" at once
+            and appends every new domain to output_filename.
+        '''
+        if (output_filename != self.potentials_file):
+            self.potentials_file = output_filename
+            self.queued = DomainIndex([output_filename])
+
+        self.load_feed_state()
+        self.queued.refresh()
+        # Same feed listed twice is only fetched once
+        lines = list(dict.fromkeys(line.strip() for line in self.malfeeds if line.strip()))
+        count = 0
+
+        with ThreadPoolExecutor(max_workers=self.fetch_workers) as pool, open(output_filename, 'a') as out:
+            for line, feed in zip(lines, pool.map(self.fetch, lines)):
+                if not (feed):
+                    continue
+
+                # Domains go straight to the file, unless they're queued or processed already.
+                new_domains = []
+                for domain in self.extract(line, feed):
+                    if (domain in self.queued):
+                        continue
+
+                    # The filter rules out new domains without reading any file.
+                    # Only a positive, which may be false, is looked up in the store.
+                    if (domain in self.seen) and (self.store.status(domain) in ('processed', 'blacklisted')):
+                        self.filtered += 1
+                        continue
+                    out.write("%s\n" % domain)
+                    self.queued.add(domain)
+                    new_domains.append(domain)
+
+                # Remembers which feed every domain came from.
+                self.store.add_pending(new_domains, feed=feeds.feed_entry(line)[0])
+                count += len(new_domains)
+
+        self.save_feed_state()
+        print("{} of pMaliciousDomains saved to {}".format(count, output_filename))
         return
     
+    def enqueue(self, domains):
+        '''
+            Queues domains that didn't come from a feed, like the hosts
+            the rollup scans first, the same way collect() queues the others.
+            Returns the domains that weren't queued yet.
+        '''
+        new_domains = [domain for domain in dict.fromkeys(domains) if (domain not in self.queued)]
+        if not (new_domains):
+            return []
+
+        with open(self.potentials_file, 'a') as out:
+            for domain in new_domains:
+                out.write("%s\n" % domain)
+                self.queued.add(domain)
+        self.store.add_pending(new_domains)
+        return new_domains
+
     def dedupe(self, filename):
         '''
             Eliminates duplicates in file.
+            Streams the file once, keeping the first of every line in its
+            original order and only an 8 byte hash of each line in memory.
+            The file is replaced through a temp file and rename.
         '''
-        old_lines = open(filename).readlines()
-        number_of_lines_before = len(old_lines)
-        uniqlines = set(old_lines)
-        current_number = len(uniqlines)
+        seen = set()
+        number_of_lines_before = 0
+        current_number = 0
+        temp_filename = filename + ".tmp"
+
+        try:
+            with open(filename, 'rb') as infile, open(temp_filename, 'wb') as outfile:
+                for line in infile:
+                    number_of_lines_before += 1
+                    if not (line.endswith(b"\n")):
+                        line += b"\n"
+
+                    digest = hashlib.blake2b(line, digest_size=8).digest()
+                    if (digest in seen):
+                        continue
+                    seen.add(digest)
+                    outfile.write(line)
+                    current_number += 1
+
+        except FileNotFoundError:
+            print("{} not found.".format(filename))
+            return
+
         number_of_dupes = number_of_lines_before - current_number
         if (number_of_dupes > 1):
             print("{} duplicates in {}!".format(number_of_dupes, filename))
-            open(filename, 'w').writelines(set(uniqlines))
-            self.number_of_domains(current_number)
+            os.replace(temp_filename, filename)
 
         elif (number_of_dupes == 1):
             print("{} duplicate in {}!".format(number_of_dupes, filename))
-            open(filename, 'w').writelines(set(uniqlines))
-            self.number_of_domains(current_number)
+            os.replace(temp_filename, filename)
 
         else:
             print("No duplicates present in {}".format(filename))
-            self.number_of_domains(current_number)
+            os.remove(temp_filename)
+
+        self.number_of_domains(current_number)
         return
     
     def number_of_domains(self, domain_number):
@@ -165,45 +305,33 @@ class Mallector:
             logging.debug('dedupe function returning less than 0.')
         return
     
-    def dedupe_all(self):
+    def dedupe_all(self, force=False):
         '''
             Removes duplicates in each individual file.
+            Everything this program appends is checked against the indexes
+            first, so the files only need a full pass once, for duplicates
+            written before that or by hand.
         '''
+        if (self.deduped) and not (force):
+            return
+
         self.dedupe(self.blk_file)
         self.dedupe(self.processed_file)
         self.dedupe(self.potentials_file)
+        self.deduped = True
         return
     
     def already_processed(self):
-
-        count = 0
-
-        with open(self.blk_file, 'r') as blk:
-            with open(self.potentials_file, 'r') as potentials:
-                with open(self.processed_file, 'r') as processed:
-
-                    blk_list = blk.read().split()
-                    potentials_list = potentials.read().split()
-                    processed_list = processed.read().split()
-
-                    already_processed_list = processed_list + blk_list
-
-                    for item1 in range(0,len(already_processed_list)):
-                        for item2 in range(0,len(potentials_list)):
-                            try:
-                                if (already_processed_list[item1] == potentials_list[item2]):
-                                    potentials_list.remove(already_processed_list[item1])
-                                    count += 1
-                            except:
-                                pass
+        '''
+            Removes every domain from Potentials.txt that is already
+            in GlobalBlacklist.txt or Processed_file.txt.
+        '''
+        # Only reads what was appended since the last cycle.
+        self.index.refresh()
+        kept, count = self.index.filter_file(self.potentials_file)
 
         print("{} domains already processed for potential.".format(count))
-        print("{} potentially malicious domains.".format(len(potentials_list)))
-
-        with open(self.potentials_file, 'w') as f:
-            for i in range(0, len(potentials_list)):
-                f.write(potentials_list[i] + "\n")
-
+        print("{} potentially malicious domains.".format(kept))
         return
 
     def removed_preprocessed_blacklist_domains(self):
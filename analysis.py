@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+#
+# analysis.py
+# Reads the rows VirusTotal.csv_output() wrote to Full-Analysis.csv back into
+# the same shape as the 'scans' of a VT result.
+#
+# Schema 1 rows have been written in two layouts:
+#   domain,,,,,,<AV cells>                      (no timestamp, AVs start on column 6)
+#   domain,timestamp,,,,,,<AV cells>            (AVs start on column 7)
+# with AV cells in the order of config/VT-AVs.
+# Schema 2 rows follow the last 'Domain,Timestamp,Schema,<AVs>' header before them. See schema.py
+# AV cells are 'detected;result' or 'detected;result;detail'.
+# The oldest rows were saved from a spreadsheet, with timestamps like '4/25/18 10:58'.
+import csv, datetime, logging, os
+
+TIMESTAMP = '%Y-%m-%d %H:%M:%S'
+SPREADSHEET_TIMESTAMP = '%m/%d/%y %H:%M'
+
+def parse_timestamp(string):
+    '''
+        '2018-04-25 10:58:00' or '4/25/18 10:58' -> seconds since the epoch, in local time.
+        None if it is neither.
+    '''
+    for layout in (TIMESTAMP, SPREADSHEET_TIMESTAMP):
+        try:
+            return datetime.datetime.strptime(string, layout).timestamp()
+        except ValueError:
+            pass
+    return
+
+def parse_cell(cell):
+    '''
+        'True;malware site;http://...' -> {'detected': True, 'result': 'malware site', 'detail': 'http://...'}
+    '''
+    parts = cell.split(';', 2)
+    av_result = {'detected': parts[0] == 'True', 'result': parts[1] if (len(parts) > 1) else ''}
+    if (len(parts) > 2):
+        av_result['detail'] = parts[2]
+    return av_result
+
+def parse_layout(header):
+    '''
+        Given a header row, returns the AV -> column mapping of schema 2 headers,
+        or None for the schema 1 header.
+    '''
+    if (len(header) > 2) and (header[2] == 'Schema'):
+        return dict((header[i], i) for i in range(3, len(header)))
+    return
+
+def parse_row(fields, av_list, layout=None):
+    '''
+        Returns (domain, timestamp, scans). timestamp is None for rows that don't have one.
+    '''
+    if (layout):
+        scans = {}
+        for av, i in layout.items():
+            if (i < len(fields)) and (fields[i]):
+                scans[av] = parse_cell(fields[i])
+        return (fields[0], parse_timestamp(fields[1]), scans)
+
+    timestamp = None
+    start = 6
+
+    for i in (1, 2):
+        if (len(fields) > i) and (fields[i]):
+            timestamp = parse_timestamp(fields[i])
+            start = 7
+            break
+
+    scans = {}
+    for i in range(0, len(av_list)):
+        if (start + i < len(fields)) and (fields[start + i]):
+            scans[av_list[i]] = parse_cell(fields[start + i])
+    return (fields[0], timestamp, scans)
+
+def read_rows(filename, av_list):
+    '''
+        Yields (domain, timestamp, scans) for every row of a Full-Analysis.csv.
+    '''
+    layout = None
+
+    # A first run has no Full-Analysis.csv yet.
+    if not (os.path.exists(filename)):
+        return
+
+    with open(filename, 'r', newline='') as f:
+        for fields in csv.reader(f):
+            if (fields) and (fields[0] == 'Domain'):
+                layout = parse_layout(fields)
+                continue
+            if not (fields) or (fields[0] in ('BROKEN', '')):
+                continue
+            try:
+                yield parse_row(fields, av_list, layout)
+            except:
+                logging.debug("Could not read row: {}".format(fields[:2]))
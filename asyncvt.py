@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+#
+# asyncvt.py
+# Pipelined VirusTotal client.
+# The serial path submits a batch, polls the reports that are due, and only
+# then submits the next batch, so it spends most of its time waiting on VT.
+# This keeps several url/scan batches and url/report batches in flight at once.
+# It uses the same calls as the serial path: add_urls() packs 4 or 25 urls per
+# url/scan call, and the shared report tracker (pending.py) decides which
+# scan_ids are polled together and when. Every verdict is recorded through
+# VirusTotal.record_batch(), on the event loop thread, one at a time.
+# Scans that aren't analysed yet when the queue is submitted stay in the tracker,
+# like they do for the serial path.
+import asyncio, logging, time
+from concurrent.futures import ThreadPoolExecutor
+
+class AsyncVirusTotal:
+
+    def __init__(self, vt, concurrency=8):
+        self.vt = vt
+        self.concurrency = concurrency      # url/scan and url/report calls in flight
+        self.idle = 0.25    # Longest sleep between looks at the tracker
+        self.semaphore = None
+        self.executor = None
+        self.completed = 0
+        self.cached = 0
+        self.invalid = 0
+        self.failed = 0
+        return
+
+    async def call(self, function, *args):
+        '''
+            Runs one of the blocking VirusTotal calls on a worker thread.
+            Only self.concurrency calls are in flight at once.
+        '''
+        loop = asyncio.get_running_loop()
+        async with self.semaphore:
+            return await loop.run_in_executor(self.executor, function, *args)
+
+    async def submit(self, batch):
+        '''
+            Submits a batch with add_urls(), which only sends the failed entries again.
+        '''
+        try:
+            scan_ids = await self.call(self.vt.add_urls, batch)
+        except:
+            logging.exception("message")
+            scan_ids = {}
+
+        # Urls that could not be submitted stay queued.
+        self.failed += len(batch) - len(scan_ids)
+        self.invalid += len([url for url, scan_id in scan_ids.items() if not (scan_id)])
+        self.vt.track(scan_ids)
+        return
+
+    async def fetch(self, batch):
+        try:
+            return await self.call(self.vt.batch_results, batch)
+        except:
+            logging.exception("message")
+            return []
+
+    def file(self, ready):
+        tracker = self.vt.report_tracker()
+        self.failed += len(tracker.expired)
+        self.completed += len(ready)
+        self.vt.file_reports(ready)
+        return
+
+    async def poll(self, submitting, wait):
+        '''
+            Fetches the report batches that are due, all at once, until every
+            batch is submitted, and with wait until every report is in.
+        '''
+        tracker = self.vt.report_tracker()
+
+        while not (submitting.done()) or ((wait) and (len(tracker))):
+            due = tracker.next_due()
+            if (due is None) or (due > 0):
+                # Wakes up early when the last batch is submitted.
+                delay = self.idle if (due is None) else min(due, self.idle)
+                await asyncio.wait([submitting], timeout=delay)
+                continue
+
+            now = time.time()
+            batches = tracker.batches(now)
+            reports = await asyncio.gather(*[self.fetch(batch) for batch in batches])
+            for batch, batch_reports in zip(batches, reports):
+                self.file(tracker.resolve(batch, batch_reports, now))
+        return
+
+    async def run(self, urls, wait):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+        # Scanned recently. Filed without spending quota, like the serial path.
+        recorded, urls = self.vt.file_cached(urls)
+        self.cached += len(recorded)
+
+        step = self.vt.batch_size()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as self.executor:
+            submitting = asyncio.ensure_future(asyncio.gather(*[self.submit(urls[i:i + step]) for i in range(0, len(urls), step)]))
+            await self.poll(submitting, wait)
+            await submitting
+        return
+
+    def analyze(self, urls, wait=False):
+        '''
+            Driver.
+            Scans every url and records the verdicts that come back while
+            the others are submitted. With wait, also waits on the rest.
+            Returns the number of domains classified per minute.
+        '''
+        start = time.time()
+        asyncio.run(self.run(list(urls), wait))
+        elapsed = time.time() - start
+
+        rate = 0
+        if (elapsed > 0):
+            rate = self.completed / (elapsed / 60)
+
+        print("{} domains classified, {} cached, {} invalid, {} failed. {:.1f} domains/minute.".format(
+            self.completed, self.cached, self.invalid, self.failed, rate))
+        logging.info("async analysis: {} completed, {} cached, {} invalid, {} failed, {:.1f} domains/minute".format(
+            self.completed, self.cached, self.invalid, self.failed, rate))
+        return rate
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+#
+# bench_async.py
+# Domains/minute of the serial path (VirusTotal.scan_list) and the async
+# pipeline (asyncvt.py), on the same queue, against MockVirusTotal.
+# Both batch urls and scan_ids the same way and poll a report every --poll
+# seconds. The serial path makes one call at a time, the async one keeps
+# --concurrency calls in flight. VT takes --analysis-delay seconds to analyse
+# a url and --latency seconds to answer any call.
+#
+# Usage: python3 benchmarks/bench_async.py [--domains 2000] [--keys 40] [--latency 0.25] [--analysis-delay 2] [--poll 1] [--concurrency 8]
+#   --keys are premium keys. The default 40 is 1000 requests/minute, so
+#   the quota isn't what's measured. --keys 1 measures a single key.
+import argparse, os, sys, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.mockserver import MockServer, MockVirusTotal, scratch_tree, ROOT
+import asyncvt, keyscheduler, transport, vt
+
+def virustotal(api, keys, poll, concurrency):
+    c = vt.VirusTotal()
+    c.api = api
+    c.http = transport.Transport(pool_size=concurrency)
+    c.premium = True
+    c.keyring = ["key-{}".format(i) for i in range(0, keys)]
+    c.scheduler = keyscheduler.KeyScheduler(c.keyring, premium=True)
+    c.open_outputs()
+
+    tracker = c.report_tracker()
+    tracker.first_poll = poll
+    tracker.max_interval = poll
+    return c
+
+def run(mode, args):
+    with scratch_tree():
+        server = MockServer()
+        av_list = open('config/VT-AVs', 'r').read().splitlines()
+        MockVirusTotal(server, av_list, analysis_delay=args.analysis_delay, latency=args.latency)
+        c = virustotal(server.url('/vtapi/v2/'), args.keys, args.poll, args.concurrency)
+        queue = ["{}-{}.com".format(mode, i) for i in range(0, args.domains)]
+        c.store.add_pending(queue)
+
+        start = time.time()
+        if (mode == 'async'):
+            asyncvt.AsyncVirusTotal(c, concurrency=args.concurrency).analyze(queue, wait=True)
+        else:
+            # What the next cycles do with the reports that weren't in yet.
+            c.scan_list(queue)
+            tracker = c.report_tracker()
+            while (len(tracker)):
+                time.sleep(tracker.next_due())
+                c.collect_reports()
+        c.commit_outputs()
+        elapsed = time.time() - start
+
+        classified = sum(count for status, count in c.store.counts().items() if (status in ('processed', 'blacklisted')))
+        server.stop()
+        c.store.close()
+    return (classified, elapsed)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--domains', type=int, default=2000)
+    parser.add_argument('--keys', type=int, default=40)
+    parser.add_argument('--latency', type=float, default=0.25)
+    parser.add_argument('--analysis-delay', type=float, default=2.0)
+    parser.add_argument('--poll', type=float, default=1.0)
+    parser.add_argument('--concurrency', type=int, default=8, help="Calls the async pipeline keeps in flight")
+    args = parser.parse_args()
+
+    # Progress lines from both paths would bury the results.
+    stdout = sys.stdout
+    results = {}
+    for mode in ('sync', 'async'):
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            results[mode] = run(mode, args)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    print("{} domains, {} premium keys, {}s latency, {}s analysis, {}s polls, {} in flight".format(
+        args.domains, args.keys, args.latency, args.analysis_delay, args.poll, args.concurrency))
+    for mode, (classified, elapsed) in results.items():
+        print("{:>5}: {} classified in {:.1f}s, {:.0f} domains/minute".format(mode, classified, elapsed, classified / elapsed * 60))
+    return
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+#
+# bench_domainindex.py
+# Time to drop the already processed domains from Potentials.txt:
+# the nested loop Mallector.already_processed() used to run, against
+# DomainIndex, cold (index built from the files) and warm (a refresh
+# that only reads what was appended, like every cycle after the first).
+# Half the potentials are already processed or blacklisted.
+#
+# Usage: python3 benchmarks/bench_domainindex.py [--sizes 10000,100000,1000000] [--legacy-limit 10000]
+#   The old loop is quadratic: ~100x slower for every 10x more domains.
+#   It only runs up to --legacy-limit domains.
+import argparse, os, shutil, sys, tempfile, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from domainindex import DomainIndex
+
+def legacy_already_processed(blk_file, potentials_file, processed_file):
+    '''
+        Mallector.already_processed() before DomainIndex.
+    '''
+    count = 0
+    with open(blk_file, 'r') as blk:
+        with open(potentials_file, 'r') as potentials:
+            with open(processed_file, 'r') as processed:
+                blk_list = blk.read().split()
+                potentials_list = potentials.read().split()
+                processed_list = processed.read().split()
+                already_processed_list = processed_list + blk_list
+
+                for item1 in range(0, len(already_processed_list)):
+                    for item2 in range(0, len(potentials_list)):
+                        try:
+                            if (already_processed_list[item1] == potentials_list[item2]):
+                                potentials_list.remove(already_processed_list[item1])
+                                count += 1
+                        except:
+                            pass
+
+    with open(potentials_file, 'w') as f:
+        for i in range(0, len(potentials_list)):
+            f.write(potentials_list[i] + "\n")
+    return count
+
+def write_files(path, size):
+    '''
+        size domains already seen, a fifth of them blacklisted,
+        and size potentials, every other one already seen.
+    '''
+    blk_file = os.path.join(path, 'GlobalBlacklist.txt')
+    processed_file = os.path.join(path, 'Processed_file.txt')
+    potentials_file = os.path.join(path, 'Potentials.txt')
+
+    with open(blk_file, 'w') as blk, open(processed_file, 'w') as processed:
+        for i in range(0, size):
+            (blk if (i % 5 == 0) else processed).write("seen{}.com\n".format(i))
+    with open(potentials_file, 'w') as f:
+        for i in range(0, size):
+            f.write("seen{}.com\n".format(i) if (i % 2 == 0) else "new{}.com\n".format(i))
+    return (blk_file, potentials_file, processed_file)
+
+def run(size, legacy):
+    path = tempfile.mkdtemp(prefix='vtw-bench-')
+    results = {}
+    try:
+        blk_file, potentials_file, processed_file = write_files(path, size)
+        shutil.copy(potentials_file, potentials_file + '.orig')
+
+        if (legacy):
+            start = time.perf_counter()
+            removed = legacy_already_processed(blk_file, potentials_file, processed_file)
+            results['legacy'] = (time.perf_counter() - start, removed)
+            shutil.copy(potentials_file + '.orig', potentials_file)
+
+        start = time.perf_counter()
+        index = DomainIndex([blk_file, processed_file])
+        kept, removed = index.filter_file(potentials_file)
+        results['cold'] = (time.perf_counter() - start, removed)
+
+        # The next cycle: a thousand new verdicts and a fresh Potentials.txt.
+        shutil.copy(potentials_file + '.orig', potentials_file)
+        with open(processed_file, 'a') as f:
+            for i in range(0, 1000):
+                f.write("later{}.com\n".format(i))
+        start = time.perf_counter()
+        index.refresh()
+        kept, removed = index.filter_file(potentials_file)
+        results['warm'] = (time.perf_counter() - start, removed)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--legacy-limit', type=int, default=10000)
+    args = parser.parse_args()
+
+    print("{:>9} {:>12} {:>12} {:>12} {:>9}".format('domains', 'legacy', 'index cold', 'index warm', 'speedup'))
+    for size in [int(size) for size in args.sizes.split(',')]:
+        results = run(size, size <= args.legacy_limit)
+        removed = set(result[1] for result in results.values())
+        if (len(removed) != 1):
+            print("Results disagree at {}: {}".format(size, results))
+
+        legacy = "{:.3f}s".format(results['legacy'][0]) if ('legacy' in results) else 'skipped'
+        speedup = "{:.0f}x".format(results['legacy'][0] / results['cold'][0]) if ('legacy' in results) else '-'
+        print("{:>9} {:>12} {:>11.3f}s {:>11.3f}s {:>9}".format(size, legacy, results['cold'][0], results['warm'][0], speedup))
+    return
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+#
+# bench_groupcommit.py
+# Records/second appending Full-Analysis.csv sized rows, the old way
+# (open, write, fsync and close for every record) against GroupCommitWriter
+# (one fsync per max_records rows), in each directory given.
+# fsync is close to free on tmpfs and is what costs on a real disk,
+# so the default is one of each: /dev/shm and the system temp directory.
+#
+# Usage: python3 benchmarks/bench_groupcommit.py [--records 2000] [--max-records 50] [directory ...]
+import argparse, os, shutil, sys, tempfile, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import groupcommit
+
+# A domain, a timestamp, a score and 70 AV cells, like a Full-Analysis.csv row.
+ROW = "example{},2026-10-18 12:00:00,0/70," + "clean site," * 70 + "\n"
+
+def per_record(filename, records):
+    for i in range(0, records):
+        with open(filename, "a") as f:
+            f.write(ROW.format(i))
+            f.flush()
+            os.fsync(f.fileno())
+    return
+
+def group_commit(filename, records, max_records):
+    writer = groupcommit.GroupCommitWriter(filename, max_records=max_records, max_ms=1000)
+    for i in range(0, records):
+        writer.write(ROW.format(i))
+    writer.close()
+    return writer.commits
+
+def run(directory, args):
+    path = tempfile.mkdtemp(prefix='vtw-bench-', dir=directory)
+    try:
+        start = time.perf_counter()
+        per_record(os.path.join(path, 'per-record.csv'), args.records)
+        old = time.perf_counter() - start
+
+        start = time.perf_counter()
+        commits = group_commit(os.path.join(path, 'group-commit.csv'), args.records, args.max_records)
+        new = time.perf_counter() - start
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+    return (old, new, commits)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=2000)
+    parser.add_argument('--max-records', type=int, default=50)
+    parser.add_argument('directories', nargs='*')
+    args = parser.parse_args()
+    directories = args.directories or [d for d in ('/dev/shm', tempfile.gettempdir()) if os.path.isdir(d)]
+
+    print("{} records of {} bytes, group commits of {}".format(args.records, len(ROW.format(0)), args.max_records))
+    print("{:<24} {:>18} {:>18} {:>8} {:>8}".format('directory', 'per record fsync', 'group commit', 'commits', 'speedup'))
+    for directory in directories:
+        old, new, commits = run(directory, args)
+        print("{:<24} {:>12.0f} rec/s {:>12.0f} rec/s {:>8} {:>7.1f}x".format(
+            directory, args.records / old, args.records / new, commits, old / new))
+    return
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+#
+# bench_normalize.py
+# Time to clean every line of data/Potentials.txt:
+# the urlparse based VirusTotal.domain_clean() normalize.py replaced, one line
+# at a time, against normalize.domains_batch() and registered_domains_batch(),
+# cold (empty LRU caches, like a fresh process) and warm (every line parsed
+# before, like a line that is listed again by a later cycle).
+# Lines that made the old function raise are counted, not timed apart.
+#
+# Usage: python3 benchmarks/bench_normalize.py [--file data/Potentials.txt] [--repeat 5]
+import argparse, logging, os, re, sys, time
+from urllib.parse import urlparse
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import normalize
+
+def legacy_domain_clean(string):
+    '''
+        VirusTotal.domain_clean() before normalize.py.
+    '''
+    # Determines if port number specified
+    domain = urlparse(string)
+
+    if (":" in string):
+        regex_port = r"(^\d*)"
+        port = re.match(regex_port, domain.path).group(0)
+        real_domain = domain.scheme
+        return real_domain + ":" + port
+
+    if (domain.netloc):
+        return domain.netloc
+
+    elif (domain.path[0] != "/"):
+
+        if ("/" in domain.path):
+            # Get string until /
+            redomain = re.match(r"[^\/]*", domain.path).group(0)
+            return redomain
+        else:
+            return(domain.path)
+
+    else:
+        logging.debug("Error while cleaning a malicious domain before appending to blacklist\nDomain: {}".format(string))
+
+    return
+
+def legacy_batch(strings):
+    '''
+        Its callers caught whatever it raised.
+    '''
+    results = []
+    errors = 0
+    for string in strings:
+        try:
+            results.append(legacy_domain_clean(string))
+        except:
+            results.append(None)
+            errors += 1
+    return (results, errors)
+
+def clear_caches():
+    normalize.parse.cache_clear()
+    normalize.registered_domain.cache_clear()
+    return
+
+def best(function, strings, repeat, cold):
+    '''
+        Fastest of repeat runs, in seconds.
+    '''
+    times = []
+    for i in range(0, repeat):
+        if (cold):
+            clear_caches()
+        else:
+            function(strings)
+        start = time.perf_counter()
+        function(strings)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--file', default=os.path.join(ROOT, 'data', 'Potentials.txt'))
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.file, 'r') as f:
+        strings = f.read().splitlines()
+    print("{} lines, {} distinct, best of {}".format(len(strings), len(set(strings)), args.repeat))
+
+    results, errors = legacy_batch(strings)
+    legacy = best(legacy_batch, strings, args.repeat, cold=False)
+    print("{:<34} {:>9.1f}ms {:>10.0f} lines/s  ({} lines raised)".format('legacy domain_clean', legacy * 1000, len(strings) / legacy, errors))
+
+    for name, function in (('domains_batch', normalize.domains_batch), ('registered_domains_batch', normalize.registered_domains_batch)):
+        for cold in (True, False):
+            elapsed = best(function, strings, args.repeat, cold)
+            print("{:<34} {:>9.1f}ms {:>10.0f} lines/s  {:.1f}x legacy".format(
+                "{} {}".format(name, 'cold' if (cold) else 'warm'), elapsed * 1000, len(strings) / elapsed, legacy / elapsed))
+
+    clear_caches()
+    cleaned = normalize.domains_batch(strings)
+    # The old function turned 'ip:port/path' into ':ip', and didn't IDNA encode hosts.
+    print("domains_batch disagrees with the legacy function on {} lines, {} of them with a port.".format(
+        sum(1 for old, new in zip(results, cleaned) if (old != new)),
+        sum(1 for string, old, new in zip(strings, results, cleaned) if (old != new) and (':' in string))))
+    return
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+#
+# bench_parsers.py
+# Items/second of every parser in feeds.PARSERS, on a generated feed of --items items.
+#   parser:        the parser alone
+#   + split_uri:   and normalize.split_uri() on every string, like Mallector.find_domain()
+#   + feedparser:  rss parsers only, from the raw xml, feedparser.parse() included
+#
+# Usage: python3 benchmarks/bench_parsers.py [--items 20000] [--repeat 3]
+import argparse, os, sys, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import feedparser, feeds, normalize
+
+def rss(items):
+    entries = "".join("<item><title>{}</title><description>{}</description></item>\n".format(title, description)
+        for title, description in items)
+    return '<?xml version="1.0"?><rss version="2.0"><channel><title>bench</title>{}</channel></rss>'.format(entries)
+
+def payloads(count):
+    '''
+        feed type -> (raw feed, argument). rss feeds are raw xml.
+    '''
+    return {
+        'malc0de': (rss(("x", "URL: evil{}.com/files/x{}.exe, IP Address: 192.0.2.{}, Country: XX, ASN: 64500".format(i, i, i % 256))
+            for i in range(0, count)), None),
+        'rss-title': (rss(("evil{}.com/panel/gate.php".format(i), "") for i in range(0, count)), None),
+        'mdl': (rss(("evil{}.com (2017/12/04_18:50)".format(i), "Host: evil{}.com/x.php, IP address: 192.0.2.1, ASN: 64500".format(i))
+            for i in range(0, count)), None),
+        'hosts': ("# hosts\n" + "".join("127.0.0.1 evil{}.com\n".format(i) for i in range(0, count)), None),
+        'urls': ("".join("http://evil{}.com/login/index.php?id={}\n".format(i, i) for i in range(0, count)), None),
+        'csv': ("# id,dateadded,url,status\n" + "".join('"{}","2026-10-18 12:00:00","http://evil{}.com/a.bin","online"\n'.format(i, i)
+            for i in range(0, count)), '2'),
+    }
+
+def best(function, repeat):
+    '''
+        The fastest of repeat runs, in seconds, and what the last one returned.
+    '''
+    times = []
+    for i in range(0, repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return (min(times), result)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print("{} items per feed, best of {}".format(args.items, args.repeat))
+    print("{:<10} {:>16} {:>16} {:>16}".format('parser', 'parser', '+ split_uri', '+ feedparser'))
+    for name, (raw, argument) in payloads(args.items).items():
+        feed_parser = feeds.PARSERS[name]
+        payload = feedparser.parse(raw) if (feed_parser.kind == 'rss') else raw
+
+        seconds, strings = best(lambda: list(feed_parser.parse(payload, argument)), args.repeat)
+        if (len(strings) != args.items):
+            print("{} returned {} of {} items".format(name, len(strings), args.items))
+        split, _ = best(lambda: [normalize.split_uri(string) for string in feed_parser.parse(payload, argument)], args.repeat)
+
+        from_xml = '-'
+        if (feed_parser.kind == 'rss'):
+            whole, _ = best(lambda: list(feed_parser.parse(feedparser.parse(raw), argument)), 1)
+            from_xml = "{:.0f}/s".format(args.items / whole)
+
+        print("{:<10} {:>14.0f}/s {:>14.0f}/s {:>16}".format(name, args.items / seconds, args.items / split, from_xml))
+    return
+
+if __name__ == "__main__":
+    main()
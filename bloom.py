@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+#
+# bloom.py
+# Bloom filter of every domain ever processed or blacklisted, kept in
+# data/seen.bloom and memory mapped, so it is ready as soon as it is opened.
+# Mallector.collect() asks it about every domain a feed gives. A negative is
+# always right, so new domains are queued without reading any data file.
+# Only a positive, right or false, is looked up in the store.
+#
+# The size comes from the number of domains it is built for (capacity) and
+# the false positive rate wanted (error_rate). Once more domains than that
+# were added, the next open rebuilds it twice as big.
+#
+# Usage: python3 bloom.py rebuild
+#   Rebuilds data/seen.bloom from GlobalBlacklist.txt, Processed_file.txt and the store.
+import hashlib, logging, math, mmap, os, struct, sys
+
+HEADER = struct.Struct('<4sQIQQd')     # magic, bits, hashes, count, capacity, error_rate
+HEADER_SIZE = 64
+MAGIC = b'BLM1'
+
+class BloomFilter:
+
+    def __init__(self, filename='data/seen.bloom', capacity=1000000, error_rate=0.001):
+        self.filename = filename
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.bits / capacity * math.log(2))))
+        self.count = 0
+        self.file = None
+        self.map = None
+        self.created = False
+        self.open()
+        return
+
+    def open(self):
+        '''
+            Maps the filter file, or creates an empty one.
+            Returns False if it had to be created, so it needs a rebuild.
+        '''
+        size = HEADER_SIZE + (self.bits + 7) // 8
+        existed = os.path.exists(self.filename)
+
+        if (existed):
+            with open(self.filename, 'rb') as f:
+                header = f.read(HEADER.size)
+            try:
+                magic, bits, hashes, count, capacity, error_rate = HEADER.unpack(header)
+            except struct.error:
+                magic = None
+
+            # An existing filter is read with the settings in its own header.
+            if (magic == MAGIC):
+                self.bits, self.hashes, self.count, self.capacity, self.error_rate = bits, hashes, count, capacity, error_rate
+                size = HEADER_SIZE + (self.bits + 7) // 8
+            else:
+                logging.warning("{} is not a filter. Starting an empty one.".format(self.filename))
+                existed = False
+
+        mode = 'r+b' if (existed) else 'w+b'
+        self.file = open(self.filename, mode)
+        if not (existed):
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.write_header()
+        self.created = not existed
+        return existed
+
+    def write_header(self):
+        self.map[0:HEADER.size] = HEADER.pack(MAGIC, self.bits, self.hashes, self.count, self.capacity, self.error_rate)
+        return
+
+    def positions(self, domain):
+        '''
+            k bit positions from two 64 bit hashes (Kirsch-Mitzenmacher).
+        '''
+        digest = hashlib.blake2b(domain.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(0, self.hashes)]
+
+    def __contains__(self, domain):
+        data = self.map
+        for position in self.positions(domain):
+            if not (data[HEADER_SIZE + (position >> 3)] & (1 << (position & 7))):
+                return False
+        return True
+
+    def add(self, domain):
+        '''
+            Returns True if the domain wasn't in the filter yet.
+        '''
+        data = self.map
+        new = False
+        for position in self.positions(domain):
+            byte = HEADER_SIZE + (position >> 3)
+            bit = 1 << (position & 7)
+            if not (data[byte] & bit):
+                data[byte] |= bit
+                new = True
+
+        if (new):
+            self.count += 1
+        return new
+
+    def update(self, domains):
+        added = 0
+        for domain in domains:
+            if (self.add(domain)):
+                added += 1
+        self.write_header()
+        return added
+
+    def full(self):
+        return self.count > self.capacity
+
+    def flush(self):
+        self.write_header()
+        self.map.flush()
+        return
+
+    def close(self):
+        if (self.map is not None):
+            self.flush()
+            self.map.close()
+            self.file.close()
+            self.map = None
+        return
+
+    def stats(self):
+        '''
+            Expected false positive rate for the domains in it so far.
+        '''
+        rate = (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+        return {'domains': self.count, 'bytes': (self.bits + 7) // 8, 'hashes': self.hashes, 'false_positive_rate': rate}
+
+
+def read_lines(filename):
+    try:
+        with open(filename, 'r') as f:
+            for line in f:
+                if (line.strip()):
+                    yield line.strip()
+    except FileNotFoundError:
+        return
+
+def rebuild(filename, files, domain_store=None, capacity=1000000, error_rate=0.001):
+    '''
+        Builds a new filter from the data files and the store, and swaps it in.
+        Returns the new filter.
+    '''
+    domains = set()
+    for data_file in files:
+        domains.update(read_lines(data_file))
+    if (domain_store is not None):
+        domains.update(domain_store.seen())
+
+    # Leaves room to grow before the next rebuild.
+    capacity = max(capacity, len(domains) * 2)
+    temp_filename = filename + ".tmp"
+    if (os.path.exists(temp_filename)):
+        os.remove(temp_filename)
+
+    seen = BloomFilter(temp_filename, capacity, error_rate)
+    seen.update(domains)
+    seen.close()
+    os.replace(temp_filename, filename)
+
+    logging.info("Rebuilt {} from {} domains.".format(filename, len(domains)))
+    return BloomFilter(filename, capacity, error_rate)
+
+def main():
+    if (len(sys.argv) < 2) or (sys.argv[1] != 'rebuild'):
+        print("Usage: python3 bloom.py rebuild")
+        return
+
+    import store
+    seen = rebuild('data/seen.bloom', ['data/GlobalBlacklist.txt', 'data/Processed_file.txt'], store.Store())
+    print("data/seen.bloom: {}".format(seen.stats()))
+    seen.close()
+    return
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+#
+# columnar.py
+# Compact, column per file store for AV results.
+# Full-Analysis.csv keeps every scan as a 70+ column row of 'detected;result;detail'
+# strings. Here every AV gets its own file with one byte per scan: a code from a
+# shared dictionary of 'detected;result' strings (0 means the AV had no result).
+# Domains and timestamps get their own files too, so a question about one AV only
+# reads that AV's column and the timestamps.
+#
+# data/analysis/
+#   meta.json        AV column order and the verdict dictionary
+#   domains.txt      one domain per scan
+#   timestamps.bin   one double per scan
+#   av-<n>.bin       one byte per scan for the n-th AV
+#
+# meta.json is saved last, after every column was appended to. Its row count is
+# the one that counts: anything past it, from a flush a crash cut short, is
+# truncated away when the sink is loaded.
+# Scans have to stay in time order, so Full-Analysis.csv is converted into an
+# empty sink before anything else is appended (VirusTotal does it on its first run).
+#
+# Usage:
+#   python3 columnar.py convert                 Converts data/Full-Analysis.csv
+#   python3 columnar.py count Fortinet 7        Scans Fortinet flagged in the last 7 days
+import analysis, array, bisect, json, logging, os, sys, time
+
+CLEAN = ('clean site', 'unrated site')
+
+class ColumnarSink:
+
+    def __init__(self, dirname='data/analysis', av_list=None, readonly=False):
+        self.dirname = dirname
+        self.readonly = readonly    # Readers don't repair, a writer may be in the middle of a flush
+        self.avs = []
+        self.codes = {'': 0}    # 'detected;result' -> code
+        self.rows = 0
+        self.pending = []       # Rows waiting for flush()
+        os.makedirs(dirname, exist_ok=True)
+        self.load()
+
+        for av in (av_list or []):
+            self.add_av(av)
+        return
+
+    def path(self, name):
+        return os.path.join(self.dirname, name)
+
+    def column(self, index):
+        return self.path("av-{}.bin".format(index))
+
+    def load(self):
+        try:
+            with open(self.path('meta.json'), 'r') as f:
+                meta = json.load(f)
+            self.avs = meta['avs']
+            self.codes = meta['codes']
+            self.rows = meta['rows']
+        except FileNotFoundError:
+            pass
+        if not (self.readonly):
+            self.repair()
+        return
+
+    def truncate(self, filename, size):
+        try:
+            if (os.path.getsize(filename) > size):
+                logging.warning("{} has rows past meta.json. Truncating it.".format(filename))
+                with open(filename, 'r+b') as f:
+                    f.truncate(size)
+            elif (os.path.getsize(filename) < size):
+                logging.warning("{} is missing rows.".format(filename))
+        except FileNotFoundError:
+            pass
+        return
+
+    def domains_size(self):
+        '''
+            Bytes taken by the first self.rows lines of domains.txt.
+        '''
+        size = 0
+        try:
+            with open(self.path('domains.txt'), 'rb') as f:
+                for i, line in enumerate(f):
+                    if (i >= self.rows):
+                        break
+                    size += len(line)
+        except FileNotFoundError:
+            pass
+        return size
+
+    def repair(self):
+        '''
+            Cuts every file back to the rows meta.json counts,
+            and drops the columns of AVs it doesn't know.
+        '''
+        self.truncate(self.path('domains.txt'), self.domains_size())
+        self.truncate(self.path('timestamps.bin'), self.rows * 8)
+        for i in range(0, len(self.avs)):
+            self.truncate(self.column(i), self.rows)
+
+        i = len(self.avs)
+        while (os.path.exists(self.column(i))):
+            os.remove(self.column(i))
+            i += 1
+        return
+
+    def save(self):
+        temp_filename = self.path('meta.json.tmp')
+        with open(temp_filename, 'w') as f:
+            json.dump({'avs': self.avs, 'codes': self.codes, 'rows': self.rows}, f)
+        os.replace(temp_filename, self.path('meta.json'))
+        return
+
+    def add_av(self, av):
+        '''
+            A new AV gets a column of empty results for the scans before it.
+        '''
+        if (av in self.avs):
+            return
+        with open(self.column(len(self.avs)), 'ab') as f:
+            f.write(bytes(self.rows))
+        self.avs.append(av)
+        return
+
+    def code(self, av_result):
+        verdict = "{};{}".format(bool(av_result.get('detected')), av_result.get('result'))
+        if (verdict not in self.codes):
+            if (len(self.codes) > 255):
+                logging.debug("Verdict dictionary is full. Storing {} as empty.".format(verdict))
+                return 0
+            self.codes[verdict] = len(self.codes)
+        return self.codes[verdict]
+
+    def append(self, domain, timestamp, scans):
+        for av in scans:
+            self.add_av(av)
+        self.pending.append((domain, timestamp or 0.0, scans))
+        return
+
+    def flush(self):
+        if not (self.pending):
+            return
+
+        timestamps = array.array('d', [row[1] for row in self.pending])
+        with open(self.path('domains.txt'), 'a') as f:
+            f.write("".join(row[0] + "\n" for row in self.pending))
+        with open(self.path('timestamps.bin'), 'ab') as f:
+            timestamps.tofile(f)
+
+        for i in range(0, len(self.avs)):
+            av = self.avs[i]
+            column = bytes(self.code(row[2][av]) if (av in row[2]) else 0 for row in self.pending)
+            with open(self.column(i), 'ab') as f:
+                f.write(column)
+
+        self.rows += len(self.pending)
+        self.pending = []
+        self.save()
+        return
+
+
+class ColumnarStore:
+
+    def __init__(self, dirname='data/analysis'):
+        self.sink = ColumnarSink(dirname, readonly=True)
+        return
+
+    # Only the rows meta.json counts are read. Anything after them is a flush in progress.
+    def timestamps(self):
+        timestamps = array.array('d')
+        with open(self.sink.path('timestamps.bin'), 'rb') as f:
+            timestamps.frombytes(f.read(self.sink.rows * timestamps.itemsize))
+        return timestamps
+
+    def column(self, av):
+        with open(self.sink.column(self.sink.avs.index(av)), 'rb') as f:
+            return f.read(self.sink.rows)
+
+    def flagged_codes(self):
+        '''
+            Codes of the verdicts that aren't clean.
+        '''
+        flagged = []
+        for verdict, code in self.sink.codes.items():
+            detected, _, result = verdict.partition(';')
+            if (code) and ((detected == 'True') or (result not in CLEAN)):
+                flagged.append(code)
+        return flagged
+
+    def count_flagged(self, av, since=0, until=None):
+        '''
+            Number of scans av flagged between since and until.
+            Scans are appended in time order, so the range is found with a bisect
+            and counted inside the column bytes.
+        '''
+        timestamps = self.timestamps()
+        start = bisect.bisect_left(timestamps, since)
+        end = len(timestamps) if (until is None) else bisect.bisect_right(timestamps, until)
+        column = self.column(av)[start:end]
+        return sum(column.count(bytes([code])) for code in self.flagged_codes())
+
+    def domains_flagged(self, av, since=0, until=None):
+        timestamps = self.timestamps()
+        start = bisect.bisect_left(timestamps, since)
+        end = len(timestamps) if (until is None) else bisect.bisect_right(timestamps, until)
+        column = self.column(av)
+        flagged = set(self.flagged_codes())
+
+        with open(self.sink.path('domains.txt'), 'r') as f:
+            domains = f.read().splitlines()
+        return set(domains[i] for i in range(start, end) if column[i] in flagged)
+
+
+def import_csv(sink, analysis_file, av_list):
+    '''
+        Appends every row of a Full-Analysis.csv to an empty sink.
+        Returns the number of rows, or None if the sink already had some,
+        since older scans after newer ones would break the time order.
+    '''
+    if (sink.rows) or (sink.pending):
+        logging.warning("{} already has {} scans. Not converting {}.".format(sink.dirname, sink.rows, analysis_file))
+        return
+
+    for domain, timestamp, scans in analysis.read_rows(analysis_file, av_list):
+        sink.append(domain, timestamp, scans)
+        if (len(sink.pending) >= 10000):
+            sink.flush()
+    sink.flush()
+    return sink.rows
+
+def convert(analysis_file, dirname, av_list):
+    '''
+        Converts a Full-Analysis.csv.
+    '''
+    return import_csv(ColumnarSink(dirname, av_list), analysis_file, av_list)
+
+
+def main():
+    if (len(sys.argv) > 1) and (sys.argv[1] == 'convert'):
+        av_list = open('config/VT-AVs', 'r').read().splitlines()
+        rows = convert('data/Full-Analysis.csv', 'data/analysis', av_list)
+        if (rows is None):
+            print("data/analysis already has scans. Remove it to convert again.")
+        else:
+            print("{} scans in data/analysis".format(rows))
+
+    elif (len(sys.argv) > 3) and (sys.argv[1] == 'count'):
+        since = time.time() - float(sys.argv[3]) * 86400
+        start = time.time()
+        count = ColumnarStore().count_flagged(sys.argv[2], since)
+        print("{} flagged {} scans. ({:.1f}ms)".format(sys.argv[2], count, (time.time() - start) * 1000))
+
+    else:
+        print("Usage: python3 columnar.py convert | count <AV> <days>")
+    return
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+#
+# domainindex.py
+# Keeps track of every domain that has already been processed or blacklisted.
+# 1. Loads GlobalBlacklist.txt and Processed_file.txt once.
+# 2. Only reads the new lines of those files on every refresh.
+# 3. Answers "seen before?" with a set lookup.
+# 4. Rewrites Potentials.txt in a single pass.
+import logging, os
+
+class DomainIndex:
+
+    def __init__(self, files):
+        self.files = list(files)
+        self.seen = set()
+        self.offsets = {}   # filename -> (inode, offset of the last full line read)
+        self.refresh()
+        return
+
+    def __contains__(self, domain):
+        return domain in self.seen
+
+    def __len__(self):
+        return len(self.seen)
+
+    def add(self, domain):
+        '''
+            Adds a domain as soon as its verdict is written,
+            so the index doesn't wait for the next refresh.
+        '''
+        domain = domain.strip()
+        if (domain):
+            self.seen.add(domain)
+        return
+
+    def refresh(self):
+        '''
+            Reads whatever was appended to the files since the last refresh.
+        '''
+        for filename in self.files:
+            self.load(filename)
+        return
+
+    def load(self, filename):
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            return
+
+        inode, offset = self.offsets.get(filename, (None, 0))
+
+        # The file was replaced or shrunk (ex. dedupe), read it from the top.
+        if (inode != stat.st_ino) or (stat.st_size < offset):
+            offset = 0
+
+        with open(filename, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                # Partial line still being written, pick it up next time.
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                domain = line.decode('utf-8', 'replace').strip()
+                if (domain):
+                    self.seen.add(domain)
+
+        self.offsets[filename] = (stat.st_ino, offset)
+        return
+
+    def filter_file(self, filename):
+        '''
+            Removes every domain already in the index from filename.
+            Streams the file once and replaces it through a temp file.
+            Returns (kept, removed).
+        '''
+        kept = 0
+        removed = 0
+        temp_filename = filename + ".tmp"
+
+        try:
+            with open(filename, 'r') as infile, open(temp_filename, 'w') as outfile:
+                for line in infile:
+                    domain = line.strip()
+                    if not (domain):
+                        continue
+                    if (domain in self.seen):
+                        removed += 1
+                        continue
+                    outfile.write(domain + "\n")
+                    kept += 1
+
+        except FileNotFoundError:
+            logging.info("{} not found. Nothing to filter.".format(filename))
+            return (0, 0)
+
+        os.replace(temp_filename, filename)
+        return (kept, removed)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+#
+# feeds.py
+# Registry of feed parsers used by Mallector.
+# Every line of config/malware-feeds is a feed url, optionally followed by its type:
+#
+#   http://malc0de.com/rss/
+#   https://urlhaus.abuse.ch/downloads/csv_recent/ csv:2
+#   https://openphish.com/feed.txt urls
+#   https://example.com/hosts.txt hosts
+#
+# Feeds without a type use DEFAULT_TYPES, or 'rss-title' when they aren't listed there.
+# 'rss' parsers are given the feed parsed by feedparser, 'text' parsers are given the
+# body of the response. Every parser yields the raw domain strings of a feed, which
+# Mallector.find_domain() then splits into domain and domain/file.
+import csv, logging, re
+
+# Precompiled once, used for every item.
+MALC0DE_URL = re.compile(r'URL: ([^,\s]+)')
+MDL_HOST = re.compile(r'Host: ([^,\s]+)')
+HOSTS_LINE = re.compile(r'^(?:\d{1,3}(?:\.\d{1,3}){3}\s+|::1?\s+)?(\S+)')
+
+DEFAULT_TYPES = {
+    'http://malc0de.com/rss/': 'malc0de',
+    'https://cybercrime-tracker.net/rss.xml': 'rss-title',
+    'http://www.malwaredomainlist.com/hostslist/mdl.xml': 'mdl',
+}
+
+PARSERS = {}
+
+class FeedParser:
+
+    def __init__(self, name, kind, function):
+        self.name = name
+        self.kind = kind            # 'rss' or 'text'
+        self.function = function
+        return
+
+    def parse(self, payload, argument=None):
+        if (argument is None):
+            return self.function(payload)
+        return self.function(payload, argument)
+
+
+def register(name, kind):
+    '''
+        Adds a parser to the registry.
+    '''
+    def decorator(function):
+        PARSERS[name] = FeedParser(name, kind, function)
+        return function
+    return decorator
+
+
+def feed_entry(line):
+    '''
+        Given a line of config/malware-feeds, returns (url, type, argument).
+        'csv:2' is the csv type with argument '2'.
+    '''
+    fields = line.split()
+    url = fields[0]
+    feed_type = fields[1] if (len(fields) > 1) else DEFAULT_TYPES.get(url, 'rss-title')
+    argument = None
+
+    if (':' in feed_type):
+        feed_type, argument = feed_type.split(':', 1)
+    return (url, feed_type, argument)
+
+
+def parser_for(feed_type):
+    try:
+        return PARSERS[feed_type]
+    except KeyError:
+        logging.debug("No parser for feed type {}".format(feed_type))
+        return
+
+
+@register('malc0de', 'rss')
+def malc0de(feed):
+    '''
+        'URL: evil.com/x.exe, IP Address: 1.2.3.4, Country: ...'
+    '''
+    for item in feed['items']:
+        match = MALC0DE_URL.search(item['summary_detail']['value'])
+        if (match):
+            yield match.group(1)
+
+
+@register('rss-title', 'rss')
+def rss_title(feed):
+    '''
+        The title of every item is the uri. ex. cybercrime-tracker.net
+    '''
+    for item in feed['items']:
+        yield item['title']
+
+
+@register('mdl', 'rss')
+def mdl(feed):
+    '''
+        'Host: evil.com/x.php, IP address: 1.2.3.4, ...'
+        Falls back on the title. 'evil.com (2017/12/04_18:50)'
+    '''
+    for item in feed['items']:
+        match = MDL_HOST.search(item.get('description', ''))
+        if (match):
+            yield match.group(1)
+        elif (item.get('title')):
+            yield item['title'].split()[0]
+
+
+@register('hosts', 'text')
+def hosts(text):
+    '''
+        Hosts file. '127.0.0.1 evil.com' or just 'evil.com'
+    '''
+    for line in text.splitlines():
+        if not (line.strip()) or (line.lstrip().startswith('#')):
+            continue
+        match = HOSTS_LINE.match(line.strip())
+        if (match) and (match.group(1) != 'localhost'):
+            yield match.group(1)
+
+
+@register('urls', 'text')
+def urls(text):
+    '''
+        One url per line. ex. OpenPhish
+    '''
+    for line in text.splitlines():
+        line = line.strip()
+        if (line) and not (line.startswith('#')):
+            yield line
+
+
+@register('csv', 'text')
+def csv_column(text, column='2'):
+    '''
+        One column of a csv dump. ex. URLhaus, where the url is column 2.
+    '''
+    column = int(column)
+    lines = (line for line in text.splitlines() if (line.strip()) and not (line.startswith('#')))
+    for fields in csv.reader(lines):
+        if (column < len(fields)):
+            yield fields[column]
@@ -1,21 +1,158 @@
 #!/usr/bin/env python3
-import requests, sys
-
-base = "https://extreme-ip-lookup.com/csv/"
-
-filename = sys.argv[2]
-
-all_ips = open(filename, "r").read().split()
-
-csv = ""
-x = 0
-for ip in all_ips:
-    url = base + ip
-    r = requests.get(url)
-    csv += r.text + "\n"
-    print("{}/{}: {}\n{}\n\n".format(x, len(all_ips), ip, r.text))
-    x += 1
-    if (x % 100):
-        with open("Full_57.csv", "a") as f:
-            f.write(csv)
-        csv = ""
\ No newline at end of file
+#
+# gip.py
+# Geolocation/ASN of a list of IPs, from extreme-ip-lookup.
+# 1. Lookups run on a bounded pool of workers sharing one keep-alive session.
+# 2. Answers are cached in data/ip-cache.json for 30 days, so a rerun only looks up new IPs.
+# 3. An IP listed more than once is looked up once.
+#    With --collapse-24, a single IP is looked up per IPv4 /24 and its answer used
+#    for its neighbours. Only use it when the provider's data is per /24 anyway.
+# 4. Rows are written in input order, batch_size at a time.
+#
+# Usage: python3 gip.py <file of IPs> [output csv] [--collapse-24]
+import ipaddress, json, logging, os, sys, time, transport
+from concurrent.futures import ThreadPoolExecutor
+
+BASE = "https://extreme-ip-lookup.com/csv/"
+DAY = 86400
+
+class IpCache:
+
+    def __init__(self, filename='data/ip-cache.json', ttl=30*DAY):
+        self.filename = filename
+        self.ttl = ttl
+        self.entries = {}       # key -> {'ip': ip that was looked up, 'row': text, 'expires': time}
+        self.hits = 0
+        self.misses = 0
+        self.load()
+        return
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logging.debug("{} is corrupt. Starting with an empty cache.".format(self.filename))
+        return
+
+    def save(self):
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(temp_filename, self.filename)
+        return
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if (entry is None) or (time.time() > entry['expires']):
+            self.misses += 1
+            return
+        self.hits += 1
+        return entry
+
+    def put(self, key, ip, row):
+        self.entries[key] = {'ip': ip, 'row': row, 'expires': time.time() + self.ttl}
+        return
+
+
+class GeoIP:
+
+    def __init__(self, output='Full_57.csv', workers=8, batch_size=100, collapse=False, base=BASE):
+        self.output = output
+        self.workers = workers
+        self.batch_size = batch_size
+        self.collapse = collapse
+        self.base = base
+        self.http = transport.Transport(pool_size=workers)
+        self.cache = IpCache()
+        self.lookups = 0
+        return
+
+    def key(self, ip):
+        '''
+            The cache entry an IP is answered from: itself, or its /24 with --collapse-24.
+            None if it isn't an IP.
+        '''
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return
+
+        if (self.collapse) and (address.version == 4):
+            return str(ipaddress.ip_network(ip + "/24", strict=False))
+        return str(address)
+
+    def lookup(self, key, ip):
+        '''
+            Returns the provider's row for ip, or None if the lookup failed.
+        '''
+        try:
+            r = self.http.get(self.base + ip)
+        except:
+            logging.exception("message")
+            return
+
+        if (r.status_code != 200):
+            logging.debug("{} returned {}".format(ip, r.status_code))
+            return
+        return r.text.strip()
+
+    def row(self, ip, entry):
+        # A neighbour's answer, given as this IP's.
+        if (entry['ip'] != ip):
+            return entry['row'].replace(entry['ip'], ip)
+        return entry['row']
+
+    def enrich(self, ips):
+        '''
+            Writes a row per IP to the output csv, in the order of ips.
+        '''
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for i in range(0, len(ips), self.batch_size):
+                batch = ips[i:i + self.batch_size]
+
+                # Only one lookup per key, whether it's a duplicate or a neighbour.
+                missing = {}
+                for ip in batch:
+                    key = self.key(ip)
+                    if (key is None):
+                        logging.debug("Not an IP: {}".format(ip))
+                    elif (key not in missing) and (self.cache.get(key) is None):
+                        missing[key] = ip
+
+                for (key, ip), row in zip(missing.items(), pool.map(lambda item: self.lookup(*item), missing.items())):
+                    self.lookups += 1
+                    if (row):
+                        self.cache.put(key, ip, row)
+
+                rows = []
+                for ip in batch:
+                    entry = self.cache.entries.get(self.key(ip) or '')
+                    if (entry):
+                        rows.append(self.row(ip, entry) + "\n")
+
+                with open(self.output, "a") as f:
+                    f.write("".join(rows))
+                self.cache.save()
+                print("{}/{}".format(min(i + self.batch_size, len(ips)), len(ips)))
+
+        logging.info("{} IPs, {} lookups, cache {} hits {} misses".format(len(ips), self.lookups, self.cache.hits, self.cache.misses))
+        return
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if not (args):
+        print("Usage: python3 gip.py <file of IPs> [output csv] [--collapse-24]")
+        return
+
+    all_ips = open(args[0], "r").read().split()
+    output = args[1] if (len(args) > 1) else "Full_57.csv"
+
+    GeoIP(output, collapse='--collapse-24' in sys.argv).enrich(all_ips)
+    return
+
+if __name__ == "__main__":
+    main()
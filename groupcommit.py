@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+#
+# groupcommit.py
+# Buffered, append only writer for the output files.
+# Every verdict used to reopen its file, write one line and fsync it.
+# GroupCommitWriter keeps the lines in memory and writes them with a single
+# fsync every max_records lines or max_ms milliseconds, whichever comes first.
+#
+# Before a batch is written, its offset and length go to a marker file (filename.wal).
+# The marker is removed once the batch is on disk. If the program dies in between,
+# the next open finds the marker and truncates the half written batch, so a crash
+# loses at most one batch and never writes one twice.
+#
+# dedupe replaces a file with a new one. A writer that notices its file was
+# replaced reopens it by name, so later batches don't go to the unlinked one.
+import logging, os, threading
+
+class GroupCommitWriter:
+
+    def __init__(self, filename, max_records=50, max_ms=1000):
+        # Reopened by name, so a change of working directory mustn't change the file.
+        self.filename = os.path.abspath(filename)
+        self.marker = self.filename + ".wal"
+        self.max_records = max_records
+        self.max_ms = max_ms
+        self.buffer = []
+        self.lock = threading.RLock()
+        self.timer = None
+        self.commits = 0
+        self.records = 0
+        self.recover()
+        self.file = None
+        self.open()
+        return
+
+    def open(self):
+        if (self.file is not None):
+            self.file.close()
+        self.file = open(self.filename, 'ab')
+        self.needs_newline = self.ends_mid_line()
+        return
+
+    def replaced(self):
+        '''
+            True if the file was replaced or removed since it was opened.
+        '''
+        try:
+            return os.stat(self.filename).st_ino != os.fstat(self.file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def ends_mid_line(self):
+        '''
+            Files saved from a spreadsheet may not end with a newline.
+            Appending to them would glue the first line onto their last one.
+        '''
+        try:
+            with open(self.filename, 'rb') as f:
+                if (f.seek(0, os.SEEK_END) == 0):
+                    return False
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) != b"\n"
+        except OSError:
+            return False
+
+    def recover(self):
+        '''
+            Drops the batch a crash left half written.
+        '''
+        try:
+            with open(self.marker, 'r') as f:
+                offset, length = [int(field) for field in f.read().split()]
+        except FileNotFoundError:
+            return
+        except ValueError:
+            # The marker itself wasn't finished, so the batch was never started.
+            os.remove(self.marker)
+            return
+
+        size = os.path.getsize(self.filename) if (os.path.exists(self.filename)) else 0
+        if (size != offset + length):
+            logging.warning("Dropping a partial batch of {} bytes from {}".format(size - offset, self.filename))
+            with open(self.filename, 'ab') as f:
+                f.truncate(min(size, offset))
+                f.flush()
+                os.fsync(f.fileno())
+        os.remove(self.marker)
+        return
+
+    def write(self, line):
+        with self.lock:
+            self.buffer.append(line)
+
+            if (len(self.buffer) >= self.max_records):
+                self.commit()
+
+            # Makes sure a lone record doesn't wait on the next write.
+            elif (self.timer is None):
+                self.timer = threading.Timer(self.max_ms / 1000.0, self.commit)
+                self.timer.daemon = True
+                self.timer.start()
+        return
+
+    def commit(self):
+        with self.lock:
+            if (self.timer is not None):
+                self.timer.cancel()
+                self.timer = None
+
+            if not (self.buffer):
+                return
+
+            if (self.replaced()):
+                logging.info("{} was replaced. Reopening it.".format(self.filename))
+                self.open()
+
+            data = "".join(self.buffer).encode('utf-8')
+            if (self.needs_newline):
+                data = b"\n" + data
+                self.needs_newline = False
+            offset = self.file.seek(0, os.SEEK_END)
+
+            with open(self.marker, 'w') as marker:
+                marker.write("{} {}".format(offset, len(data)))
+                marker.flush()
+                os.fsync(marker.fileno())
+
+            self.file.write(data)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            os.remove(self.marker)
+
+            self.commits += 1
+            self.records += len(self.buffer)
+            self.buffer = []
+        return
+
+    def flush(self):
+        self.commit()
+        return
+
+    def close(self):
+        self.commit()
+        self.file.close()
+        return
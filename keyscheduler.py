@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+#
+# keyscheduler.py
+# Hands out API keys so the whole keyring is used at its combined rate.
+#
+# Privileges	public key
+# Request rate	4 requests/minute
+# Daily quota	5760 requests/day
+#
+# Privileges	paid key
+# Request rate	25 requests/minute
+# Daily quota	36,000 requests/day
+#
+# Every key gets its own token bucket that refills at its per-minute rate,
+# plus a daily quota. acquire() returns the key with the earliest available
+# token and only waits when every key in the keyring is spent.
+import logging, threading, time, datetime
+
+PUBLIC = (4, 5760)
+PREMIUM = (25, 36000)
+
+class TokenBucket:
+
+    def __init__(self, key, rate, daily):
+        self.key = key
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.refill_rate = rate / 60.0     # Tokens per second
+        self.updated = time.monotonic()
+        self.daily = daily
+        self.day = datetime.datetime.utcnow().date()
+        self.day_used = 0
+        # Counters
+        self.used = 0
+        self.waits = 0
+        self.no_content = 0     # Number of 204s VT returned for this key
+        return
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+        today = datetime.datetime.utcnow().date()
+        if (today != self.day):
+            self.day = today
+            self.day_used = 0
+        return
+
+    def available_in(self, now):
+        '''
+            Seconds until this key can send another request.
+        '''
+        self.refill(now)
+
+        if (self.day_used >= self.daily):
+            tomorrow = datetime.datetime.combine(self.day + datetime.timedelta(days=1), datetime.time())
+            return (tomorrow - datetime.datetime.utcnow()).total_seconds()
+
+        if (self.tokens >= 1):
+            return 0
+        return (1 - self.tokens) / self.refill_rate
+
+    def take(self):
+        self.tokens -= 1
+        self.day_used += 1
+        self.used += 1
+        return
+
+    def drain(self):
+        '''
+            VT says this key is out of requests (204), so trust VT over our count.
+        '''
+        self.tokens = min(self.tokens, 0)
+        self.no_content += 1
+        return
+
+
+class KeyScheduler:
+
+    def __init__(self, keys, premium=False):
+        rate, daily = PREMIUM if premium else PUBLIC
+        self.buckets = [TokenBucket(key, rate, daily) for key in keys]
+        self.lock = threading.Lock()
+        return
+
+    def capacity(self):
+        '''
+            Number of requests the whole keyring can send per minute.
+        '''
+        return sum(bucket.capacity for bucket in self.buckets)
+
+    def acquire(self):
+        '''
+            Returns the key with the earliest available token.
+            Only sleeps when every key is spent.
+        '''
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                bucket = min(self.buckets, key=lambda b: b.available_in(now))
+                wait = bucket.available_in(now)
+
+                if (wait <= 0):
+                    bucket.take()
+                    return bucket.key
+
+                bucket.waits += 1
+
+            logging.debug("Keyring exhausted. Waiting {:.1f}s".format(wait))
+            time.sleep(wait)
+
+    def throttled(self, key):
+        with self.lock:
+            for bucket in self.buckets:
+                if (bucket.key == key):
+                    bucket.drain()
+        return
+
+    def stats(self):
+        '''
+            Counters per key. Keys are shortened so they can be logged.
+        '''
+        with self.lock:
+            return {str(bucket.key)[:8]: {'used': bucket.used, 'waits': bucket.waits, '204': bucket.no_content, 'today': bucket.day_used} for bucket in self.buckets}
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+#
+# multipart.py
+# multipart/form-data body that is read from disk while it is being sent.
+# requests.post(files=...) builds the whole body in memory first, so a 200MB
+# sample cost 200MB of RAM, and the handle passed to it was never closed.
+# MultipartFile is iterated chunk by chunk, so memory stays at one chunk
+# whatever the size of the sample. It has a length, so requests sends a
+# Content-Length instead of a chunked body.
+#
+# Usage:
+#   with MultipartFile('file', 'sample.exe', '/malware/sample.exe') as body:
+#       http.post(url, data=body, headers={'Content-Type': body.content_type})
+import os, time, uuid
+
+CHUNK_SIZE = 1024 * 1024
+
+def quote(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+class MultipartFile:
+
+    def __init__(self, field, filename, path, fields=None, chunk_size=CHUNK_SIZE, progress=None, interval=1.0):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(self.boundary)
+        self.path = path
+        self.chunk_size = chunk_size
+        self.progress = progress    # progress(sent, total, seconds)
+        self.interval = interval
+        self.file = None
+        self.size = os.path.getsize(path)
+
+        head = ""
+        for name, value in (fields or {}).items():
+            head += '--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n{}\r\n'.format(self.boundary, quote(name), value)
+        head += '--{}\r\nContent-Disposition: form-data; name="{}"; filename="{}"\r\n'.format(self.boundary, quote(field), quote(filename))
+        head += 'Content-Type: application/octet-stream\r\n\r\n'
+
+        self.head = head.encode('utf-8')
+        self.tail = '\r\n--{}--\r\n'.format(self.boundary).encode('utf-8')
+        return
+
+    def __len__(self):
+        return len(self.head) + self.size + len(self.tail)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return
+
+    def close(self):
+        if (self.file is not None):
+            self.file.close()
+            self.file = None
+        return
+
+    def __iter__(self):
+        total = len(self)
+        start = time.monotonic()
+        reported = start
+        sent = len(self.head)
+        yield self.head
+
+        self.file = open(self.path, 'rb')
+        try:
+            chunk = self.file.read(self.chunk_size)
+            while (chunk):
+                yield chunk
+                sent += len(chunk)
+
+                now = time.monotonic()
+                if (self.progress) and (now - reported >= self.interval):
+                    self.progress(sent, total, now - start)
+                    reported = now
+                chunk = self.file.read(self.chunk_size)
+        finally:
+            self.close()
+
+        yield self.tail
+        if (self.progress):
+            self.progress(total, total, time.monotonic() - start)
+        return
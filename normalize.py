@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+#
+# normalize.py
+# One place that turns the strings feeds give us into hosts and domains.
+# VirusTotal.domain_clean(), Mallector.find_domain(), the verdict cache and
+# the shard slots all go through it.
+# 1. Patterns are compiled once. Nothing goes through urlparse.
+# 2. Hosts are lowercased, IDNA encoded (punycode) and stripped of a trailing dot.
+#    IPv4 and IPv6 addresses, bracketed or not, are written the same way every time.
+# 3. Ports are kept apart from the host. 'http://' is a scheme, not a port.
+# 4. registered_domain() is the public suffix + 1 label. Suffixes come from
+#    config/public_suffix_list.dat (https://publicsuffix.org/list/) when it is there,
+#    otherwise from the short list in SUFFIXES.
+# 5. Results are memoized in a bounded LRU. The *_batch functions parse each
+#    distinct string once however many times it is listed.
+import functools, ipaddress, logging, re
+
+SCHEME = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.-]*://')
+AUTHORITY = re.compile(r'^(?:[^@/?#]*@)?(\[[0-9a-fA-F:.]+\]|[^/?#:]*)(?::(\d*))?([/?#].*)?$', re.S)
+HOSTNAME = re.compile(r'^[a-z0-9_-]+(?:\.[a-z0-9_-]+)*$')
+LOOKS_LIKE_IP = re.compile(r'^\[?(?:[0-9.]+|[0-9a-fA-F]*:[0-9a-fA-F:.]*)\]?$')
+CACHE_SIZE = 65536
+PUBLIC_SUFFIX_FILE = 'config/public_suffix_list.dat'
+
+# Multi label suffixes seen in the feeds, for when the full list isn't installed.
+SUFFIXES = '''
+co.uk org.uk ac.uk gov.uk ltd.uk plc.uk me.uk net.uk
+com.au net.au org.au edu.au gov.au co.nz net.nz org.nz
+com.br net.br org.br com.ar com.mx com.co com.pe com.ve com.uy com.ec com.bo com.py
+co.jp ne.jp or.jp ac.jp co.kr or.kr ac.kr com.cn net.cn org.cn gov.cn edu.cn
+com.hk com.tw com.sg com.my com.ph com.vn com.pk com.bd com.np com.lk
+co.in net.in org.in firm.in gen.in ind.in co.id or.id web.id ac.id ac.th co.th in.th
+com.tr net.tr org.tr gen.tr com.ua net.ua org.ua in.ua com.ru net.ru org.ru msk.ru spb.ru
+com.pl net.pl org.pl com.ng com.gh co.za org.za co.ke co.tz co.ug com.eg com.sa com.kw
+com.ge com.kz co.il org.il co.ir com.es com.pt com.gr com.cy co.hu co.at or.at
+'''.split()
+
+def load_suffixes(filename=PUBLIC_SUFFIX_FILE):
+    '''
+        Returns (rules, wildcards, exceptions) from a public_suffix_list.dat.
+    '''
+    rules, wildcards, exceptions = set(), set(), set()
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not (line.strip()) or (line.startswith('//')):
+                    continue
+                rule = line.split()[0]
+                kind = rules
+
+                if (rule.startswith('!')):
+                    kind, rule = exceptions, rule[1:]
+                elif (rule.startswith('*.')):
+                    kind, rule = wildcards, rule[2:]
+
+                try:
+                    kind.add(rule.encode('idna').decode('ascii'))
+                except UnicodeError:
+                    logging.debug("Skipping public suffix rule {}".format(rule))
+    except FileNotFoundError:
+        rules = set(SUFFIXES)
+    return (rules, wildcards, exceptions)
+
+RULES, WILDCARDS, EXCEPTIONS = load_suffixes()
+
+def ip_address(host):
+    '''
+        Returns the address written the standard way, or None if host isn't an IP.
+    '''
+    # Most hosts are names. Not raising a ValueError for each of them halves parse().
+    if not (LOOKS_LIKE_IP.match(host)):
+        return
+    try:
+        return str(ipaddress.ip_address(host.strip('[]')))
+    except ValueError:
+        return
+
+def encode_host(host):
+    host = host.strip().rstrip('.').lower()
+    if (HOSTNAME.match(host)):
+        return host
+    try:
+        return host.encode('idna').decode('ascii')
+    except UnicodeError:
+        # Labels idna won't take (too long, '_' and such) are kept as given.
+        return host
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def parse(string):
+    '''
+        'HTTP://User@Bücher.de:8080/a?b' -> ('xn--bcher-kva.de', '8080', '/a?b')
+        Returns (host, port, rest), or None if there is no host.
+        port and rest are '' when there aren't any.
+    '''
+    string = SCHEME.sub('', string.strip())
+    match = AUTHORITY.match(string)
+
+    # A bare IPv6 address has too many ':' for the host:port pattern.
+    if not (match):
+        address = ip_address(string.split('/')[0])
+        if (address is None):
+            return
+        rest = string[len(string.split('/')[0]):]
+        return (address, '', rest)
+
+    host, port, rest = match.group(1), match.group(2) or '', match.group(3) or ''
+    if not (host):
+        return
+
+    address = ip_address(host)
+    host = address if (address) else encode_host(host)
+    return (host, port, rest)
+
+def host(string):
+    '''
+        'http://www.Example.com:8080/file' -> 'www.example.com'
+    '''
+    parsed = parse(string)
+    if (parsed):
+        return parsed[0]
+    return
+
+def domain(string):
+    '''
+        The host, and its port when one is given. What goes to the blacklist.
+        'http://www.Example.com:8080/file' -> 'www.example.com:8080'
+    '''
+    parsed = parse(string)
+    if not (parsed):
+        return
+    if (parsed[1]):
+        if (':' in parsed[0]):
+            return "[{}]:{}".format(parsed[0], parsed[1])
+        return "{}:{}".format(parsed[0], parsed[1])
+    return parsed[0]
+
+def is_ip(string):
+    parsed = parse(string)
+    return bool(parsed) and (ip_address(parsed[0]) is not None)
+
+def public_suffix(hostname):
+    labels = hostname.split('.')
+    for i in range(0, len(labels)):
+        candidate = '.'.join(labels[i:])
+        if (candidate in EXCEPTIONS):
+            return '.'.join(labels[i + 1:])
+        if (candidate in RULES):
+            return candidate
+        if (i + 1 < len(labels)) and ('.'.join(labels[i + 1:]) in WILDCARDS):
+            return candidate
+    # Anything not on the list is a single label TLD.
+    return labels[-1]
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def registered_domain(string):
+    '''
+        'a.b.example.co.uk/x' -> 'example.co.uk'. IPs are returned as they are.
+    '''
+    hostname = host(string)
+    if not (hostname) or (ip_address(hostname)):
+        return hostname
+
+    suffix = public_suffix(hostname)
+    if (hostname == suffix):
+        return hostname
+    label = hostname[:-len(suffix) - 1].rsplit('.', 1)[-1]
+    return label + '.' + suffix
+
+def key(url):
+    '''
+        'http://Example.com/' and 'example.com' are the same entry.
+        Hosts are IDNA encoded, the rest is lowercased like it always was.
+    '''
+    parsed = parse(url)
+    if not (parsed):
+        return SCHEME.sub('', url.strip()).rstrip('/').lower()
+    hostname, port, rest = parsed
+    if (port):
+        hostname = domain(url)
+    return (hostname + rest).rstrip('/').lower()
+
+def split_uri(string):
+    '''
+        Given a domain or domain/file, returns [domain] or [domain, domain/file].
+        The scheme is dropped, the file keeps its query.
+    '''
+    parsed = parse(string)
+    if not (parsed):
+        return []
+    name = domain(string)
+    rest = parsed[2]
+
+    # 'example.com/' is just the domain.
+    if (rest.strip('/') == ''):
+        return [name]
+    return [name, name + rest]
+
+def batch(function, strings):
+    '''
+        Applies function to every string, once per distinct string.
+    '''
+    results = dict((string, function(string)) for string in dict.fromkeys(strings))
+    return [results[string] for string in strings]
+
+def hosts_batch(strings):
+    return batch(host, strings)
+
+def domains_batch(strings):
+    return batch(domain, strings)
+
+def registered_domains_batch(strings):
+    return batch(registered_domain, strings)
+
+def keys_batch(strings):
+    return batch(key, strings)
+
+def cache_info():
+    return {'parse': parse.cache_info()._asdict(), 'registered_domain': registered_domain.cache_info()._asdict()}
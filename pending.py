@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+#
+# pending.py
+# Tracks the scans VT hasn't finished analysing yet.
+# Waiting on a report used to mean sleeping 60s and asking again, recursively,
+# so one slow analysis held up everything queued behind it.
+# PendingReports keeps every outstanding scan_id with the time it should next be
+# polled. Each poll() asks for all the due ones together, batch_size per report
+# call, and returns right away with whatever is ready. A report that isn't ready
+# waits twice as long before its next poll, up to max_interval, and is given up
+# on after max_polls.
+import heapq, logging, time
+
+class PendingReports:
+
+    def __init__(self, fetch, ready, batch_size=4, first_poll=15, max_interval=300, max_polls=20):
+        self.fetch = fetch      # list of scan_ids -> list of reports, in the same order
+        self.ready = ready      # report -> True once the analysis is complete
+        self.batch_size = batch_size
+        self.first_poll = first_poll
+        self.max_interval = max_interval
+        self.max_polls = max_polls
+        self.heap = []          # (next poll, scan_id)
+        self.items = {}         # scan_id -> [item, polls, interval]
+        self.expired = []       # items that were never ready
+        self.calls = 0
+        return
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, scan_id):
+        return scan_id in self.items
+
+    def waiting(self, items):
+        '''
+            True if any of items is still waiting on its report.
+        '''
+        return any(entry[0] in items for entry in self.items.values())
+
+    def add(self, scan_id, item, now=None):
+        '''
+            item is handed back with the report, usually the url that was scanned.
+        '''
+        if (scan_id in self.items):
+            return
+        now = time.time() if (now is None) else now
+        self.items[scan_id] = [item, 0, self.first_poll]
+        heapq.heappush(self.heap, (now + self.first_poll, scan_id))
+        return
+
+    def next_due(self, now=None):
+        '''
+            Seconds until the next poll is due. None if nothing is pending.
+        '''
+        if not (self.heap):
+            return
+        now = time.time() if (now is None) else now
+        return max(self.heap[0][0] - now, 0)
+
+    def due(self, now):
+        scan_ids = []
+        while (self.heap) and (self.heap[0][0] <= now):
+            scan_ids.append(heapq.heappop(self.heap)[1])
+        return scan_ids
+
+    def backoff(self, scan_id, now):
+        entry = self.items[scan_id]
+        entry[1] += 1
+
+        if (entry[1] >= self.max_polls):
+            logging.debug("Report never completed: {}".format(entry[0]))
+            self.expired.append(entry[0])
+            del self.items[scan_id]
+            return
+
+        entry[2] = min(entry[2] * 2, self.max_interval)
+        heapq.heappush(self.heap, (now + entry[2], scan_id))
+        return
+
+    def batches(self, now=None):
+        '''
+            Takes the scan_ids that are due, batch_size at a time.
+            Each batch has to be handed back to resolve() with its reports.
+        '''
+        now = time.time() if (now is None) else now
+        due = self.due(now)
+        return [due[i:i + self.batch_size] for i in range(0, len(due), self.batch_size)]
+
+    def resolve(self, batch, reports, now=None):
+        '''
+            Given a batch and its reports, in the same order, returns (item, report)
+            for the ones that are ready. The others wait longer for their next poll.
+        '''
+        now = time.time() if (now is None) else now
+        done = []
+        self.calls += 1
+
+        for j in range(0, len(batch)):
+            if (j < len(reports)) and (self.ready(reports[j])):
+                done.append((self.items.pop(batch[j])[0], reports[j]))
+            else:
+                self.backoff(batch[j], now)
+        return done
+
+    def poll(self, now=None):
+        '''
+            Never sleeps. Returns a list of (item, report) for the reports that are ready.
+        '''
+        now = time.time() if (now is None) else now
+        done = []
+
+        for batch in self.batches(now):
+            try:
+                reports = self.fetch(batch)
+            except:
+                logging.exception("message")
+                reports = []
+            done += self.resolve(batch, reports, now)
+        return done
+
+    def wait(self):
+        '''
+            Blocks until every scan_id is ready or given up on.
+            Returns a dict of item: report.
+        '''
+        results = {}
+        while (self.items):
+            time.sleep(self.next_due())
+            results.update(self.poll())
+        return results
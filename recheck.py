@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+#
+# recheck.py
+# Decides which processed domains are rechecked first.
+# reprocess() used to walk Processed_file.txt with a cursor that lived in memory.
+# Instead every processed domain keeps when it was first seen, when it was last
+# checked, how many AVs didn't call it clean and which feed it came from.
+# The domains most likely to flip to malicious are rechecked first, and the
+# queue is saved to disk so a restart doesn't lose it.
+import heapq, json, logging, math, os, time
+from verdictcache import cache_key
+
+DAY = 86400.0
+
+# How much each signal adds to a domain's priority.
+WEIGHTS = {
+    'staleness': 1.0,   # Per day since the last check
+    'non_clean': 2.0,   # Per AV that didn't call it clean
+    'freshness': 5.0,   # Young domains flip more often. Decays over a week.
+}
+
+# Some feeds have more domains that turn out malicious later on.
+FEED_WEIGHTS = {
+    'http://malc0de.com/rss/': 2.0,
+    'https://cybercrime-tracker.net/rss.xml': 3.0,
+    'http://www.malwaredomainlist.com/hostslist/mdl.xml': 1.0,
+}
+
+class RecheckQueue:
+
+    def __init__(self, filename='data/recheck-queue.json'):
+        self.filename = filename
+        self.entries = {}
+        self.requests = 0
+        self.flips = 0
+        self.load()
+        return
+
+    def __contains__(self, domain):
+        return cache_key(domain) in self.entries
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as f:
+                state = json.load(f)
+            self.entries = state['entries']
+            self.requests = state.get('requests', 0)
+            self.flips = state.get('flips', 0)
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError):
+            logging.debug("{} is corrupt. Starting with an empty queue.".format(self.filename))
+        return
+
+    def save(self):
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, 'w') as f:
+            json.dump({'entries': self.entries, 'requests': self.requests, 'flips': self.flips}, f)
+        os.replace(temp_filename, self.filename)
+        return
+
+    def add(self, domain, feed=None, non_clean=0, now=None):
+        key = cache_key(domain)
+        if (key in self.entries):
+            return False
+
+        now = now or time.time()
+        self.entries[key] = {
+            'domain': domain,
+            'first_seen': now,
+            'last_checked': now,
+            'non_clean': non_clean,
+            'feed': feed,
+            'malicious': False,
+        }
+        return True
+
+    def sync(self, processed_list):
+        '''
+            Adds every domain from Processed_file.txt that isn't queued yet.
+            Returns the keys that were added.
+        '''
+        added = set()
+        for domain in processed_list:
+            if (self.add(domain)):
+                added.add(cache_key(domain))
+        return added
+
+    def seed_from_analysis(self, analysis_file, keys):
+        '''
+            Counts the AVs that didn't call each of keys clean in its
+            latest Full-Analysis.csv row.
+        '''
+        if not (keys):
+            return
+
+        try:
+            with open(analysis_file, 'r') as f:
+                for line in f:
+                    cells = line.rstrip("\n").split(",")
+                    key = cache_key(cells[0])
+                    if (key not in keys):
+                        continue
+
+                    non_clean = 0
+                    for cell in cells[1:]:
+                        if (cell.startswith('True;')) or (cell.startswith('False;') and ('clean site' not in cell) and ('unrated site' not in cell)):
+                            non_clean += 1
+                    self.entries[key]['non_clean'] = non_clean
+
+        except FileNotFoundError:
+            pass
+        return
+
+    def seed_feeds(self, keys, lookup):
+        '''
+            lookup(domain) returns the feed a domain came from.
+        '''
+        for key in keys:
+            self.entries[key]['feed'] = lookup(self.entries[key]['domain'])
+        return
+
+    def seed_times(self, keys, lookup):
+        '''
+            lookup(domain) returns (first_seen, last_checked), or None.
+            Otherwise a domain added by sync() looks first seen and checked just now.
+        '''
+        for key in keys:
+            times = lookup(self.entries[key]['domain'])
+            if (times):
+                self.entries[key]['first_seen'], self.entries[key]['last_checked'] = times
+        return
+
+    def priority(self, entry, now):
+        '''
+            Bigger means recheck sooner.
+        '''
+        days_since_check = (now - entry['last_checked']) / DAY
+        age = (now - entry['first_seen']) / DAY
+
+        score = WEIGHTS['staleness'] * days_since_check
+        score += WEIGHTS['non_clean'] * entry['non_clean']
+        score += WEIGHTS['freshness'] * math.exp(-age / 7)
+        score += FEED_WEIGHTS.get(entry['feed'], 0)
+        return score
+
+    def ordered(self):
+        '''
+            Yields the domains that aren't blacklisted yet, highest priority first.
+        '''
+        now = time.time()
+        heap = [(-self.priority(entry, now), key) for key, entry in self.entries.items() if not entry['malicious']]
+        heapq.heapify(heap)
+
+        while (heap):
+            score, key = heapq.heappop(heap)
+            yield self.entries[key]['domain']
+
+    def non_clean(self, result):
+        count = 0
+        for av_result in result.get('scans', {}).values():
+            if (av_result.get('detected')) or (av_result.get('result') not in ('clean site', 'unrated site')):
+                count += 1
+        return count
+
+    def checked(self, domain, result, malicious):
+        '''
+            Records the outcome of a recheck.
+        '''
+        key = cache_key(domain)
+        self.add(domain)
+        entry = self.entries[key]
+        self.requests += 1
+
+        if (malicious) and not (entry['malicious']):
+            self.flips += 1
+            logging.info("{} flipped to malicious.".format(domain))
+
+        entry['last_checked'] = time.time()
+        entry['malicious'] = malicious
+        if (result):
+            entry['non_clean'] = self.non_clean(result)
+        return
+
+    def covered(self, domain, malicious):
+        '''
+            A url decided by the verdict on its host. See rollup.py
+            Only rechecked later on if its host was clean.
+        '''
+        key = cache_key(domain)
+        self.add(domain)
+        self.entries[key]['last_checked'] = time.time()
+        self.entries[key]['malicious'] = malicious
+        return
+
+    def stats(self):
+        rate = 0
+        if (self.requests):
+            rate = self.flips / self.requests
+        return {'queued': len(self.entries), 'requests': self.requests, 'flips': self.flips, 'flips_per_request': rate}
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+#
+# reportcache.py
+# On-disk cache of VT file reports, by sha256.
+# A sample's report doesn't change unless it is rescanned, so running upload.py
+# over the same malware directory again shouldn't spend any quota on it.
+# Only complete reports (response_code 1) are cached. Unknown samples are
+# looked up again next time.
+import json, logging, os
+
+class ReportCache:
+
+    def __init__(self, filename='data/file-report-cache.json'):
+        self.filename = filename
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.load()
+        return
+
+    def __contains__(self, sha256):
+        return sha256.lower() in self.entries
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logging.debug("{} is corrupt. Starting with an empty cache.".format(self.filename))
+        return
+
+    def save(self):
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(temp_filename, self.filename)
+        return
+
+    def get(self, sha256):
+        result = self.entries.get(sha256.lower())
+        if (result is None):
+            self.misses += 1
+            return
+        self.hits += 1
+        return result
+
+    def put(self, sha256, result):
+        if not (result) or (result.get('response_code') != 1) or ('scans' not in result):
+            return
+
+        # Only what csv_output() needs is kept.
+        self.entries[sha256.lower()] = {
+            'response_code': 1,
+            'md5': result.get('md5'),
+            'sha256': result.get('sha256', sha256),
+            'positives': result.get('positives'),
+            'scan_date': result.get('scan_date'),
+            'scans': result['scans'],
+        }
+        return
+
+    def stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# rollup.py
+# Potentials.txt has runs of urls on the same host, like
+#   004b0bdd1.c11.ixsecure.com/..., 004b0bdd1.c11.ixsecure.com/admin.php, ...
+# and Mallector.domain_splitter() queues the host and every host/path it saw.
+# Each of them used to cost its own scan.
+# Rollup groups the queue by host (or registered domain). The host of a group
+# is scanned first, and the policy in config/rollup decides from its verdict
+# whether the urls under it need scans of their own. A url whose host is
+# blacklisted is already covered by the blacklist entry of its host.
+import logging, normalize
+from collections import OrderedDict
+
+POLICY = {
+    'group': 'host',
+    'min_group': 2,
+    'malicious': 'skip',
+    'clean': 'scan',
+    'sample': 3,
+}
+
+class Rollup:
+
+    def __init__(self, policy_file='config/rollup'):
+        self.policy = dict(POLICY)
+        self.load(policy_file)
+        self.groups = 0         # Groups rolled up
+        self.heads = 0          # Hosts scanned that weren't queued themselves
+        self.scanned = 0        # Entries scanned after their host
+        self.saved = 0          # Entries their host's verdict covered
+        return
+
+    def load(self, policy_file):
+        '''
+            Lines are 'option<TAB>value'.
+        '''
+        try:
+            with open(policy_file, 'r') as f:
+                for line in f:
+                    if not (line.strip()) or (line.startswith('#')):
+                        continue
+                    fields = line.split()
+                    if (fields[0] not in POLICY) or (len(fields) < 2):
+                        logging.debug("Unknown rollup option: {}".format(line.strip()))
+                        continue
+                    self.policy[fields[0]] = int(fields[1]) if (type(POLICY[fields[0]]) == int) else fields[1]
+        except FileNotFoundError:
+            pass
+        return
+
+    def keys(self, entries):
+        if (self.policy['group'] == 'registered'):
+            return normalize.registered_domains_batch(entries)
+        return normalize.domains_batch(entries)
+
+    def plan(self, entries):
+        '''
+            Returns (first, children, aliases).
+            first: the entries to scan now, hosts of groups included.
+            children: {host: entries to decide once the host has a verdict}
+            aliases: {host: other spellings of the host that were queued}
+        '''
+        groups = OrderedDict()
+        first = []
+
+        for entry, key in zip(entries, self.keys(entries)):
+            if (key is None):
+                first.append(entry)
+                continue
+            groups.setdefault(key, []).append(entry)
+
+        children = {}
+        aliases = {}
+        for key, members in groups.items():
+            # The host itself may be queued too, as 'evil.com', 'EVIL.com' or 'evil.com/'.
+            spellings = [member for member in members if (normalize.key(member) == key)]
+            rest = [member for member in members if (normalize.key(member) != key)]
+
+            if (len(rest) < self.policy['min_group']):
+                first += members
+                continue
+
+            # The host is scanned as it was queued, so that entry leaves the queue.
+            self.groups += 1
+            if (spellings):
+                head = spellings[0]
+            else:
+                head = key
+                self.heads += 1
+
+            first.append(head)
+            children[head] = rest
+            if (spellings[1:]):
+                aliases[head] = spellings[1:]
+        return (first, children, aliases)
+
+    def decide(self, status, suspicious):
+        '''
+            Given the store status of a host and whether any AV flagged it,
+            returns 'scan', 'skip' or 'sample' for the entries under it.
+        '''
+        if (status == 'blacklisted'):
+            return self.policy['malicious']
+        if (status == 'processed') and not (suspicious):
+            return self.policy['clean']
+
+        # Flagged by some AVs, or no verdict at all.
+        return 'scan'
+
+    def split(self, members, decision):
+        '''
+            Returns (scan, covered).
+        '''
+        if (decision == 'skip'):
+            keep = 0
+        elif (decision == 'sample'):
+            keep = self.policy['sample']
+        else:
+            keep = len(members)
+
+        self.scanned += min(keep, len(members))
+        self.saved += max(len(members) - keep, 0)
+        return (members[:keep], members[keep:])
+
+    def stats(self):
+        return {'groups': self.groups, 'hosts_added': self.heads, 'scanned': self.scanned,
+            'saved': self.saved, 'net_saved': self.saved - self.heads}
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#
+# sampleindex.py
+# Persistent index of the samples in the malware directory.
+# Every file is kept with the mtime and size it had when it was hashed, and
+# its sha256. A pass over the directory only stats the files, so the daemon
+# (python3 upload.py watch) only hashes and submits files that are new or
+# changed, and a restart doesn't rehash thousands of samples it already knows.
+import json, logging, os, time
+
+class SampleIndex:
+
+    def __init__(self, filename='data/sample-index.json', settle=5):
+        self.filename = filename
+        self.settle = settle    # Files modified in the last few seconds may still be being written
+        self.entries = {}       # filename -> {'mtime': ns, 'size': bytes, 'sha256': hex}
+        self.load()
+        return
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logging.debug("{} is corrupt. Every sample will be hashed again.".format(self.filename))
+        return
+
+    def save(self):
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(temp_filename, self.filename)
+        return
+
+    def scan(self, directory):
+        '''
+            Stats every file in directory.
+            Returns {filename: (mtime, size)} for the ones that are new or changed.
+            Files that are gone are dropped from the index.
+        '''
+        changed = {}
+        present = set()
+        now = time.time_ns()
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not (entry.is_file()) or (entry.name.startswith('.')):
+                    continue
+                present.add(entry.name)
+                stat = entry.stat()
+
+                known = self.entries.get(entry.name)
+                if (known) and (known['mtime'] == stat.st_mtime_ns) and (known['size'] == stat.st_size):
+                    continue
+
+                # Picked up on the next pass, once it stops changing.
+                if (now - stat.st_mtime_ns < self.settle * 1e9):
+                    continue
+                changed[entry.name] = (stat.st_mtime_ns, stat.st_size)
+
+        for filename in set(self.entries) - present:
+            del self.entries[filename]
+        return changed
+
+    def record(self, filename, mtime, size, sha256):
+        self.entries[filename] = {'mtime': mtime, 'size': size, 'sha256': sha256}
+        return
+
+    def sha256(self, filename):
+        entry = self.entries.get(filename)
+        if (entry):
+            return entry['sha256']
+        return
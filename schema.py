@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+#
+# schema.py
+# Column layout of Full-Analysis.csv, built from config/VT-AVs.
+#
+# Schema 1 was a hardcoded header that didn't match config/VT-AVs, with empty
+# columns between the timestamp and the AVs. Schema 2 is
+#   Domain,Timestamp,Schema,<every AV in config/VT-AVs>
+# and every row carries its schema id (2:<hash of the AV list>) in the Schema column.
+# When the AV list changes, a new header row is written before the next row,
+# and analysis.read_rows() follows whichever header came last.
+#
+# Engines VT returns that aren't in config/VT-AVs aren't dropped. Their results
+# go to data/Unseen-AVs.csv (timestamp, domain, AV, cell).
+import csv, datetime, hashlib, json, logging
+
+SCHEMA_VERSION = 2
+LEADING = ['Domain', 'Timestamp', 'Schema']
+TIMESTAMP = '%Y-%m-%d %H:%M:%S'
+
+def quote(field):
+    if (',' in field) or ('"' in field) or ("\n" in field):
+        return '"' + field.replace('"', '""') + '"'
+    return field
+
+def cell(av_result):
+    '''
+        Given a single av_result by vt,
+        this will format an output.
+        ex. {'detected': False, 'result': 'clean site'}
+            'False;clean site'
+    '''
+    cell = "{};{}".format(av_result.get('detected'), av_result.get('result'))
+
+    # Sometimes there aren't details.
+    if (av_result.get('detail')):
+        cell += ";" + av_result['detail']
+    return cell
+
+class AnalysisSchema:
+
+    def __init__(self, av_list, schema_file='data/Full-Analysis.schema', unseen_file='data/Unseen-AVs.csv'):
+        self.columns = LEADING + list(av_list)
+        self.slots = dict((av, i) for i, av in enumerate(self.columns) if (i >= len(LEADING)))
+        digest = hashlib.sha1("\n".join(av_list).encode('utf-8')).hexdigest()[:8]
+        self.id = "{}:{}".format(SCHEMA_VERSION, digest)
+        self.schema_file = schema_file
+        self.unseen_file = unseen_file
+        self.unseen = set()
+        self.load_unseen()
+        return
+
+    def header(self):
+        return ",".join(quote(column) for column in self.columns) + "\n"
+
+    def current(self):
+        '''
+            True if the last header written to Full-Analysis.csv is this schema.
+        '''
+        try:
+            with open(self.schema_file, 'r') as f:
+                return json.load(f).get('id') == self.id
+        except (FileNotFoundError, ValueError):
+            return False
+
+    def save(self):
+        with open(self.schema_file, 'w') as f:
+            json.dump({'id': self.id, 'columns': self.columns}, f)
+        return
+
+    def load_unseen(self):
+        try:
+            with open(self.unseen_file, 'r', newline='') as f:
+                for fields in csv.reader(f):
+                    if (len(fields) > 2):
+                        self.unseen.add(fields[2])
+        except FileNotFoundError:
+            pass
+        return
+
+    def row(self, domain, ts, scans):
+        '''
+            Fills a row through the precomputed AV -> column mapping.
+            Returns (row, unseen rows).
+        '''
+        timestamp = datetime.datetime.fromtimestamp(ts).strftime(TIMESTAMP)
+        cells = [''] * len(self.columns)
+        cells[0] = quote(domain)
+        cells[1] = timestamp
+        cells[2] = self.id
+        unseen = []
+
+        for av, av_result in scans.items():
+            slot = self.slots.get(av)
+            if (slot is None):
+                if (av not in self.unseen):
+                    logging.info("VT returned an engine not in config/VT-AVs: {}".format(av))
+                    self.unseen.add(av)
+                unseen.append(",".join([timestamp, quote(domain), quote(av), quote(cell(av_result))]) + "\n")
+                continue
+            cells[slot] = quote(cell(av_result))
+
+        return (",".join(cells) + "\n", unseen)
+
+    def write_unseen(self, rows):
+        if not (rows):
+            return
+        with open(self.unseen_file, 'a') as f:
+            f.write("".join(rows))
+        return
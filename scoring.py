@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# scoring.py
+# Decides which domains are malicious from the consensus of the AVs on VT.
+# Every AV in config/VT-AVs gets a weight and a reliability from config/AV-weights.
+# A batch of 'scans' dicts becomes a verdict matrix (one row per domain, one
+# column per AV, 1 where the AV flagged it), and the whole batch is scored with
+# a single matrix product against weight * reliability.
+#
+# Usage: python3 scoring.py rescore
+#   Re-scores every scan in data/analysis with the current weights. No VT quota is spent.
+import columnar, logging, sys
+import numpy as np
+
+CLEAN = ('clean', 'unrated')
+
+class Scorer:
+
+    def __init__(self, av_list, weights_file='config/AV-weights'):
+        self.av_list = list(av_list)
+        self.slots = dict((av, i) for i, av in enumerate(self.av_list))
+        self.threshold = 1.0
+        self.weights = np.zeros(len(self.av_list))
+        self.load(weights_file)
+        return
+
+    def load(self, weights_file):
+        '''
+            Lines are 'AV<TAB>weight<TAB>reliability', plus one 'threshold<TAB>value'.
+        '''
+        try:
+            with open(weights_file, 'r') as f:
+                for line in f:
+                    if not (line.strip()) or (line.startswith('#')):
+                        continue
+                    fields = line.rstrip("\n").split("\t")
+
+                    if (fields[0] == 'threshold'):
+                        self.threshold = float(fields[1])
+                        continue
+
+                    if (fields[0] not in self.slots):
+                        logging.debug("{} is weighted but not in config/VT-AVs".format(fields[0]))
+                        continue
+
+                    reliability = float(fields[2]) if (len(fields) > 2) else 1.0
+                    self.weights[self.slots[fields[0]]] = float(fields[1]) * reliability
+
+        except FileNotFoundError:
+            logging.warning("{} not found. No AV has any weight.".format(weights_file))
+        return
+
+    def flagged(self, av_result):
+        result = str(av_result.get('result'))
+        for word in CLEAN:
+            if (word in result):
+                return False
+        return True
+
+    def matrix(self, scans_list):
+        '''
+            One row per scans dict, 1 where the AV flagged the domain.
+            Only AVs with a weight are looked at.
+        '''
+        matrix = np.zeros((len(scans_list), len(self.av_list)), dtype=np.int8)
+        weighted = [(self.av_list[i], i) for i in np.flatnonzero(self.weights)]
+
+        for row in range(0, len(scans_list)):
+            scans = scans_list[row] or {}
+            for av, slot in weighted:
+                if (av in scans) and (self.flagged(scans[av])):
+                    matrix[row, slot] = 1
+        return matrix
+
+    def score(self, matrix):
+        return matrix @ self.weights
+
+    def is_malicious_batch(self, results):
+        '''
+            Given a list of VT results, returns a list of True/False.
+            A result that is empty is never malicious.
+        '''
+        scans_list = [(result or {}).get('scans') for result in results]
+        verdicts = self.score(self.matrix(scans_list)) >= self.threshold
+        return [bool(verdicts[i]) and bool(scans_list[i]) for i in range(0, len(results))]
+
+    def rescore(self, store):
+        '''
+            Scores every scan in a columnar.ColumnarStore.
+            Returns the domains whose latest scan is malicious with the current weights.
+        '''
+        flagged_codes = np.zeros(256, dtype=np.int8)
+        for verdict, code in store.sink.codes.items():
+            detected, _, result = verdict.partition(';')
+            if (code) and not any(word in result for word in CLEAN):
+                flagged_codes[code] = 1
+
+        scores = np.zeros(store.sink.rows)
+        for i in np.flatnonzero(self.weights):
+            if (self.av_list[i] not in store.sink.avs):
+                continue
+            column = np.frombuffer(store.column(self.av_list[i]), dtype=np.uint8)
+            scores += flagged_codes[column] * self.weights[i]
+
+        with open(store.sink.path('domains.txt'), 'r') as f:
+            domains = f.read().splitlines()
+
+        # Later scans of the same domain overwrite earlier ones.
+        latest = dict(zip(domains, scores >= self.threshold))
+        return set(domain for domain, malicious in latest.items() if malicious)
+
+
+def main():
+    if (len(sys.argv) < 2) or (sys.argv[1] != 'rescore'):
+        print("Usage: python3 scoring.py rescore")
+        return
+
+    av_list = open('config/VT-AVs', 'r').read().splitlines()
+    malicious = Scorer(av_list).rescore(columnar.ColumnarStore())
+
+    with open('data/Rescored-Blacklist.txt', 'w') as f:
+        for domain in sorted(malicious):
+            f.write(domain + "\n")
+    print("{} domains are malicious with the current weights. Saved to data/Rescored-Blacklist.txt".format(len(malicious)))
+    return
+
+if __name__ == "__main__":
+    main()
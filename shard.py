@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+#
+# shard.py
+# Lets several processes, on one box or many, scan the pending queue without
+# scanning the same domain twice.
+#
+# Every domain falls in one of SLOTS slots, by hash of its cleaned domain.
+# The coordinator places the live workers on a consistent hash ring, and each
+# worker only leases pending domains from the slots it owns. When a worker
+# joins or leaves, only the slots next to it on the ring change hands.
+# Leases live in the store (see Store.lease) and expire after lease_seconds
+# unless the worker renews them. Workers renew on every pass of their loop,
+# whether or not they ask for work. A dead worker's domains go back to
+# pending and are leased by whoever owns their slots next.
+#
+# Workers only talk to VT. Their results go back to the coordinator, which
+# scores and records them, so the output files have a single writer.
+# Each worker has its own keyring.
+#
+# Usage: python3 shard.py coordinator [host:port] [no-update]
+#        python3 shard.py worker <host:port> <API key file> [premium]
+# The coordinator listens on 127.0.0.1:7700 by default. Give it 0.0.0.0:7700 for remote workers.
+import bisect, hashlib, json, logging, normalize, os, socket, socketserver, sys, threading, time
+
+SLOTS = 1024
+ADDRESS = ('127.0.0.1', 7700)
+
+def digest(string):
+    return int.from_bytes(hashlib.blake2b(string.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def clean(domain):
+    '''
+        'http://Example.com:8080/path' -> 'example.com'
+    '''
+    return normalize.host(domain) or domain
+
+def slot(domain):
+    return digest(clean(domain)) % SLOTS
+
+def address(string):
+    host, _, port = string.rpartition(':')
+    return (host or ADDRESS[0], int(port))
+
+class HashRing:
+
+    def __init__(self, nodes, replicas=64):
+        self.points = sorted((digest("{}#{}".format(node, i)), node) for node in nodes for i in range(0, replicas))
+        self.keys = [point for point, node in self.points]
+        return
+
+    def owner(self, slot):
+        if not (self.points):
+            return
+        i = bisect.bisect(self.keys, digest("slot:{}".format(slot))) % len(self.points)
+        return self.points[i][1]
+
+    def slots(self, node):
+        return [i for i in range(0, SLOTS) if (self.owner(i) == node)]
+
+
+class Coordinator:
+
+    def __init__(self, vt, lease_seconds=600):
+        self.vt = vt
+        self.store = vt.store
+        self.lease_seconds = lease_seconds
+        self.workers = {}       # worker -> last time it renewed its leases
+        self.rings = {}         # live workers -> their slots
+        self.lock = threading.Lock()
+        self.requeued = 0
+        self.recorded = 0
+        return
+
+    def live(self):
+        now = time.time()
+        return tuple(sorted(worker for worker, seen in self.workers.items() if (now - seen < self.lease_seconds)))
+
+    def slots(self, worker):
+        live = self.live()
+        if (live not in self.rings):
+            ring = HashRing(live)
+            self.rings = {live: dict((node, ring.slots(node)) for node in live)}
+            logging.info("Workers: {}".format(list(live)))
+        return self.rings[live].get(worker, [])
+
+    def renew(self, worker):
+        '''
+            Keeps the worker on the ring and its leases from expiring.
+            The caller holds self.lock.
+        '''
+        self.workers[worker] = time.time()
+        self.store.renew(worker, self.lease_seconds)
+        self.requeued += self.store.expire_leases()
+        return
+
+    def heartbeat(self, worker):
+        '''
+            A worker busy with the reports it already has, that isn't asking for work.
+        '''
+        with self.lock:
+            self.renew(worker)
+        return True
+
+    def lease(self, worker, count):
+        '''
+            Asking for work renews the leases the worker already holds.
+        '''
+        with self.lock:
+            self.renew(worker)
+            return self.store.lease(worker, self.slots(worker), count, self.lease_seconds)
+
+    def complete(self, worker, results, failed):
+        '''
+            Records the results a worker sends back.
+            failed domains are released so they can be leased again.
+        '''
+        with self.lock:
+            recorded = self.vt.record_batch([(domain, result) for domain, result in results])
+            self.recorded += len(recorded)
+            self.store.release([domain for domain, result in results] + list(failed))
+        return len(recorded)
+
+    def handle(self, message):
+        if (message.get('op') == 'lease'):
+            return {'domains': self.lease(message['worker'], message.get('count', 16))}
+        if (message.get('op') == 'renew'):
+            return {'renewed': self.heartbeat(message['worker'])}
+        if (message.get('op') == 'complete'):
+            return {'recorded': self.complete(message['worker'], message.get('results', []), message.get('failed', []))}
+        return {'error': 'unknown op'}
+
+    def serve(self, host_port=ADDRESS):
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        reply = coordinator.handle(json.loads(line))
+                    except:
+                        logging.exception("message")
+                        reply = {'error': 'failed'}
+                    self.wfile.write((json.dumps(reply) + "\n").encode('utf-8'))
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer(host_port, Handler)
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        return self.server.server_address
+
+    def run(self, host_port=ADDRESS, interval=3600):
+        '''
+            Serves workers, and collects new domains from the feeds every interval seconds.
+        '''
+        self.vt.open_outputs()
+        print("Coordinator listening on {}:{}".format(*self.serve(host_port)))
+
+        # Workers lease from the store. Potentials.txt is only cleared once per run.
+        self.vt.collector.already_processed()
+
+        while True:
+            with self.lock:
+                if (self.vt.update):
+                    self.vt.collector.update_feeds()
+                    self.vt.collector.collect(self.vt.potentials_file)
+                # Buffered verdicts go out before dedupe replaces the files. See groupcommit.py
+                self.vt.commit_outputs()
+                self.vt.collector.dedupe_all(force=True)
+
+            # Flushes what workers sent back and logs progress until the next collection.
+            for minute in range(0, max(interval // 60, 1)):
+                time.sleep(60)
+                with self.lock:
+                    self.vt.commit_outputs()
+                logging.info("Leases: {} Recorded: {} Requeued: {} Domains: {}".format(
+                    self.store.leases(), self.recorded, self.requeued, self.store.counts()))
+
+
+class CoordinatorClient:
+
+    def __init__(self, host_port):
+        self.host_port = host_port
+        self.sock = None
+        return
+
+    def call(self, **message):
+        '''
+            Sends one message and waits for the reply. Reconnects once if the connection dropped.
+        '''
+        for attempt in range(0, 2):
+            try:
+                if (self.sock is None):
+                    self.sock = socket.create_connection(self.host_port)
+                    self.file = self.sock.makefile('rwb')
+                self.file.write((json.dumps(message) + "\n").encode('utf-8'))
+                self.file.flush()
+                reply = self.file.readline()
+                if (reply):
+                    return json.loads(reply)
+            except OSError:
+                if (attempt == 1):
+                    raise
+            self.close()
+        raise ConnectionError("Coordinator closed the connection")
+
+    def close(self):
+        if (self.sock is not None):
+            self.sock.close()
+            self.sock = None
+        return
+
+
+class Worker:
+
+    def __init__(self, vt, client, lease_count=None, idle=30):
+        self.vt = vt
+        self.client = client
+        self.id = "{}-{}".format(socket.gethostname(), os.getpid())
+        self.lease_count = lease_count if (lease_count) else vt.batch_size() * 4
+        self.idle = idle
+        return
+
+    def submit(self, domains):
+        '''
+            Returns (results, failed). results are the invalid urls, with no result.
+            The rest wait in the report tracker.
+        '''
+        tracker = self.vt.report_tracker()
+        results = []
+        failed = []
+
+        for i in range(0, len(domains), self.vt.batch_size()):
+            batch = domains[i:i + self.vt.batch_size()]
+            scan_ids = self.vt.add_urls(batch)
+
+            for domain in batch:
+                if (domain not in scan_ids):
+                    failed.append(domain)
+                elif not (scan_ids[domain]):
+                    results.append((domain, None))
+                else:
+                    tracker.add(scan_ids[domain], domain)
+        return (results, failed)
+
+    def run(self):
+        tracker = self.vt.report_tracker()
+        print("Worker {} started.".format(self.id))
+
+        while True:
+            domains = []
+            # Leases aren't taken faster than reports come back.
+            # Reports can take over an hour, so the leases held are renewed meanwhile.
+            if (len(tracker) < self.lease_count):
+                domains = self.client.call(op='lease', worker=self.id, count=self.lease_count)['domains']
+            else:
+                self.client.call(op='renew', worker=self.id)
+
+            results, failed = self.submit(domains)
+            results += tracker.poll()
+
+            # Reports that never completed are handed back.
+            failed += tracker.expired
+            tracker.expired = []
+
+            if (results) or (failed):
+                self.client.call(op='complete', worker=self.id, results=results, failed=failed)
+
+            if not (domains):
+                wait = tracker.next_due()
+                time.sleep(self.idle if (wait is None) else min(wait, self.idle))
+
+
+def main():
+    if (len(sys.argv) < 2) or (sys.argv[1] not in ('coordinator', 'worker')) or ((sys.argv[1] == 'worker') and (len(sys.argv) < 4)):
+        print("Usage: python3 shard.py coordinator [host:port] [no-update]")
+        print("       python3 shard.py worker <host:port> <API key file> [premium]")
+        return
+
+    import vt
+    c = vt.VirusTotal()
+
+    if (sys.argv[1] == 'coordinator'):
+        c.update = 'no-update' not in sys.argv[2:]
+        host_port = [address(arg) for arg in sys.argv[2:] if (':' in arg)]
+        Coordinator(c).run(host_port[0] if (host_port) else ADDRESS)
+        return
+
+    with open(sys.argv[3], 'r') as kh:
+        c.keyring = kh.read().split()
+    c.premium = 'premium' in sys.argv[4:]
+    Worker(c, CoordinatorClient(address(sys.argv[2]))).run()
+    return
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+#
+# store.py
+# SQLite store for everything VirusTotal and Mallector keep track of.
+# Replaces re-reading Potentials.txt, Processed_file.txt, GlobalBlacklist.txt
+# and Full-Analysis.csv every cycle.
+#
+# domains:     every domain ever collected, its status and the feed it came from.
+#              status moves pending -> submitted -> reported -> processed or blacklisted.
+#              submitted domains keep their scan_id and reported ones their report,
+#              so a restart picks up where the last run stopped without spending quota again.
+#              previous is the status a domain had before it was submitted, so a recheck
+#              of a processed domain that never got a report goes back to processed.
+# verdicts:    one row per VT result.
+# av_results:  one row per AV per verdict.
+# feeds:       feed urls.
+# leases:      pending domains a scanning worker is working on, until when. See shard.py
+#
+# Usage: python3 store.py import
+#   Imports the existing text/csv files into data/vt.db
+import analysis, json, logging, shard, sqlite3, sys, threading, time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS feeds (
+    id INTEGER PRIMARY KEY,
+    url TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS domains (
+    domain TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'pending',
+    first_seen REAL,
+    last_checked REAL,
+    feed_id INTEGER REFERENCES feeds(id)
+);
+CREATE INDEX IF NOT EXISTS domains_status ON domains(status);
+CREATE TABLE IF NOT EXISTS verdicts (
+    id INTEGER PRIMARY KEY,
+    domain TEXT NOT NULL,
+    scanned REAL,
+    scan_date TEXT,
+    malicious INTEGER
+);
+CREATE INDEX IF NOT EXISTS verdicts_domain ON verdicts(domain);
+CREATE TABLE IF NOT EXISTS av_results (
+    verdict_id INTEGER NOT NULL REFERENCES verdicts(id),
+    av TEXT NOT NULL,
+    detected INTEGER,
+    result TEXT,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS av_results_verdict ON av_results(verdict_id);
+CREATE INDEX IF NOT EXISTS av_results_av ON av_results(av);
+CREATE TABLE IF NOT EXISTS leases (
+    domain TEXT PRIMARY KEY,
+    worker TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS leases_worker ON leases(worker);
+CREATE INDEX IF NOT EXISTS leases_expires ON leases(expires);
+'''
+
+class Store:
+
+    def __init__(self, filename='data/vt.db'):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        self.migrate()
+        self.db.commit()
+        return
+
+    def migrate(self):
+        '''
+            Adds the columns stores created by older versions don't have.
+        '''
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(domains)')]
+        if ('slot' not in columns):
+            self.db.execute('ALTER TABLE domains ADD COLUMN slot INTEGER')
+        if ('scan_id' not in columns):
+            self.db.execute('ALTER TABLE domains ADD COLUMN scan_id TEXT')
+            self.db.execute('ALTER TABLE domains ADD COLUMN report TEXT')
+        if ('previous' not in columns):
+            self.db.execute('ALTER TABLE domains ADD COLUMN previous TEXT')
+        self.db.execute('CREATE INDEX IF NOT EXISTS domains_status_slot ON domains(status, slot)')
+        self.db.create_function('shard_slot', 1, shard.slot, deterministic=True)
+        return
+
+    def close(self):
+        self.db.close()
+        return
+
+    def empty(self):
+        return self.db.execute('SELECT 1 FROM domains LIMIT 1').fetchone() is None
+
+    def feed_id(self, url):
+        if not (url):
+            return
+        self.db.execute('INSERT OR IGNORE INTO feeds(url) VALUES (?)', (url,))
+        return self.db.execute('SELECT id FROM feeds WHERE url = ?', (url,)).fetchone()[0]
+
+    def add_pending(self, domains, feed=None):
+        '''
+            Adds new domains. Domains the store already has are left alone.
+            Returns the number of domains added.
+        '''
+        now = time.time()
+        with self.lock, self.db:
+            feed_id = self.feed_id(feed)
+            before = self.db.total_changes
+            self.db.executemany("INSERT OR IGNORE INTO domains(domain, status, first_seen, feed_id) VALUES (?, 'pending', ?, ?)",
+                ((domain, now, feed_id) for domain in domains))
+            return self.db.total_changes - before
+
+    def set_status(self, domains, status):
+        with self.lock, self.db:
+            now = time.time()
+            self.db.executemany("INSERT INTO domains(domain, status, first_seen) VALUES (?, ?, ?) ON CONFLICT(domain) DO UPDATE SET status = excluded.status",
+                ((domain, status, now) for domain in domains))
+        return
+
+    def has_pending(self):
+        return self.db.execute("SELECT 1 FROM domains WHERE status = 'pending' LIMIT 1").fetchone() is not None
+
+    def pending(self, limit=-1):
+        rows = self.db.execute("SELECT domain FROM domains WHERE status = 'pending' ORDER BY first_seen LIMIT ?", (limit,))
+        return [row[0] for row in rows]
+
+    def submitted(self, scan_ids):
+        '''
+            Given {domain: scan_id}, remembers the scans that are waiting on a report,
+            and the status each domain had before, for requeue().
+        '''
+        with self.lock, self.db:
+            now = time.time()
+            self.db.executemany("INSERT INTO domains(domain, status, first_seen, scan_id, previous) VALUES (?, 'submitted', ?, ?, 'pending') "
+                "ON CONFLICT(domain) DO UPDATE SET status = 'submitted', scan_id = excluded.scan_id, "
+                "previous = CASE WHEN status IN ('submitted', 'reported') THEN previous ELSE status END",
+                ((domain, now, scan_id) for domain, scan_id in scan_ids.items()))
+        return
+
+    def reported(self, results):
+        '''
+            Given a list of (domain, result), keeps the reports until they are classified.
+        '''
+        with self.lock, self.db:
+            self.db.executemany("UPDATE domains SET status = 'reported', report = ? WHERE domain = ?",
+                ((json.dumps(result), domain) for domain, result in results))
+        return
+
+    def requeue(self, domains):
+        '''
+            Scans that never got a report go back to the status they had.
+            New domains are pending again. Rechecks of processed domains go back
+            to processed and stay in the recheck queue.
+        '''
+        with self.lock, self.db:
+            self.db.executemany("UPDATE domains SET status = COALESCE(previous, 'pending'), scan_id = NULL, previous = NULL "
+                "WHERE domain = ? AND status = 'submitted'",
+                ((domain,) for domain in domains))
+        return
+
+    def outstanding(self):
+        '''
+            Returns [(domain, scan_id)] for the scans still waiting on a report.
+        '''
+        return self.db.execute("SELECT domain, scan_id FROM domains WHERE status = 'submitted'").fetchall()
+
+    def unclassified(self):
+        '''
+            Returns [(domain, result)] for the reports that came back but weren't recorded.
+        '''
+        rows = self.db.execute("SELECT domain, report FROM domains WHERE status = 'reported'")
+        return [(domain, json.loads(report)) for domain, report in rows]
+
+    def processed(self):
+        return [row[0] for row in self.db.execute("SELECT domain FROM domains WHERE status = 'processed'")]
+
+    def seen(self):
+        '''
+            Every domain that was processed or blacklisted.
+        '''
+        rows = self.db.execute("SELECT domain FROM domains WHERE status IN ('processed', 'blacklisted')")
+        return [row[0] for row in rows]
+
+    def status(self, domain):
+        row = self.db.execute('SELECT status FROM domains WHERE domain = ?', (domain,)).fetchone()
+        if (row):
+            return row[0]
+        return
+
+    def feed(self, domain):
+        row = self.db.execute('SELECT feeds.url FROM domains JOIN feeds ON feeds.id = domains.feed_id WHERE domain = ?', (domain,)).fetchone()
+        if (row):
+            return row[0]
+        return
+
+    def history(self, domain):
+        '''
+            Returns (first_seen, last_checked) for a domain, or None if the store doesn't know it.
+            Imported domains only have the time of the import and the scan times of
+            their Full-Analysis.csv rows, so the verdicts count too.
+        '''
+        row = self.db.execute('SELECT domains.first_seen, domains.last_checked, MIN(verdicts.scanned), MAX(verdicts.scanned) '
+            'FROM domains LEFT JOIN verdicts ON verdicts.domain = domains.domain AND verdicts.scanned > 0 '
+            'WHERE domains.domain = ?', (domain,)).fetchone()
+        if (row[0] is None) and (row[2] is None):
+            return
+
+        first_seen = min(t for t in (row[0], row[2]) if t is not None)
+        last_checked = max([t for t in (row[1], row[3]) if t is not None] or [first_seen])
+        return (first_seen, last_checked)
+
+    def record(self, domain, result, malicious, scanned=None, blacklisted_as=None):
+        '''
+            Stores a VT result and the verdict on it.
+            blacklisted_as is the cleaned domain that went to the blacklist.
+        '''
+        scanned = scanned or time.time()
+        status = 'blacklisted' if (malicious) else 'processed'
+        scans = (result or {}).get('scans', {})
+
+        with self.lock, self.db:
+            self.db.execute("INSERT INTO domains(domain, status, first_seen, last_checked) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(domain) DO UPDATE SET status = excluded.status, last_checked = excluded.last_checked, scan_id = NULL, report = NULL, previous = NULL",
+                (domain, status, scanned, scanned))
+
+            if (blacklisted_as) and (blacklisted_as != domain):
+                self.db.execute("INSERT INTO domains(domain, status, first_seen, last_checked) VALUES (?, 'blacklisted', ?, ?) "
+                    "ON CONFLICT(domain) DO UPDATE SET status = 'blacklisted', last_checked = excluded.last_checked",
+                    (blacklisted_as, scanned, scanned))
+
+            if not (scans):
+                return
+
+            cursor = self.db.execute('INSERT INTO verdicts(domain, scanned, scan_date, malicious) VALUES (?, ?, ?, ?)',
+                (domain, scanned, (result or {}).get('scan_date'), int(bool(malicious))))
+            verdict_id = cursor.lastrowid
+            self.db.executemany('INSERT INTO av_results(verdict_id, av, detected, result, detail) VALUES (?, ?, ?, ?, ?)',
+                ((verdict_id, av, int(bool(av_result.get('detected'))), av_result.get('result'), av_result.get('detail'))
+                    for av, av_result in scans.items()))
+        return
+
+    def lease(self, worker, slots, count, seconds):
+        '''
+            Leases up to count pending domains in the given shard slots
+            that nobody else holds a lease on.
+            Returns the domains leased.
+        '''
+        now = time.time()
+        slots = list(slots)
+        if not (slots):
+            return []
+
+        with self.lock, self.db:
+            # Domains collected before their slot was known.
+            self.db.execute("UPDATE domains SET slot = shard_slot(domain) WHERE status = 'pending' AND slot IS NULL")
+
+            marks = ",".join("?" * len(slots))
+            rows = self.db.execute("SELECT domain FROM domains WHERE status = 'pending' AND slot IN ({}) "
+                "AND domain NOT IN (SELECT domain FROM leases) ORDER BY first_seen LIMIT ?".format(marks), slots + [count])
+            domains = [row[0] for row in rows]
+            self.db.executemany('INSERT INTO leases(domain, worker, expires) VALUES (?, ?, ?)',
+                ((domain, worker, now + seconds) for domain in domains))
+        return domains
+
+    def renew(self, worker, seconds):
+        with self.lock, self.db:
+            self.db.execute('UPDATE leases SET expires = ? WHERE worker = ?', (time.time() + seconds, worker))
+        return
+
+    def release(self, domains):
+        '''
+            Drops the leases on domains. The ones still pending can be leased again.
+        '''
+        with self.lock, self.db:
+            self.db.executemany('DELETE FROM leases WHERE domain = ?', ((domain,) for domain in domains))
+        return
+
+    def expire_leases(self):
+        '''
+            Requeues the domains of workers that stopped renewing their leases.
+            Returns the number of domains requeued.
+        '''
+        with self.lock, self.db:
+            return self.db.execute('DELETE FROM leases WHERE expires < ?', (time.time(),)).rowcount
+
+    def leases(self):
+        return dict(self.db.execute('SELECT worker, COUNT(*) FROM leases GROUP BY worker').fetchall())
+
+    def counts(self):
+        return dict(self.db.execute('SELECT status, COUNT(*) FROM domains GROUP BY status').fetchall())
+
+    def read_lines(self, filename):
+        try:
+            with open(filename, 'r') as f:
+                return [line.strip() for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def import_files(self, potentials_file, processed_file, blk_file, analysis_file, av_list):
+        '''
+            Imports the text/csv files. Safe to run more than once for the domains,
+            but Full-Analysis.csv rows are imported every time it runs.
+        '''
+        self.add_pending(self.read_lines(potentials_file))
+        self.set_status(self.read_lines(processed_file), 'processed')
+        self.set_status(self.read_lines(blk_file), 'blacklisted')
+
+        rows = 0
+        for domain, timestamp, scans in analysis.read_rows(analysis_file, av_list):
+            with self.lock, self.db:
+                cursor = self.db.execute('INSERT INTO verdicts(domain, scanned) VALUES (?, ?)', (domain, timestamp))
+                self.db.executemany('INSERT INTO av_results(verdict_id, av, detected, result, detail) VALUES (?, ?, ?, ?, ?)',
+                    ((cursor.lastrowid, av, int(av_result['detected']), av_result['result'], av_result.get('detail'))
+                        for av, av_result in scans.items()))
+            rows += 1
+
+        logging.info("Imported {} analysis rows. Domains: {}".format(rows, self.counts()))
+        return rows
+
+
+def main():
+    if (len(sys.argv) < 2) or (sys.argv[1] != 'import'):
+        print("Usage: python3 store.py import")
+        return
+
+    av_list = open('config/VT-AVs', 'r').read().splitlines()
+    store = Store()
+    rows = store.import_files('data/Potentials.txt', 'data/Processed_file.txt', 'data/GlobalBlacklist.txt', 'data/Full-Analysis.csv', av_list)
+    print("{} analysis rows imported. Domains: {}".format(rows, store.counts()))
+    store.close()
+    return
+
+if __name__ == "__main__":
+    main()
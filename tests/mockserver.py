@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+#
+# mockserver.py
+# Loopback HTTP server the tests and benchmarks run against, instead of VT.
+# MockServer serves whatever routes are added to it, each with an optional delay,
+# and counts the requests every route got.
+# MockVirusTotal adds url/scan and url/report. A report is ready analysis_delay
+# seconds after its url was submitted. Urls with 'evil' in them are flagged by
+# the AVs config/AV-weights needs to call them malicious, urls with a space are invalid
+# and urls in stuck are never analysed.
+#
+# MockFileScanner adds file/scan, file/scan/upload_url and file/report. Uploads
+# are read and hashed a chunk at a time, so a sample of any size can be sent.
+#
+# MockFeeds serves feed bodies with an ETag and a Last-Modified, and answers
+# conditional GETs for an unchanged feed with 304.
+#
+# MockIpLookup answers /csv/<ip> with a csv row, like extreme-ip-lookup.
+#
+# scratch_tree() gives a temporary working directory with a copy of config/
+# and empty data/ and logs/, since every module opens its files relative to it.
+import collections, hashlib, json, os, shutil, tempfile, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # Keep-alive, like VT
+
+    def do_GET(self):
+        self.server.mock.dispatch(self, 'GET')
+        return
+
+    def do_POST(self):
+        self.server.mock.dispatch(self, 'POST')
+        return
+
+    def body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def form(self):
+        '''
+            The query string and a url encoded body, as {name: value}.
+        '''
+        fields = parse_qs(urlparse(self.path).query)
+        if (self.command == 'POST') and ('multipart' not in self.headers.get('Content-Type', '')):
+            fields.update(parse_qs(self.body().decode('utf-8')))
+        return dict((name, values[0]) for name, values in fields.items())
+
+    def reply(self, status=200, body=b'', headers=None):
+        if (type(body) != bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return
+
+    def log_message(self, format, *args):
+        return
+
+
+class MockServer:
+
+    def __init__(self):
+        self.routes = {}        # (method, path prefix) -> (function, delay)
+        self.hits = collections.Counter()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.server.mock = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return
+
+    def url(self, path=''):
+        return "http://127.0.0.1:{}{}".format(self.server.server_address[1], path)
+
+    def route(self, method, prefix, function, delay=0):
+        '''
+            function(handler) answers every request whose path starts with prefix.
+        '''
+        self.routes[(method, prefix)] = (function, delay)
+        return
+
+    def dispatch(self, handler, method):
+        path = urlparse(handler.path).path
+        matches = [prefix for (route_method, prefix) in self.routes if (route_method == method) and (path.startswith(prefix))]
+        if not (matches):
+            handler.reply(404, b'')
+            return
+
+        prefix = max(matches, key=len)
+        function, delay = self.routes[(method, prefix)]
+        with self.lock:
+            self.hits[prefix] += 1
+        if (delay):
+            time.sleep(delay)
+        function(handler)
+        return
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        return
+
+
+class MockVirusTotal:
+
+    def __init__(self, server, av_list, analysis_delay=0, latency=0):
+        self.server = server
+        self.av_list = av_list
+        self.analysis_delay = analysis_delay
+        self.submitted = {}     # scan_id -> (url, time submitted)
+        self.scanned = []       # Every url sent to url/scan, in order
+        self.stuck = set()      # Urls whose analysis never finishes
+        self.lock = threading.Lock()
+        server.route('POST', '/vtapi/v2/url/scan', self.url_scan, latency)
+        server.route('POST', '/vtapi/v2/url/report', self.url_report, latency)
+        return
+
+    def api(self):
+        return self.server.url('/vtapi/v2/')
+
+    def url_scan(self, handler):
+        entries = []
+        for url in handler.form()['url'].split("\n"):
+            with self.lock:
+                self.scanned.append(url)
+
+            if (' ' in url):
+                entries.append({'response_code': -1, 'verbose_msg': 'Invalid URL, the scan request was not queued'})
+                continue
+
+            scan_id = "{}-{}".format(url, len(self.scanned))
+            with self.lock:
+                self.submitted[scan_id] = (url, time.time())
+            entries.append({'response_code': 1, 'scan_id': scan_id, 'url': url,
+                'verbose_msg': 'Scan request successfully queued, come back later for the report'})
+
+        handler.reply(200, entries if (len(entries) > 1) else entries[0])
+        return
+
+    def report(self, url):
+        scans = dict((av, {'detected': False, 'result': 'clean site'}) for av in self.av_list)
+        if ('evil' in url):
+            for av in ('Forcepoint ThreatSeeker', 'Fortinet'):
+                scans[av] = {'detected': True, 'result': 'malicious site'}
+        return {'response_code': 1, 'url': url, 'scan_date': time.strftime('%Y-%m-%d %H:%M:%S'), 'scans': scans}
+
+    def url_report(self, handler):
+        entries = []
+        for scan_id in handler.form()['resource'].split("\n"):
+            url, submitted = self.submitted.get(scan_id, (None, None))
+            if (url is None):
+                entries.append({'response_code': 0, 'resource': scan_id})
+            elif (time.time() - submitted < self.analysis_delay) or (url in self.stuck):
+                entries.append({'response_code': -2, 'resource': scan_id, 'verbose_msg': 'Scan request successfully queued'})
+            else:
+                entries.append(self.report(url))
+
+        handler.reply(200, entries if (len(entries) > 1) else entries[0])
+        return
+
+
+class MockFileScanner:
+
+    def __init__(self, server, av_list, analysis_delay=0, chunk_size=1024 * 1024):
+        self.server = server
+        self.av_list = av_list
+        self.analysis_delay = analysis_delay
+        self.chunk_size = chunk_size
+        self.known = {}         # sha256 -> report VT already has
+        self.submitted = {}     # scan_id -> (sha256, time submitted)
+        self.uploads = []       # (path, bytes of the sample, sha256) of every upload, in order
+        self.lock = threading.Lock()
+        server.route('POST', '/vtapi/v2/file/scan', self.file_scan)
+        server.route('GET', '/vtapi/v2/file/scan/upload_url', self.upload_url)
+        server.route('POST', '/upload/', self.file_scan)
+        server.route('GET', '/vtapi/v2/file/report', self.file_report)
+        return
+
+    def api(self):
+        return self.server.url('/vtapi/v2/')
+
+    def report(self, sha):
+        scans = dict((av, {'detected': False, 'result': None, 'update': '20261018', 'version': '1.0'}) for av in self.av_list)
+        return {'response_code': 1, 'resource': sha, 'sha256': sha, 'md5': sha[:32], 'positives': 0, 'scans': scans}
+
+    def receive(self, handler):
+        '''
+            Hashes the file part of a multipart body without holding more than a chunk of it.
+            Returns (bytes, sha256).
+        '''
+        boundary = handler.headers['Content-Type'].split('boundary=')[1]
+        tail = len('\r\n--{}--\r\n'.format(boundary))
+        remaining = int(handler.headers.get('Content-Length', 0))
+        hasher = hashlib.sha256()
+        size = 0
+        buffered = b''
+        in_file = False
+
+        while (remaining):
+            chunk = handler.rfile.read(min(self.chunk_size, remaining))
+            if not (chunk):
+                break
+            remaining -= len(chunk)
+            buffered += chunk
+
+            if not (in_file):
+                end = buffered.find(b'\r\n\r\n')
+                if (end < 0):
+                    continue
+                buffered = buffered[end + 4:]
+                in_file = True
+
+            # The last bytes could be the closing boundary.
+            if (len(buffered) > tail):
+                hasher.update(buffered[:-tail])
+                size += len(buffered) - tail
+                buffered = buffered[-tail:]
+        return (size, hasher.hexdigest())
+
+    def file_scan(self, handler):
+        size, sha = self.receive(handler)
+        with self.lock:
+            self.uploads.append((urlparse(handler.path).path, size, sha))
+            scan_id = "{}-{}".format(sha, len(self.uploads))
+            self.submitted[scan_id] = (sha, time.time())
+        handler.reply(200, {'response_code': 1, 'scan_id': scan_id, 'sha256': sha,
+            'verbose_msg': 'Scan request successfully queued, come back later for the report'})
+        return
+
+    def upload_url(self, handler):
+        with self.lock:
+            path = '/upload/{}'.format(len(self.uploads))
+        handler.reply(200, {'upload_url': self.server.url(path)})
+        return
+
+    def file_report(self, handler):
+        entries = []
+        for resource in handler.form()['resource'].split(','):
+            resource = resource.strip()
+            sha, submitted = self.submitted.get(resource, (resource, None))
+            if (sha in self.known):
+                entries.append(self.known[sha])
+            elif (submitted is None):
+                entries.append({'response_code': 0, 'resource': resource, 'verbose_msg': 'The requested resource is not among the finished, queued or pending scans'})
+            elif (time.time() - submitted < self.analysis_delay):
+                entries.append({'response_code': -2, 'resource': resource, 'verbose_msg': 'Your resource is queued for analysis'})
+            else:
+                entries.append(self.report(sha))
+
+        handler.reply(200, entries if (len(entries) > 1) else entries[0])
+        return
+
+
+class MockFeeds:
+
+    def __init__(self, server, delay=0):
+        self.server = server
+        self.feeds = {}         # path -> (body, etag, last modified)
+        self.sent = collections.Counter()           # path -> 200s
+        self.not_modified = collections.Counter()   # path -> 304s
+        self.version = 0
+        server.route('GET', '/feeds/', self.get, delay)
+        return
+
+    def publish(self, name, body):
+        '''
+            Serves body at /feeds/name, with a new ETag and Last-Modified.
+            Returns its url.
+        '''
+        path = '/feeds/' + name
+        self.version += 1
+        modified = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(time.time() + self.version))
+        self.feeds[path] = (body.encode('utf-8'), '"{}-{}"'.format(name, self.version), modified)
+        return self.server.url(path)
+
+    def get(self, handler):
+        path = urlparse(handler.path).path
+        if (path not in self.feeds):
+            handler.reply(404, b'')
+            return
+
+        body, etag, modified = self.feeds[path]
+        if (handler.headers.get('If-None-Match') == etag) or (handler.headers.get('If-Modified-Since') == modified):
+            self.not_modified[path] += 1
+            handler.reply(304, b'', {'ETag': etag, 'Last-Modified': modified})
+            return
+
+        self.sent[path] += 1
+        content_type = 'application/rss+xml' if (body.startswith(b'<?xml')) else 'text/plain'
+        handler.reply(200, body, {'ETag': etag, 'Last-Modified': modified, 'Content-Type': content_type})
+        return
+
+
+class MockIpLookup:
+
+    def __init__(self, server, delay=0):
+        self.server = server
+        self.looked_up = []     # Every IP asked about, in order
+        self.lock = threading.Lock()
+        server.route('GET', '/csv/', self.get, delay)
+        return
+
+    def base(self):
+        return self.server.url('/csv/')
+
+    def get(self, handler):
+        ip = urlparse(handler.path).path[len('/csv/'):]
+        with self.lock:
+            self.looked_up.append(ip)
+        handler.reply(200, "{},Example ISP,AS64500,Example Country\n".format(ip).encode('utf-8'), {'Content-Type': 'text/csv'})
+        return
+
+
+class scratch_tree:
+    '''
+        with scratch_tree() as path: runs the block in a temporary copy of config/.
+    '''
+
+    def __enter__(self):
+        self.cwd = os.getcwd()
+        self.path = tempfile.mkdtemp(prefix='vtw-')
+        shutil.copytree(os.path.join(ROOT, 'config'), os.path.join(self.path, 'config'))
+        os.makedirs(os.path.join(self.path, 'data'))
+        os.makedirs(os.path.join(self.path, 'logs'))
+        os.chdir(self.path)
+        return self.path
+
+    def __exit__(self, *exc):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.path, ignore_errors=True)
+        return False
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+#
+# test_analysis.py
+# Converting the rows of the real data/Full-Analysis.csv keeps their timestamps.
+import datetime, os, unittest
+from tests.mockserver import ROOT, scratch_tree
+import analysis, columnar, store
+
+def real_rows(count):
+    '''
+        The header and the first count rows with a timestamp from the repo's Full-Analysis.csv.
+    '''
+    with open(os.path.join(ROOT, 'data', 'Full-Analysis.csv'), 'r') as f:
+        lines = f.read().splitlines()
+    return [lines[0]] + [line for line in lines[1:] if '/18 ' in line.split(',')[1]][:count]
+
+class ConvertTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = scratch_tree()
+        self.tree.__enter__()
+        self.lines = real_rows(3)
+        with open('data/Full-Analysis.csv', 'w') as f:
+            f.write("\n".join(self.lines) + "\n")
+        with open('config/VT-AVs', 'r') as f:
+            self.av_list = f.read().splitlines()
+
+        # '4/25/18 10:14' as written by the spreadsheet, in local time.
+        self.expected = [datetime.datetime.strptime(line.split(',')[1], '%m/%d/%y %H:%M').timestamp() for line in self.lines[1:]]
+        return
+
+    def tearDown(self):
+        self.tree.__exit__()
+        return
+
+    def test_spreadsheet_timestamps(self):
+        self.assertEqual(analysis.parse_timestamp('4/25/18 10:58'), datetime.datetime(2018, 4, 25, 10, 58).timestamp())
+        self.assertEqual(analysis.parse_timestamp('2018-04-25 10:58:00'), datetime.datetime(2018, 4, 25, 10, 58).timestamp())
+        self.assertIsNone(analysis.parse_timestamp('yesterday'))
+        return
+
+    def test_columnar_convert(self):
+        self.assertEqual(columnar.convert('data/Full-Analysis.csv', 'data/analysis', self.av_list), 3)
+
+        reader = columnar.ColumnarStore('data/analysis')
+        self.assertEqual(list(reader.timestamps()), self.expected)
+        # Clean rows, so nothing is flagged in 2018 either.
+        self.assertEqual(reader.count_flagged('Fortinet', since=self.expected[0]), 0)
+        return
+
+    def test_store_import(self):
+        db = store.Store('data/vt.db')
+        self.assertEqual(db.import_files('data/Potentials.txt', 'data/Processed_file.txt', 'data/GlobalBlacklist.txt', 'data/Full-Analysis.csv', self.av_list), 3)
+
+        scanned = [row[0] for row in db.db.execute('SELECT scanned FROM verdicts ORDER BY id')]
+        db.close()
+
+        # Not NULL, which left them out of every time range.
+        self.assertEqual(scanned, self.expected)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+#
+# test_asyncvt.py
+# The async scan/report pipeline and the serial one, against MockVirusTotal.
+# benchmarks/bench_async.py measures the domains/minute of both.
+import os, time, unittest
+from tests.mockserver import MockServer, MockVirusTotal, scratch_tree, ROOT
+import asyncvt, keyscheduler, transport, vt
+
+AV_LIST = open(os.path.join(ROOT, 'config/VT-AVs'), 'r').read().splitlines()
+
+def virustotal(api, keys=40):
+    '''
+        A VirusTotal on the mock, with enough premium keys that the quota isn't what's tested.
+    '''
+    c = vt.VirusTotal()
+    c.api = api
+    c.http = transport.Transport()
+    c.premium = True
+    c.keyring = ["key-{}".format(i) for i in range(0, keys)]
+    c.scheduler = keyscheduler.KeyScheduler(c.keyring, premium=True)
+    c.open_outputs()
+
+    tracker = c.report_tracker()
+    tracker.first_poll = 0.05
+    tracker.max_interval = 0.2
+    return c
+
+def settle(c, timeout=5):
+    '''
+        Collects reports like the next cycles would, until the tracker is empty.
+    '''
+    tracker = c.report_tracker()
+    deadline = time.time() + timeout
+    while (len(tracker)) and (time.time() < deadline):
+        time.sleep(tracker.next_due())
+        c.collect_reports()
+    return
+
+def domains(count, prefix=''):
+    # Every fifth one is malicious.
+    return ["{}evil{}.com/x".format(prefix, i) if (i % 5 == 0) else "{}site{}.com".format(prefix, i) for i in range(0, count)]
+
+def read_lines(filename):
+    with open(filename, 'r') as f:
+        return f.read().split()
+
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = scratch_tree()
+        self.tree.__enter__()
+        self.server = MockServer()
+        self.mock = MockVirusTotal(self.server, AV_LIST, analysis_delay=0.2)
+        self.vt = virustotal(self.mock.api())
+        return
+
+    def tearDown(self):
+        # Nothing is left for a writer's timer to commit once the tree is gone.
+        self.vt.commit_outputs()
+        self.server.stop()
+        self.vt.store.close()
+        self.tree.__exit__()
+        return
+
+    def pipeline(self):
+        return asyncvt.AsyncVirusTotal(self.vt, concurrency=8)
+
+    def test_async_records_every_domain(self):
+        queue = domains(40) + ['not a url']
+        self.vt.store.add_pending(queue)
+
+        client = self.pipeline()
+        client.analyze(queue, wait=True)
+        self.vt.commit_outputs()
+
+        self.assertEqual((client.completed, client.invalid, client.failed), (40, 1, 0))
+        # 25 urls per url/scan call with a paid key.
+        self.assertEqual(self.server.hits['/vtapi/v2/url/scan'], 2)
+        self.assertLess(self.server.hits['/vtapi/v2/url/report'], 40)
+        self.assertFalse(self.vt.store.has_pending())
+        self.assertEqual(sorted(read_lines('data/GlobalBlacklist.txt')), sorted("evil{}.com".format(i) for i in range(0, 40, 5)))
+        self.assertIn('not a url', open('data/Processed_file.txt').read())
+        # One Full-Analysis.csv row per report, none for the invalid url.
+        self.assertEqual(len(open('data/Full-Analysis.csv').read().splitlines()) - 1, 40)
+        return
+
+    def test_async_skips_cached_verdicts(self):
+        self.vt.cache.put('cached.com', self.mock.report('cached.com'), False)
+        self.vt.store.add_pending(['cached.com', 'new.com'])
+
+        client = self.pipeline()
+        client.analyze(['cached.com', 'new.com'])
+
+        self.assertEqual(self.mock.scanned, ['new.com'])
+        self.assertEqual(client.cached, 1)
+        self.assertEqual(self.vt.store.status('cached.com'), 'processed')
+        return
+
+    def test_sync_and_async_agree(self):
+        serial = domains(30, 'a-')
+        pipelined = domains(30, 'b-')
+        self.vt.store.add_pending(serial + pipelined)
+
+        self.vt.scan_list(serial)
+        settle(self.vt)
+        self.vt.async_mode = True
+        self.vt.scan_list(pipelined)
+        settle(self.vt)
+        self.vt.commit_outputs()
+
+        counts = self.vt.store.counts()
+        self.assertEqual(counts.get('pending', 0), 0)
+        blacklist = read_lines('data/GlobalBlacklist.txt')
+        self.assertEqual(len([domain for domain in blacklist if domain.startswith('a-')]), 6)
+        self.assertEqual(len([domain for domain in blacklist if domain.startswith('b-')]), 6)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
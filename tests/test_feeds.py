@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+#
+# test_feeds.py
+# Mallector.collect() against fixture feeds served by MockFeeds:
+# every feed type, conditional GETs, and feeds fetched at once.
+import time, unittest
+from tests.mockserver import MockServer, MockFeeds, scratch_tree
+import Mallector, store
+
+def rss(items):
+    entries = "".join("<item><title>{}</title><description>{}</description></item>".format(title, description)
+        for title, description in items)
+    return '<?xml version="1.0"?><rss version="2.0"><channel><title>feed</title>{}</channel></rss>'.format(entries)
+
+FEEDS = {
+    'tracker.xml': ('rss-title', rss([('evil1.com/gate.php', ''), ('198.51.100.7/panel/', '')])),
+    'malc0de.xml': ('malc0de', rss([('x', 'URL: mal.example.org/x.exe, IP Address: 203.0.113.5, Country: XX')])),
+    'phish.txt': ('urls', "# OpenPhish\nhttp://phish.example.net/login\n"),
+    'hosts.txt': ('hosts', "# hosts\n127.0.0.1 localhost\n127.0.0.1 hosts1.example.com\nbare.example.com\n"),
+    'urlhaus.csv': ('csv:2', '# id,dateadded,url\n"1","2026-10-18","http://haus.example.com/a.bin"\n'),
+}
+
+EXPECTED = set([
+    'evil1.com', 'evil1.com/gate.php', '198.51.100.7', '198.51.100.7/panel/',
+    'mal.example.org', 'mal.example.org/x.exe', 'phish.example.net', 'phish.example.net/login',
+    'hosts1.example.com', 'bare.example.com', 'haus.example.com', 'haus.example.com/a.bin',
+])
+
+class CollectTest(unittest.TestCase):
+
+    def setUp(self, delay=0):
+        self.tree = scratch_tree()
+        self.tree.__enter__()
+        self.server = MockServer()
+        self.feeds = MockFeeds(self.server, delay)
+
+        with open('config/malware-feeds', 'w') as f:
+            for name, (feed_type, body) in FEEDS.items():
+                f.write("{} {}\n".format(self.feeds.publish(name, body), feed_type))
+        self.store = store.Store()
+        return
+
+    def tearDown(self):
+        self.server.stop()
+        self.store.close()
+        self.tree.__exit__()
+        return
+
+    def potentials(self):
+        with open('data/Potentials.txt', 'r') as f:
+            return f.read().split()
+
+    def collect(self):
+        collector = Mallector.Mallector(self.store)
+        collector.collect('data/Potentials.txt')
+        collector.seen.close()
+        return collector
+
+    def test_every_feed_type(self):
+        self.collect()
+        self.assertEqual(set(self.potentials()), EXPECTED)
+        self.assertEqual(len(self.potentials()), len(EXPECTED))
+        self.assertEqual(len(self.store.pending()), len(EXPECTED))
+        return
+
+    def test_unchanged_feeds_cost_a_304(self):
+        self.collect()
+        # A new Mallector, like after a restart. The validators are kept in data/feed-state.json.
+        self.collect()
+
+        self.assertEqual(set(self.feeds.sent.values()), set([1]))
+        self.assertEqual(set(self.feeds.not_modified.values()), set([1]))
+        self.assertEqual(len(self.potentials()), len(EXPECTED))
+        return
+
+    def test_changed_feed_is_fetched_again(self):
+        self.collect()
+        self.feeds.publish('phish.txt', "http://phish.example.net/login\nhttp://new.example.net/\n")
+        self.collect()
+
+        self.assertEqual(self.feeds.sent['/feeds/phish.txt'], 2)
+        self.assertEqual(self.feeds.sent['/feeds/hosts.txt'], 1)
+        self.assertEqual(self.potentials()[len(EXPECTED):], ['new.example.net'])
+        return
+
+
+class ConcurrentFetchTest(CollectTest):
+
+    def setUp(self):
+        # Every feed takes half a second to answer.
+        super().setUp(delay=0.5)
+        return
+
+    def test_feeds_are_fetched_at_once(self):
+        start = time.time()
+        self.collect()
+        self.assertLess(time.time() - start, 0.5 * len(FEEDS) / 2)
+        self.assertEqual(set(self.potentials()), EXPECTED)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+#
+# test_gip.py
+# gip.GeoIP against MockIpLookup: order, duplicates, the cache, --collapse-24
+# and lookups running at once.
+import time, unittest
+from tests.mockserver import MockServer, MockIpLookup, scratch_tree
+import gip
+
+IPS = ['192.0.2.1', '198.51.100.7', 'not-an-ip', '192.0.2.1', '203.0.113.9', '192.0.2.77', '2001:db8::1']
+
+def read_rows(filename):
+    with open(filename, 'r') as f:
+        return [line.split(',')[0] for line in f.read().splitlines()]
+
+class GeoIPTest(unittest.TestCase):
+
+    def setUp(self, delay=0):
+        self.tree = scratch_tree()
+        self.tree.__enter__()
+        self.server = MockServer()
+        self.mock = MockIpLookup(self.server, delay)
+        return
+
+    def tearDown(self):
+        self.server.stop()
+        self.tree.__exit__()
+        return
+
+    def enrich(self, ips, output='data/ips.csv', **kwargs):
+        geoip = gip.GeoIP(output, base=self.mock.base(), **kwargs)
+        geoip.enrich(ips)
+        return geoip
+
+    def test_rows_in_input_order(self):
+        self.enrich(IPS)
+        # One row per IP, duplicates included. Not an IP has no row.
+        self.assertEqual(read_rows('data/ips.csv'), [ip for ip in IPS if ip != 'not-an-ip'])
+        self.assertEqual(sorted(self.mock.looked_up), sorted(set(IPS) - set(['not-an-ip'])))
+        return
+
+    def test_rerun_is_answered_from_the_cache(self):
+        self.enrich(IPS)
+        looked_up = len(self.mock.looked_up)
+        geoip = self.enrich(IPS, 'data/again.csv')
+
+        self.assertEqual(len(self.mock.looked_up), looked_up)
+        self.assertEqual(geoip.lookups, 0)
+        self.assertEqual(read_rows('data/again.csv'), read_rows('data/ips.csv'))
+        return
+
+    def test_collapse_24(self):
+        self.enrich(IPS, collapse=True)
+
+        # 192.0.2.1 answers for 192.0.2.77, under its own address.
+        self.assertEqual(self.mock.looked_up.count('192.0.2.1') + self.mock.looked_up.count('192.0.2.77'), 1)
+        self.assertEqual(len(self.mock.looked_up), 4)
+        self.assertEqual(read_rows('data/ips.csv'), [ip for ip in IPS if ip != 'not-an-ip'])
+        return
+
+
+class ConcurrentLookupTest(GeoIPTest):
+
+    def setUp(self):
+        # Every lookup takes a fifth of a second.
+        super().setUp(delay=0.2)
+        return
+
+    def test_lookups_run_at_once(self):
+        ips = ["198.51.100.{}".format(i) for i in range(1, 33)]
+        start = time.time()
+        self.enrich(ips, workers=8)
+
+        self.assertLess(time.time() - start, 0.2 * len(ips) / 2)
+        self.assertEqual(read_rows('data/ips.csv'), ips)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
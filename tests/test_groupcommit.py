@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+#
+# test_groupcommit.py
+# GroupCommitWriter on files that Mallector.dedupe() replaces underneath it.
+import os, unittest
+from tests.mockserver import scratch_tree
+import groupcommit, Mallector
+
+def read(filename):
+    with open(filename, 'r') as f:
+        return f.read()
+
+class ReplacedFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = scratch_tree()
+        self.tree.__enter__()
+        self.collector = Mallector.Mallector()
+        return
+
+    def tearDown(self):
+        self.collector.seen.close()
+        self.collector.store.close()
+        self.tree.__exit__()
+        return
+
+    def test_commit_after_dedupe(self):
+        with open('data/Processed_file.txt', 'w') as f:
+            f.write("a.com\na.com\n")
+        writer = groupcommit.GroupCommitWriter('data/Processed_file.txt')
+
+        self.collector.dedupe('data/Processed_file.txt')
+        writer.write("b.com\n")
+        writer.commit()
+        writer.write("c.com\n")
+        writer.close()
+
+        self.assertEqual(read('data/Processed_file.txt'), "a.com\nb.com\nc.com\n")
+        return
+
+    def test_commit_after_remove(self):
+        writer = groupcommit.GroupCommitWriter('data/GlobalBlacklist.txt')
+        writer.write("a.com\n")
+        writer.commit()
+
+        os.remove('data/GlobalBlacklist.txt')
+        writer.write("b.com\n")
+        writer.close()
+
+        self.assertEqual(read('data/GlobalBlacklist.txt'), "b.com\n")
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+#
+# test_queue.py
+# VirusTotal.scan_queue() takes its work from the store, not Potentials.txt.
+import os, unittest
+from tests.mockserver import MockServer, MockVirusTotal, scratch_tree
+from tests.test_asyncvt import AV_LIST, settle, virustotal
+
+class QueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = scratch_tree()
+        self.tree.__enter__()
+        with open('data/Potentials.txt', 'w') as f:
+            f.write("done.com\nnew.com\nsent.com\n")
+
+        self.server = MockServer()
+        self.mock = MockVirusTotal(self.server, AV_LIST)
+        self.vt = virustotal(self.mock.api())
+        return
+
+    def tearDown(self):
+        # Nothing is left for a writer's timer to commit once the tree is gone.
+        self.vt.commit_outputs()
+        self.server.stop()
+        self.vt.store.close()
+        self.tree.__exit__()
+        return
+
+    def test_queue_comes_from_the_store(self):
+        self.vt.store.set_status(['done.com'], 'processed')
+        self.vt.store.submitted({'sent.com': 'sent.com-0'})
+        self.vt.store.add_pending(['store-only.com'])
+        inode = os.stat('data/Potentials.txt').st_ino
+
+        self.vt.scan_queue()
+        settle(self.vt)
+
+        # Processed and submitted domains aren't sent again, whatever Potentials.txt says.
+        self.assertEqual(sorted(self.mock.scanned), ['new.com', 'store-only.com'])
+        self.assertFalse(self.vt.store.has_pending())
+        # Potentials.txt isn't rewritten by a cycle.
+        self.assertEqual(os.stat('data/Potentials.txt').st_ino, inode)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
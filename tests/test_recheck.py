@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+#
+# test_recheck.py
+# Domains RecheckQueue.sync() adds keep the times the store has for them.
+import datetime, time, unittest
+from tests.mockserver import scratch_tree
+import recheck, store
+from verdictcache import cache_key
+
+DAY = 86400
+
+class SeedTimesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = scratch_tree()
+        self.tree.__enter__()
+        self.store = store.Store('data/vt.db')
+        self.queue = recheck.RecheckQueue('data/recheck-queue.json')
+        self.now = time.time()
+        return
+
+    def tearDown(self):
+        self.store.close()
+        self.tree.__exit__()
+        return
+
+    def entry(self, domain):
+        return self.queue.entries[cache_key(domain)]
+
+    def test_times_come_from_the_store(self):
+        # Imported: only the scan time of its Full-Analysis.csv row.
+        with open('data/Processed_file.txt', 'w') as f:
+            f.write("http://imported.com/\n")
+        with open('data/Full-Analysis.csv', 'w') as f:
+            f.write("http://imported.com/,4/25/18 10:14,,,,,,False;clean site\n")
+        self.store.import_files('data/Potentials.txt', 'data/Processed_file.txt', 'data/GlobalBlacklist.txt', 'data/Full-Analysis.csv', ['ADMINUSLabs'])
+
+        # Scanned twice by this version.
+        result = {'scans': {'ADMINUSLabs': {'detected': False, 'result': 'clean site'}}}
+        self.store.record('twice.com', result, False, scanned=self.now - 30 * DAY)
+        self.store.record('twice.com', result, False, scanned=self.now - 2 * DAY)
+
+        added = self.queue.sync(self.store.processed() + ['unknown.com'])
+        self.queue.seed_times(added, self.store.history)
+
+        scanned = datetime.datetime(2018, 4, 25, 10, 14).timestamp()
+        self.assertEqual(self.entry('http://imported.com/')['first_seen'], scanned)
+        self.assertEqual(self.entry('http://imported.com/')['last_checked'], scanned)
+        self.assertEqual(self.entry('twice.com')['first_seen'], self.now - 30 * DAY)
+        self.assertEqual(self.entry('twice.com')['last_checked'], self.now - 2 * DAY)
+
+        # The store doesn't know it, so it stays seen and checked just now.
+        self.assertGreaterEqual(self.entry('unknown.com')['last_checked'], self.now)
+
+        # Unchecked since 2018 goes first.
+        self.assertEqual(list(self.queue.ordered())[0], 'http://imported.com/')
+        return
+
+    def test_no_scan_time(self):
+        self.store.set_status(['plain.com'], 'processed')
+        first_seen = self.store.db.execute("SELECT first_seen FROM domains WHERE domain = 'plain.com'").fetchone()[0]
+
+        added = self.queue.sync(['plain.com'])
+        self.queue.seed_times(added, self.store.history)
+
+        # Never checked: as of when it was first seen.
+        self.assertEqual(self.entry('plain.com')['first_seen'], first_seen)
+        self.assertEqual(self.entry('plain.com')['last_checked'], first_seen)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+#
+# test_reports.py
+# Slow analyses stay in the shared report tracker instead of holding up
+# VirusTotal.scan_list(), and are recorded whenever their reports come back.
+import time, unittest
+from tests.mockserver import MockServer, MockVirusTotal, scratch_tree
+from tests.test_asyncvt import AV_LIST, settle, virustotal
+
+class ReportTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = scratch_tree()
+        self.tree.__enter__()
+        self.server = MockServer()
+        self.mock = MockVirusTotal(self.server, AV_LIST)
+        self.vt = virustotal(self.mock.api())
+        return
+
+    def tearDown(self):
+        # Nothing is left for a writer's timer to commit once the tree is gone.
+        self.vt.commit_outputs()
+        self.server.stop()
+        self.vt.store.close()
+        self.tree.__exit__()
+        return
+
+    def test_slow_analysis_does_not_hold_up_the_queue(self):
+        self.mock.stuck.add('slow.com')
+        self.vt.store.add_pending(['slow.com', 'fast.com'])
+
+        start = time.time()
+        self.vt.scan_list(['slow.com', 'fast.com'])
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(self.vt.store.status('slow.com'), 'submitted')
+
+        self.mock.stuck.clear()
+        settle(self.vt)
+        self.assertEqual(self.vt.store.status('slow.com'), 'processed')
+        self.assertEqual(self.vt.store.status('fast.com'), 'processed')
+        return
+
+    def test_rollup_waits_on_its_hosts_only(self):
+        self.mock.stuck.add('slow.com')
+        self.vt.scan_list(['slow.com'])
+        self.vt.scan_list(['host.com'])
+
+        self.vt.wait_for(['host.com'])
+        self.assertEqual(self.vt.store.status('host.com'), 'processed')
+        self.assertEqual(self.vt.store.status('slow.com'), 'submitted')
+        return
+
+    def test_late_recheck_reaches_the_recheck_queue(self):
+        self.vt.recheck.add('old.com', now=time.time() - 30 * 86400)
+        self.mock.stuck.add('old.com')
+        self.vt.submit_batch(['old.com'])
+        self.vt.collect_reports()
+
+        self.mock.stuck.clear()
+        settle(self.vt)
+        self.assertEqual(self.vt.recheck.requests, 1)
+        self.assertGreater(self.vt.recheck.entries['old.com']['last_checked'], time.time() - 60)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
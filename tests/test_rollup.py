@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+#
+# test_rollup.py
+# VirusTotal.scan_queue() with rollup groups, against MockVirusTotal.
+import unittest
+from tests.mockserver import MockServer, MockVirusTotal, scratch_tree
+from tests.test_asyncvt import AV_LIST, read_lines, settle, virustotal
+
+URLS = ['evil-host.com/a.php', 'evil-host.com/b.php', 'evil-host.com/c.php']
+SLOW = ['slow-host.com/a.php', 'slow-host.com/b.php', 'slow-host.com/c.php']
+
+class RollupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = scratch_tree()
+        self.tree.__enter__()
+        with open('data/Potentials.txt', 'w') as f:
+            f.write("\n".join(URLS + SLOW) + "\n")
+
+        self.server = MockServer()
+        self.mock = MockVirusTotal(self.server, AV_LIST)
+        self.vt = virustotal(self.mock.api())
+        self.vt.report_tracker().max_polls = 2
+        return
+
+    def tearDown(self):
+        # Nothing is left for a writer's timer to commit once the tree is gone.
+        self.vt.commit_outputs()
+        self.server.stop()
+        self.vt.store.close()
+        self.tree.__exit__()
+        return
+
+    def test_blacklisted_host_covers_its_urls(self):
+        self.vt.scan_queue()
+        settle(self.vt)
+
+        # The urls under the blacklisted host weren't scanned, the ones under the clean one were.
+        self.assertEqual(sorted(self.mock.scanned), sorted(['evil-host.com', 'slow-host.com'] + SLOW))
+        self.assertEqual(set(self.vt.store.status(url) for url in URLS), set(['blacklisted']))
+        self.assertEqual(set(self.vt.store.status(url) for url in SLOW + ['slow-host.com']), set(['processed']))
+        self.assertFalse(self.vt.store.has_pending())
+        return
+
+    def test_expired_head_is_scanned_again(self):
+        # The host wasn't queued. The rollup added it, and its report never comes.
+        self.mock.stuck.add('slow-host.com')
+        self.vt.scan_queue()
+
+        self.assertEqual(self.vt.store.status('slow-host.com'), 'pending')
+        self.assertIn('slow-host.com', read_lines('data/Potentials.txt'))
+
+        # The next cycle picks it up from the queue like any other entry.
+        self.mock.stuck.clear()
+        self.vt.scan_queue()
+        settle(self.vt)
+        self.vt.commit_outputs()
+
+        self.assertEqual(self.vt.store.status('slow-host.com'), 'processed')
+        self.assertFalse(self.vt.store.has_pending())
+        self.assertIn('slow-host.com', read_lines('data/Processed_file.txt'))
+        return
+
+if __name__ == "__main__":
+    unittest.main()
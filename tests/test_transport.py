@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#
+# test_transport.py
+# Which requests transport.Transport retries, against MockServer.
+import socket, unittest
+from tests.mockserver import MockServer, MockVirusTotal, scratch_tree
+from tests.test_asyncvt import AV_LIST, virustotal
+import requests, transport
+
+def closed_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class RetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockServer()
+        self.server.route('GET', '/busy', lambda handler: handler.reply(503, b''))
+        self.server.route('POST', '/busy', lambda handler: handler.reply(503, b''))
+        self.http = transport.Transport(retries=2, backoff=0)
+        return
+
+    def tearDown(self):
+        self.server.stop()
+        return
+
+    def test_get_is_retried(self):
+        self.assertEqual(self.http.get(self.server.url('/busy')).status_code, 503)
+        self.assertEqual(self.server.hits['/busy'], 3)
+        return
+
+    def test_post_is_not_retried(self):
+        self.assertEqual(self.http.post(self.server.url('/busy')).status_code, 503)
+        self.assertEqual(self.server.hits['/busy'], 1)
+        return
+
+    def test_idempotent_post_is_retried(self):
+        self.http.post(self.server.url('/busy'), idempotent=True)
+        self.assertEqual(self.server.hits['/busy'], 3)
+        return
+
+    def test_post_that_never_connected_is_retried(self):
+        url = "http://127.0.0.1:{}/scan".format(closed_port())
+        with self.assertRaises(requests.ConnectionError):
+            self.http.post(url)
+        self.assertEqual(self.http.stats()['/scan']['count'], 3)
+        return
+
+
+class ScanRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = scratch_tree()
+        self.tree.__enter__()
+        self.server = MockServer()
+        self.mock = MockVirusTotal(self.server, AV_LIST)
+        self.vt = virustotal(self.mock.api(), keys=1)
+        self.vt.http = transport.Transport(backoff=0)
+
+        # The first url/scan fails after VT read it.
+        self.failures = 1
+        self.server.route('POST', '/vtapi/v2/url/scan', self.flaky)
+        return
+
+    def tearDown(self):
+        # Nothing is left for a writer's timer to commit once the tree is gone.
+        self.vt.commit_outputs()
+        self.server.stop()
+        self.vt.store.close()
+        self.tree.__exit__()
+        return
+
+    def flaky(self, handler):
+        if (self.failures):
+            self.failures -= 1
+            handler.form()
+            handler.reply(503, b'')
+            return
+        self.mock.url_scan(handler)
+        return
+
+    def test_failed_scan_is_submitted_again_with_a_new_token(self):
+        scan_ids = self.vt.add_urls(['a.com', 'b.com'])
+
+        self.assertEqual(sorted(scan_ids), ['a.com', 'b.com'])
+        self.assertEqual(self.server.hits['/vtapi/v2/url/scan'], 2)
+        # Both calls were counted against the key.
+        self.assertEqual(list(self.vt.scheduler.stats().values())[0]['used'], 2)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
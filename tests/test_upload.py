@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+#
+# test_upload.py
+# upload.py against MockFileScanner: only unknown samples are uploaded, and
+# samples over 32MB go through an upload url, streamed from disk.
+# VTW_LARGE_SAMPLE_MB sets the size of the large sample, 64MB by default.
+# Try 2048 to send a 2GB one.
+import hashlib, os, subprocess, sys, unittest
+from tests.mockserver import MockServer, MockFileScanner, scratch_tree, ROOT
+import keyscheduler, transport, upload
+
+LARGE_SAMPLE = int(os.environ.get('VTW_LARGE_SAMPLE_MB', 64)) * 1024 * 1024
+AV_LIST = open(os.path.join(ROOT, 'config/AV-file_scanners'), 'r').read().splitlines()
+
+# Uploads one sample and prints the peak RSS in KB before and after.
+UPLOAD_SCRIPT = """
+import resource, sys
+sys.path.insert(0, sys.argv[1])
+import transport, upload
+u = upload.upload(apikey='k', malDir=sys.argv[3], premium=True)
+u.api = sys.argv[2]
+u.http = transport.Transport()
+u.progress = lambda *args: None
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+response = u.upload_malware(sys.argv[4])
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(before, after, response.json()['scan_id'])
+"""
+
+def write_sample(path, data, size=None):
+    with open(path, 'wb') as f:
+        f.write(data)
+        # The rest is a hole, so a large sample costs no disk.
+        if (size):
+            f.truncate(size)
+    return
+
+def sha256_of(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+class UploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = scratch_tree()
+        self.path = self.tree.__enter__()
+        self.server = MockServer()
+        self.mock = MockFileScanner(self.server, AV_LIST, analysis_delay=0.1)
+        self.samples = os.path.join(self.path, 'samples')
+        os.makedirs(self.samples)
+        return
+
+    def tearDown(self):
+        self.server.stop()
+        self.tree.__exit__()
+        return
+
+    def uploader(self):
+        u = upload.upload(apikey='k', malDir=self.samples, premium=True)
+        u.api = self.mock.api()
+        u.http = transport.Transport()
+        u.scheduler = keyscheduler.KeyScheduler(["key-{}".format(i) for i in range(0, 40)], premium=True)
+        u.reports.first_poll = 0.05
+        u.reports.max_interval = 0.2
+        u.hash_workers = 1
+        u.progress = lambda *args: None
+        return u
+
+    def test_only_unknown_samples_are_uploaded(self):
+        write_sample(os.path.join(self.samples, 'known.exe'), b'known sample')
+        write_sample(os.path.join(self.samples, 'new.exe'), b'new sample')
+        write_sample(os.path.join(self.samples, 'copy.exe'), b'new sample')
+        known = sha256_of(os.path.join(self.samples, 'known.exe'))
+        self.mock.known[known] = self.mock.report(known)
+
+        u = self.uploader()
+        resolved = u.analyze(sorted(u.filename_list(self.samples)))
+
+        new = sha256_of(os.path.join(self.samples, 'new.exe'))
+        # Copies of a sample are only sent once.
+        self.assertEqual(self.mock.uploads, [('/vtapi/v2/file/scan', len(b'new sample'), new)])
+        self.assertEqual(resolved, set([known, new]))
+        self.assertEqual(len(open('data/Malware-Analysis.csv').read().splitlines()), 2)
+
+        # Both are cached now, a second run doesn't call VT.
+        hits = sum(self.server.hits.values())
+        self.assertEqual(self.uploader().analyze(['known.exe', 'new.exe']), set([known, new]))
+        self.assertEqual(sum(self.server.hits.values()), hits)
+        return
+
+    def test_large_sample_goes_to_an_upload_url(self):
+        sample = os.path.join(self.samples, 'large.bin')
+        write_sample(sample, b'large sample', LARGE_SAMPLE)
+        sha = sha256_of(sample)
+
+        resolved = self.uploader().analyze(['large.bin'])
+
+        self.assertEqual(self.server.hits['/vtapi/v2/file/scan/upload_url'], 1)
+        self.assertEqual(self.mock.uploads, [('/upload/0', LARGE_SAMPLE, sha)])
+        self.assertEqual(resolved, set([sha]))
+        return
+
+    def test_upload_memory_does_not_grow_with_the_sample(self):
+        # A process of its own, since ru_maxrss is the peak of the whole process.
+        write_sample(os.path.join(self.samples, 'large.bin'), b'large sample', LARGE_SAMPLE)
+        output = subprocess.check_output([sys.executable, '-c', UPLOAD_SCRIPT,
+            ROOT, self.mock.api(), self.samples, 'large.bin'], cwd=self.path)
+        before, after, scan_id = output.decode('utf-8').split()
+
+        self.assertEqual(self.mock.uploads[0][1], LARGE_SAMPLE)
+        # ru_maxrss is in KB. A few 1MB chunks in flight, not the sample.
+        growth = (int(after) - int(before)) * 1024
+        self.assertLess(growth, 16 * 1024 * 1024, "{:.1f}MB for a {}MB sample".format(growth / 1048576.0, LARGE_SAMPLE // 1048576))
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+#
+# transport.py
+# Shared HTTP transport for every VT call.
+# Calling requests.post/requests.get directly opens a new connection, and pays
+# for a new TLS handshake, on every call. A single pooled Session keeps the
+# connections to www.virustotal.com alive between calls.
+# 1. Connect and read timeouts on every request.
+# 2. gzip responses.
+# 3. Connection errors, timeouts and 5xx are retried with jittered exponential backoff.
+#    A POST like url/scan may have been accepted, and charged, before it failed, so it
+#    is only retried when it never reached VT. The caller decides what to do otherwise.
+# 4. Latency histogram per endpoint.
+import bisect, logging, random, threading, time
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+# Upper bounds, in seconds, of the latency histogram buckets. The last bucket is everything slower.
+BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+RETRY_STATUS = (500, 502, 503, 504)
+IDEMPOTENT = ('GET', 'HEAD', 'OPTIONS')
+
+def connect_failed(error):
+    '''
+        True if the request never reached the server, so it can't have been done twice.
+        urllib3's NewConnectionError (refused, unreachable) is a ConnectTimeoutError too.
+    '''
+    if (isinstance(error, requests.ConnectTimeout)):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if (error.args) else None
+    return isinstance(reason, ConnectTimeoutError)
+
+class Transport:
+
+    def __init__(self, pool_size=16, connect_timeout=10, read_timeout=60, retries=3, backoff=1.0):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate', 'User-Agent': 'VirusTotalWrapper'})
+        self.lock = threading.Lock()
+        self.histograms = {}    # endpoint -> [count per bucket]
+        self.totals = {}        # endpoint -> (count, seconds)
+        return
+
+    def observe(self, url, seconds):
+        endpoint = urlparse(url).path
+        with self.lock:
+            if (endpoint not in self.histograms):
+                self.histograms[endpoint] = [0] * (len(BUCKETS) + 1)
+                self.totals[endpoint] = (0, 0.0)
+            self.histograms[endpoint][bisect.bisect_left(BUCKETS, seconds)] += 1
+            count, total = self.totals[endpoint]
+            self.totals[endpoint] = (count + 1, total + seconds)
+        return
+
+    def wait(self, attempt):
+        '''
+            Full jitter: anywhere between 0 and backoff * 2^attempt seconds.
+        '''
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+        return
+
+    def request(self, method, url, retries=None, idempotent=None, **kwargs):
+        '''
+            Same arguments as requests.request. retries=0 for requests that
+            can't be sent twice, like a file being streamed.
+            Only idempotent requests, GETs by default, are retried after a timeout
+            or a 5xx. The others are only retried when they couldn't connect.
+        '''
+        retries = self.retries if (retries is None) else retries
+        idempotent = (method in IDEMPOTENT) if (idempotent is None) else idempotent
+        kwargs.setdefault('timeout', self.timeout)
+
+        for attempt in range(0, retries + 1):
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+
+            except (requests.ConnectionError, requests.Timeout) as error:
+                self.observe(url, time.monotonic() - start)
+                if (attempt == retries) or not (idempotent or connect_failed(error)):
+                    raise
+                logging.debug("{} {} failed. Retry {}/{}".format(method, url, attempt + 1, retries))
+                self.wait(attempt)
+                continue
+
+            self.observe(url, time.monotonic() - start)
+            if (response.status_code in RETRY_STATUS) and (attempt < retries) and (idempotent):
+                logging.debug("{} {} returned {}. Retry {}/{}".format(method, url, response.status_code, attempt + 1, retries))
+                self.wait(attempt)
+                continue
+            return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        '''
+            Per endpoint: count, mean latency and the histogram as {'<=bound': count}.
+        '''
+        labels = ["<={}s".format(bound) for bound in BUCKETS] + [">{}s".format(BUCKETS[-1])]
+        with self.lock:
+            return dict((endpoint, {
+                'count': self.totals[endpoint][0],
+                'mean': self.totals[endpoint][1] / max(self.totals[endpoint][0], 1),
+                'histogram': dict((label, count) for label, count in zip(labels, histogram) if count),
+            }) for endpoint, histogram in self.histograms.items())
+
+
+shared_transport = None
+shared_lock = threading.Lock()
+
+def shared():
+    '''
+        The one Transport every module uses, so they share the connection pool.
+    '''
+    global shared_transport
+    with shared_lock:
+        if (shared_transport is None):
+            shared_transport = Transport()
+        return shared_transport
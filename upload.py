@@ -2,24 +2,70 @@
 #
 # Name: VT upload
 # Description: Determines if malware has already been uploaded. if it hasn't, upload. Get results on malware.
-from os import listdir, getcwd, fsync
-from os.path import isfile, join, exists
-import hashlib, requests, time, datetime
+#
+# Usage: python3 upload.py
+#        python3 upload.py watch <malware directory> <API key file> [premium] [interval]
+#   watch runs unattended. New or changed samples are picked up every interval seconds (60).
+from os import listdir, getcwd, fsync, fstat, cpu_count
+from os.path import isfile, join, exists, getsize
+from concurrent.futures import ProcessPoolExecutor
+import hashlib, logging, mmap, sys, time, datetime, keyscheduler, multipart, pending, reportcache, sampleindex, transport
+
+LARGE_FILE = 32 * 1024 * 1024   # file/scan only takes samples up to 32MB
+
+def sha256_file(path):
+    '''
+        Hashes a whole file through mmap, so the OS pages it in
+        instead of Python reading it 64KB at a time.
+        Module level, so a process pool can run it.
+    '''
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as afile:
+        # An empty file can't be mapped.
+        if (fstat(afile.fileno()).st_size == 0):
+            return hasher.hexdigest()
+        with mmap.mmap(afile.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            hasher.update(buf)
+    return hasher.hexdigest()
 
 class upload:
 
-    def __init__(self):
-        self.apikey = self.get_api()
-        self.malDir = self.malware_directory()
+    def __init__(self, apikey=None, malDir=None, premium=None):
+        # Anything not given is asked for.
+        self.apikey = apikey if (apikey) else self.get_api()
+        self.premium = premium if (premium is not None) else self.get_premium()
+        self.scheduler = keyscheduler.KeyScheduler([self.apikey], premium=self.premium)
+        self.malDir = malDir if (malDir) else self.malware_directory()
         self.malware_list = self.filename_list(self.malDir)
         self.av_list_file_scanners = open('config/AV-file_scanners', 'r').read().splitlines()
         self.analysis = None
         self.analysis_file = 'data/Malware-Analysis.csv'
+        self.api = 'https://www.virustotal.com/vtapi/v2/'   # The tests point it at a local mock
+        self.http = transport.shared()  # Pooled keep-alive connections for every VT call
+        self.reports = pending.PendingReports(self.batch_results, self.results_completed, batch_size=self.batch_size(), first_poll=60, max_interval=600)
+        self.cache = reportcache.ReportCache()     # sha256 -> report. Known samples cost no quota.
+        self.hashes = {}
+        self.hash_workers = cpu_count() or 1
+        self.index = None
 
     def get_api(self):
         self.apikey = input("API Key?: ")
         return self.apikey
 
+    def get_premium(self):
+        premium = input("Is your API key premium (25 requests/minute)? (y/n) ")
+        if (premium.lower() == "yes" or premium.lower() == "y"):
+            return True
+        return False
+
+    def batch_size(self):
+        '''
+            file/report accepts up to 4 resources per call with a public key, 25 with a paid key.
+        '''
+        if (self.premium):
+            return 25
+        return 4
+
     def malware_directory(self):
         '''
             Determines where the directory containin malware is located.
@@ -54,42 +100,105 @@ class upload:
 
     def get_sha256(self, filename):
         '''
-            Given a file, this will gather the 
+            Given a file, this will gather the sha256 of it.
         '''
-        filename = self.malDir + "/" + filename   # Gives full path of file
-        BLOCKSIZE = 65536
-        hasher = hashlib.sha256()
-        with open(filename, 'rb') as afile:
-            buf = afile.read(BLOCKSIZE)
-            while len(buf) > 0:
-                hasher.update(buf)
-                buf = afile.read(BLOCKSIZE)
-        return hasher.hexdigest()
+        return sha256_file(join(self.malDir, filename))   # Gives full path of file
 
     def collect_sha256(self, malware_list):
         '''
             Given a list of filenames.
-            open each up and get the sha256 of the file.
+            Hashes them in parallel, one process per core.
         '''
-        sha_list = []
-        for i in range(0, len(malware_list)):
-            sha_hash = self.get_sha256(malware_list[i])
-            sha_list.append(sha_hash)
+        paths = [join(self.malDir, filename) for filename in malware_list]
+
+        if (len(paths) < 2) or (self.hash_workers < 2):
+            sha_list = [sha256_file(path) for path in paths]
+        else:
+            with ProcessPoolExecutor(max_workers=self.hash_workers) as pool:
+                sha_list = list(pool.map(sha256_file, paths, chunksize=8))
+
         self.sha_list = sha_list
-        return
+        self.hashes.update(zip(malware_list, sha_list))
+        return sha_list
+
+    def lookup(self, sha_list):
+        '''
+            Asks VT about every hash, batch_size hashes per file/report call.
+            Hashes in the cache aren't sent.
+            Returns (known, queued, unknown):
+              known: {sha256: report}
+              queued: hashes VT is still analysing
+              unknown: hashes VT has never seen
+        '''
+        known = {}
+        queued = []
+        unknown = []
+        missing = []
 
+        for sha in dict.fromkeys(sha_list):
+            cached = self.cache.get(sha)
+            if (cached):
+                known[sha] = cached
+            else:
+                missing.append(sha)
+
+        for i in range(0, len(missing), self.batch_size()):
+            batch = missing[i:i + self.batch_size()]
+
+            try:
+                reports = self.batch_results(batch)
+            except:
+                logging.exception("message")
+                continue
+
+            # Reports come back in the order the hashes were sent.
+            for j in range(0, len(batch)):
+                if (j >= len(reports)) or not (reports[j]):
+                    logging.debug("No report for {}".format(batch[j]))
+                elif (self.results_completed(reports[j])):
+                    known[batch[j]] = reports[j]
+                    self.cache.put(batch[j], reports[j])
+                elif (reports[j].get('response_code') == -2):
+                    queued.append(batch[j])
+                elif (reports[j].get('response_code') == 0):
+                    unknown.append(batch[j])
+        return (known, queued, unknown)
 
     def filename_list(self, mypath):
         self.malware_list = [f for f in listdir(mypath) if isfile(join(mypath, f))]
         return self.malware_list
 
-    def upload_malware(self, filename):
-        url = 'https://www.virustotal.com/vtapi/v2/file/scan'
-        params = {'apikey': self.apikey}
+    def upload_url(self):
+        '''
+            Samples over 32MB have to be sent to a one time upload url.
+        '''
+        params = {'apikey': self.scheduler.acquire()}
+        response = self.http.get(self.api + 'file/scan/upload_url', params=params)
+        return response.json()['upload_url']
+
+    def progress(self, sent, total, seconds):
+        rate = sent / seconds if (seconds) else 0
+        sys.stdout.write("\r{:.1f}/{:.1f} MB ({:.0%}) {:.2f} MB/s".format(
+            sent / 1048576.0, total / 1048576.0, sent / total if (total) else 1, rate / 1048576.0))
+        if (sent >= total):
+            sys.stdout.write("\n")
+        sys.stdout.flush()
+        return
 
+    def upload_malware(self, filename):
+        '''
+            Streams the sample from disk, so memory doesn't grow with its size.
+        '''
+        url = self.api + 'file/scan'
         fullpath = self.malDir + "/" + filename
-        files = {'file': (filename, open(fullpath, 'rb'))}
-        response = requests.post(url, files=files, params=params)
+
+        if (getsize(fullpath) > LARGE_FILE):
+            url = self.upload_url()
+        params = {'apikey': self.scheduler.acquire()}
+
+        with multipart.MultipartFile('file', filename, fullpath, progress=self.progress) as body:
+            # A body that was half sent can't be sent again.
+            response = self.http.post(url, data=body, params=params, headers={'Content-Type': body.content_type}, retries=0)
         return response
         #return response.json()
 
@@ -99,10 +208,8 @@ class upload:
             Input can be scan_id or "resource"
         '''
         # These are for the request to VT's server
-        params = {'apikey': self.apikey, 'resource':scan_id}
-        headers = {"Accept-Encoding": "gzip, deflate",\
-            "User-Agent" : "gzip,  My Python requests library example client or username"}
-        response = requests.get('https://www.virustotal.com/vtapi/v2/file/report', params=params, headers=headers)
+        params = {'apikey': self.scheduler.acquire(), 'resource':scan_id}
+        response = self.http.get(self.api + 'file/report', params=params)
 
         # There's a case where the response is empty
         if not (response):
@@ -111,24 +218,37 @@ class upload:
         json_response = response.json()
         return json_response
 
+    def batch_results(self, scan_ids):
+        '''
+            file/report takes up to 4 comma separated resources per call.
+            Returns a list of results in the same order.
+        '''
+        result = self.results(", ".join(scan_ids))
+        if (type(result) == list):
+            return result
+        if (result):
+            return [result]
+        return []
+
     def get_report(self, scan_id):
         '''
             Given a scan_id
-            get the report of a malicious file from VT
+            get the report of a malicious file from VT.
+            Every other scan still pending is polled with it.
         '''
-        result = self.results(scan_id)
-        if (self.results_completed(result)):
+        self.reports.add(scan_id, scan_id)
+        for scan_id, result in self.reports.wait().items():
             # Put result in csv
             self.csv_output(result)
-        
-        else:
-            print("Analysis of Malware not complete. Sleeping 60s...")
-            time.sleep(60)
-            self.get_report(scan_id)
+
+        for scan_id in self.reports.expired:
+            print("Analysis of {} never completed.".format(scan_id))
+            logging.debug("Analysis of {} never completed.".format(scan_id))
+        self.reports.expired = []
         return
 
     def results_completed(self, result):
-        if (result['response_code'] is not 1):
+        if not (result) or (result.get('response_code') != 1):
             return False
         return True
 
@@ -138,11 +258,60 @@ class upload:
             This is the main function.
             Given a filename, it will get the report and output it to a csv.
         '''
-        response = self.upload_malware(filename)
-        scan_id = response.json()['scan_id']
-        self.get_report(scan_id)
+        self.analyze([filename])
         return
 
+    def analyze(self, malware_list):
+        '''
+            Hashes every sample, looks the hashes up in bulk
+            and only uploads the samples VT has never seen.
+            Returns the hashes that have a report: cached, looked up, or
+            analysed after an upload. Failed lookups and uploads aren't in it.
+        '''
+        self.collect_sha256(malware_list)
+        cached = set(sha for sha in self.sha_list if (sha in self.cache))
+        known, queued, unknown = self.lookup(self.sha_list)
+        resolved = set(known)
+
+        # Samples in the cache are already in Malware-Analysis.csv.
+        for sha, result in known.items():
+            if (sha not in cached):
+                self.csv_output(result)
+
+        for sha in queued:
+            self.reports.add(sha, sha)
+
+        uploaded = 0
+        unknown = set(unknown)
+        for filename in malware_list:
+            sha = self.hashes[filename]
+            if (sha not in unknown):
+                continue
+            # Copies of the same sample are only sent once.
+            unknown.discard(sha)
+
+            try:
+                response = self.upload_malware(filename)
+                self.reports.add(response.json()['scan_id'], sha)
+                uploaded += 1
+            except:
+                logging.exception("message")
+
+        for sha, result in self.reports.wait().items():
+            self.cache.put(sha, result)
+            self.csv_output(result)
+            resolved.add(sha)
+
+        for sha in self.reports.expired:
+            print("Analysis of {} never completed.".format(sha))
+            logging.debug("Analysis of {} never completed.".format(sha))
+        self.reports.expired = []
+
+        self.cache.save()
+        logging.info("{} samples: {} cached, {} looked up, {} queued by VT, {} uploaded".format(
+            len(malware_list), len(cached), len(known) - len(cached), len(queued), uploaded))
+        return resolved
+
     def cell(self, av_result):
         '''
             Given a single av_result by vt,
@@ -189,10 +358,54 @@ class upload:
             fsync(self.analysis.fileno())
         return
 
+    def watch(self, interval=60):
+        '''
+            Daemon mode. Polls the malware directory and only hashes and
+            submits the samples that are new or changed since the last pass,
+            including the passes of earlier runs. See sampleindex.py
+        '''
+        self.index = sampleindex.SampleIndex()
+        logging.info("Watching {}. {} samples already indexed.".format(self.malDir, len(self.index)))
+
+        while True:
+            try:
+                changed = self.index.scan(self.malDir)
+                if (changed):
+                    print("{} new or changed samples.".format(len(changed)))
+                    resolved = self.analyze(list(changed))
+
+                    # Samples whose lookup or upload failed, or whose report never came,
+                    # aren't recorded, so they are tried again on the next pass.
+                    for filename, (mtime, size) in changed.items():
+                        if (self.hashes[filename] in resolved):
+                            self.index.record(filename, mtime, size, self.hashes[filename])
+                self.index.save()
+
+            except KeyboardInterrupt:
+                raise
+            except:
+                # Nothing from this pass was recorded, so the same samples are tried again.
+                logging.exception("message")
+
+            time.sleep(interval)
+
 def main():
+    if (len(sys.argv) > 1) and (sys.argv[1] == 'watch'):
+        if (len(sys.argv) < 4):
+            print("Usage: python3 upload.py watch <malware directory> <API key file> [premium] [interval]")
+            return
+
+        logging.basicConfig(filename='logs/upload.log', level=logging.INFO, format='%(asctime)s %(message)s')
+        apikey = open(sys.argv[3], 'r').read().split()[0]
+        premium = 'premium' in sys.argv[4:]
+        interval = [int(arg) for arg in sys.argv[4:] if arg.isdigit()]
+        c = upload(apikey=apikey, malDir=sys.argv[2], premium=premium)
+        c.watch(interval[0] if (interval) else 60)
+        return
+
     c = upload()
     print(c.malware_list)
-    c.sha_list = c.collect_sha256(c.malware_list)
+    c.analyze(c.malware_list)
     return
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#
+# verdictcache.py
+# On-disk cache of the last VT verdict of every domain/url.
+# Reprocessing a domain that was scanned minutes ago wastes quota,
+# so VirusTotal asks the cache before sending anything.
+# 1. Entries expire after a TTL. Suspicious entries expire sooner.
+# 2. Least recently used entries are evicted past max_entries.
+# 3. Hits, misses and expired lookups are counted.
+# 4. Only the AVs that didn't call a url clean are kept. That is all the scoring,
+#    the rollup and the recheck queue look at, and a few entries instead of 70+.
+# 5. The file is only rewritten when an entry was added or dropped.
+import json, logging, normalize, os, time
+from collections import OrderedDict
+
+DAY = 86400
+CLEAN = ('clean site', 'unrated site')
+
+def cache_key(url):
+    '''
+        'http://Example.com/' and 'example.com' are the same entry. See normalize.key
+    '''
+    return normalize.key(url)
+
+class VerdictCache:
+
+    def __init__(self, filename='data/verdict-cache.json', ttl=7*DAY, suspicious_ttl=DAY, max_entries=100000):
+        self.filename = filename
+        self.ttl = ttl
+        self.suspicious_ttl = suspicious_ttl    # Suspicious but not blacklisted entries flip more often
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.changed = False
+        self.load()
+        return
+
+    def key(self, url):
+        return cache_key(url)
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as f:
+                self.entries = OrderedDict(json.load(f))
+
+            # Entries saved before they were compacted.
+            for entry in self.entries.values():
+                entry['result'] = self.compact(entry['result'])
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logging.debug("{} is corrupt. Starting with an empty cache.".format(self.filename))
+        return
+
+    def save(self):
+        if not (self.changed):
+            return
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, 'w') as f:
+            json.dump(list(self.entries.items()), f)
+        os.replace(temp_filename, self.filename)
+        self.changed = False
+        return
+
+    def flagged(self, av_result):
+        if (av_result.get('detected')):
+            return True
+        if (av_result.get('result') not in CLEAN):
+            return True
+        return False
+
+    def compact(self, result):
+        '''
+            The result with only the AVs that didn't call it clean, without their details.
+        '''
+        scans = {}
+        for av, av_result in result.get('scans', {}).items():
+            if (self.flagged(av_result)):
+                scans[av] = {'detected': av_result.get('detected'), 'result': av_result.get('result')}
+        return {'url': result.get('url'), 'scans': scans, 'scan_date': result.get('scan_date')}
+
+    def suspicious(self, result):
+        '''
+            At least one AV didn't call it clean.
+        '''
+        for av_result in result.get('scans', {}).values():
+            if (self.flagged(av_result)):
+                return True
+        return False
+
+    def get(self, url):
+        '''
+            Returns the cached result of url, or None if there isn't a fresh one.
+        '''
+        key = self.key(url)
+        entry = self.entries.get(key)
+
+        if (entry is None):
+            self.misses += 1
+            return
+
+        if (time.time() > entry['expires']):
+            del self.entries[key]
+            self.expired += 1
+            self.changed = True
+            return
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry['result']
+
+    def expires(self, url):
+        '''
+            When the cached result of url expires, or None if there isn't one.
+        '''
+        entry = self.entries.get(self.key(url))
+        if (entry is None):
+            return
+        return entry['expires']
+
+    def put(self, url, result, malicious):
+        if not (result) or ('scans' not in result):
+            return
+
+        key = self.key(url)
+
+        # A cached result being recorded again keeps its original expiry.
+        if (key in self.entries) and (self.entries[key]['result'] is result):
+            return
+
+        ttl = self.ttl
+        if (not malicious) and (self.suspicious(result)):
+            ttl = self.suspicious_ttl
+
+        result = self.compact(result)
+        result['url'] = result['url'] or url
+        self.entries[key] = {
+            'result': result,
+            'malicious': malicious,
+            'expires': time.time() + ttl,
+        }
+        self.entries.move_to_end(key)
+        self.changed = True
+
+        while (len(self.entries) > self.max_entries):
+            self.entries.popitem(last=False)
+        return
+
+    def stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses, 'expired': self.expired}
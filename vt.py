@@ -22,20 +22,28 @@
 # https://stackoverflow.com/questions/22698244/how-to-merge-two-json-string-in-python
 # Merge two json strings to one json
 from pathlib import Path
-from urllib.parse import urlparse
-import Mallector, requests, logging
-import time, os, datetime, sys, re
+import Mallector, asyncvt, columnar, groupcommit, keyscheduler, normalize, pending, recheck, rollup, schema, scoring, store, transport, verdictcache, logging
+import time, os, datetime, sys
 
 class VirusTotal:
 
     def __init__(self):
         self.update = True
+        self.async_mode = False
         self.keyblade = None
         self.keyring = None
         self.new_key = True
-        self.key_index = 0
-        self.collector = Mallector.Mallector()
+        self.premium = False    # Paid keys get 25 requests/minute instead of 4
+        self.scheduler = None
+        self.reports = None     # Scans waiting on their report. See pending.py
+        self.http = transport.shared()  # Pooled keep-alive connections for every VT call
+        self.api = 'https://www.virustotal.com/vtapi/v2/'   # The tests point it at a local mock
+        self.cache = verdictcache.VerdictCache()
         self.av_list = open('config/VT-AVs', 'r').read().splitlines()
+        self.scorer = scoring.Scorer(self.av_list)
+        self.schema = schema.AnalysisSchema(self.av_list)
+        self.store = store.Store()
+        self.collector = Mallector.Mallector(self.store)
         self.potentials = None
         self.potentials_file = 'data/Potentials.txt'
         self.blk = None
@@ -45,8 +53,20 @@ class VirusTotal:
         self.processed = None
         self.processed_file = 'data/Processed_file.txt'
         self.cycles = 0
-        self.reprocess_line = 0 # Used to determine what line the reprocessing function is on
+        self.recheck = recheck.RecheckQueue()   # Decides which processed domains are rechecked first
+        self.rollup = rollup.Rollup()   # Scans hosts before the urls under them
         self.data = [self.analysis_file, self.blk_file, self.potentials_file, self.processed_file]
+        self.blk_writer = None
+        self.processed_writer = None
+        self.columnar = columnar.ColumnarSink('data/analysis', self.av_list)   # Compact copy of Full-Analysis.csv
+
+        # First run with a store. Brings in everything the text files know.
+        if (self.store.empty()):
+            self.store.import_files(self.potentials_file, self.processed_file, self.blk_file, self.analysis_file, self.av_list)
+
+        # Same for the columnar sink, before any live scan is appended after the older ones.
+        if not (self.columnar.rows):
+            columnar.import_csv(self.columnar, self.analysis_file, self.av_list)
         logging.basicConfig(filename='logs/vt.log', level=logging.DEBUG, format='%(asctime)s %(message)s')
         return
     
@@ -55,6 +75,33 @@ class VirusTotal:
             return True
         return False
     
+    def open_outputs(self):
+        '''
+            Verdicts are written through group commit writers,
+            one fsync per batch instead of one per line.
+        '''
+        if (self.files_exist(self.analysis_file)):
+            self.analysis = groupcommit.GroupCommitWriter(self.analysis_file)
+
+            # config/VT-AVs changed since the last header. Rows after this follow the new one.
+            if not (self.schema.current()):
+                self.write_header()
+
+        else:
+            self.csv_format() # Formats output file for csv
+
+        self.blk_writer = groupcommit.GroupCommitWriter(self.blk_file)
+        self.processed_writer = groupcommit.GroupCommitWriter(self.processed_file)
+        return
+
+    def commit_outputs(self):
+        for writer in (self.analysis, self.blk_writer, self.processed_writer):
+            if (writer is not None):
+                writer.commit()
+        self.columnar.flush()
+        self.collector.seen.flush()
+        return
+
     def files_exist(self, filename):
         the_file = Path(filename)
         if (the_file.is_file()):
@@ -101,22 +148,10 @@ class VirusTotal:
             print("{}/{}".format(i, len(domainList)))
             
             try:
-                result = self.request(domainList[i])
-                domain = result['url']
-                row = domain + ","
-                ts = time.time()
-                timestamp = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
-                row += ",{},,,,,".format(timestamp) # This is the number of columns until the spreadsheet records AVs.
-                scanResults = result['scans']
-                
-                for i in range(0, len(self.av_list)):
-                    try:
-                        row += self.cell(scanResults[self.av_list[i]])
-                    except:
-                        pass
-                    row += ","
-                
-                row += "\n"
+                # Every AV gets a column, so the cache, which only keeps the flagged ones, isn't used.
+                result = self.request(domainList[i], cache=False)
+                row, unseen = self.schema.row(result['url'], time.time(), result['scans'])
+                self.schema.write_unseen(unseen)
                 try:
                     analysis.write(row)
                 except:
@@ -141,30 +176,25 @@ class VirusTotal:
     def persistent_analysis(self):
         '''
             Driver.
-            1. Reads domain list from file
+            1. Reads domain list from the store
             2. Creates output file
             3. Formats output file
             4. Gives url to 
         '''
         # Determine if files exist, if they don't create them.
-        # Full-Analysis.txt
-        if (self.files_exist(self.analysis_file)):
-            self.analysis = open(self.analysis_file, 'a')
+        # Full-Analysis.csv
+        if (self.analysis is None):
+            self.open_outputs()
 
-        else:
-            self.csv_format() # Formats output file for csv
-            self.analysis.flush()
-            os.fsync(self.analysis.fileno())
+        # Whatever the last run submitted but didn't record.
+        self.resume()
 
-        # GlobalBlacklist.txt
-        if not (self.files_exist(self.blk_file)):
-            self.blk = open(self.blk_file, 'a')
-            self.blk.close()
-        
-        # Processed_file.txt
-        if not (self.files_exist(self.processed_file)):
-            self.processed = open(self.processed_file, 'a')
-            self.processed.close()
+        # The queue is read from the store. Potentials.txt is only the log of what
+        # was queued, so it is cleared of processed domains once per run, not every cycle.
+        # Buffered verdicts go out before dedupe replaces the files. See groupcommit.py
+        self.commit_outputs()
+        self.collector.dedupe_all()
+        self.collector.already_processed()
 
         # Blacklist output file. New file each day.
         # Removing blacklist file per day. Going to make it one master blacklist.
@@ -175,6 +205,9 @@ class VirusTotal:
             # Number of cycles
             print("Number of cycles: {}".format(self.cycles))
 
+            # Reports that came due since the last cycle. Slow ones stay in the tracker.
+            self.collect_reports()
+
             if (self.update):
                 # Updates feeds
                 self.collector.update_feeds()
@@ -182,364 +215,608 @@ class VirusTotal:
                 # Gathers all new domains from feeds
                 self.collector.collect(self.potentials_file)
 
-            # Cleans all duplicates in all three files.
-            self.collector.dedupe_all()
-
-            # Cleans all domains that have already been processed
-            self.collector.already_processed()
-
-            # Creates a list of potentially malicious domains from potential.txt
+            # Any potentially malicious domains queued in the store
             new_potentials = self.new_pdomains()
 
             if (new_potentials):
-
-                # Analysis Output file. Contains all AV results per request
-                with open(self.potentials_file, 'r') as self.potentials:
-                    domainList = self.potentials.read().split()
-
-                for i in range(0, len(domainList)):
-                    print("{}/{}".format(i, len(domainList)))
-                    
-                    try:
-                        result = self.request(domainList[i])
-                        print("result: {}".format(result))
-
-                        # Determine if domain is malicious
-                        # If both Forcepoint ThreatSeeker and Fortinet return True,
-                        # it is malicious.
-                        if (self.is_malicious(result)):
-                            print('{} is MALICIOUS!'.format(domainList[i]))
-
-                            with open(self.blk_file, 'a') as self.blk:
-                                clean_domain = self.domain_clean(domainList[i])
-                                self.blk.write(clean_domain + "\n")
-                                self.blk.flush()
-                                os.fsync(self.blk.fileno())
-
-                        else:
-                            print('{} is NOT malicious!'.format(domainList[i]))
-                            with open(self.processed_file, 'a') as self.processed:
-                                self.processed.write(domainList[i] + "\n")
-                                self.processed.flush()
-                                os.fsync(self.processed.fileno())
-
-                        self.csv_output(result)
-
-                    except:
-                        print("Check persistent analysis..")
-                        logging.debug("Check persistent analysis.\n")
-                        pass
-                
-                self.analysis.close()
+                self.scan_queue()
                 
             else:
                 logging.info("No new potentially malicious domains.")
-                logging.info("Reprocessing starting on line {}".format(self.reprocess_line))
+                logging.info("Reprocessing {} queued domains.".format(len(self.recheck.entries)))
                 
                 # Reprocessed the processed list to see if anything has changed
                 self.reprocess()
 
             # Keep track of the number of times this program has looped.
             self.cycles += 1
+            self.commit_outputs()
+            logging.info("Key usage: {}".format(self.key_scheduler().stats()))
+            logging.info("VT latency: {}".format(self.http.stats()))
+            self.cache.save()
+
+        return
+
+    def scan_queue(self):
+        '''
+            Scans the queued domains, the hosts the rollup groups them under first.
+        '''
+        # Pending only. Domains already submitted have their reports in the tracker.
+        domainList = self.store.pending()
+
+        # Hosts first. Their verdicts decide which urls under them still need a scan.
+        first, children, aliases = self.rollup.plan(domainList)
+
+        # A host that wasn't queued is queued now, so it is scanned again
+        # if its report never comes, like any other entry.
+        self.collector.enqueue(children)
+
+        self.scan_list(first)
+
+        # Only the hosts' verdicts are waited on. Everything else is collected when it is due.
+        self.wait_for(children)
+        self.scan_list(self.rollup_children(children, aliases))
+        logging.info("Rollup: {}".format(self.rollup.stats()))
+
+        self.commit_outputs()
+        return
+
+    def scan_list(self, domainList):
+        '''
+            Submits every domain in domainList and records the verdicts that are ready.
+            Scans VT is still analysing stay in the report tracker, across cycles,
+            so a slow analysis never holds up the queue.
+        '''
+        if (self.async_mode):
+            # Keeps many scans and reports in flight at once.
+            asyncvt.AsyncVirusTotal(self).analyze(domainList)
+
+        else:
+            # Packs the queue into as few url/scan calls as possible.
+            step = self.batch_size()
+            for i in range(0, len(domainList), step):
+                print("{}/{}".format(i, len(domainList)))
+                batch = domainList[i:i + step]
+
+                try:
+                    self.submit_batch(batch)
+
+                    # Reports that are due are collected between submissions.
+                    # A slow analysis waits in the tracker instead of holding up the queue.
+                    self.collect_reports()
+
+                except:
+                    print("Check persistent analysis..")
+                    logging.debug("Check persistent analysis.\n")
+                    continue
 
+            self.collect_reports()
         return
+
+    def rollup_children(self, children, aliases=None):
+        '''
+            Given {host: urls under it}, decides from each host's verdict which
+            urls still need a scan. See rollup.py
+            The others are recorded as covered by their host.
+            aliases are {host: other spellings of it}, recorded with its verdict.
+            Returns the urls to scan.
+        '''
+        scan = []
+        aliases = aliases or {}
+        for head, members in children.items():
+            status = self.store.status(head)
+            result = self.cache.get(head)
+            suspicious = bool(result) and self.cache.suspicious(result)
+
+            # A host that couldn't be scanned keeps its other spellings queued for next cycle.
+            if (status in ('processed', 'blacklisted')):
+                for domain in aliases.get(head, []):
+                    self.record_covered(domain, head, status == 'blacklisted')
+
+            keep, covered = self.rollup.split(members, self.rollup.decide(status, suspicious))
+            scan += keep
+            for domain in covered:
+                self.record_covered(domain, head, status == 'blacklisted')
+        return scan
+
+    def record_covered(self, domain, head, malicious):
+        '''
+            A url that didn't need its own scan, because of the verdict on its host.
+            It is marked processed, so it leaves Potentials.txt, and the store
+            remembers it the way its host was classified.
+        '''
+        if (domain not in self.collector.index):
+            self.processed_writer.write(domain + "\n")
+            self.collector.index.add(domain)
+        self.store.set_status([domain], 'blacklisted' if (malicious) else 'processed')
+        self.collector.seen.add(domain)
+        self.recheck.covered(domain, malicious)
+        return
+
+    def classify(self, domain, malicious):
+        '''
+            Writes domain to GlobalBlacklist.txt or Processed_file.txt
+            and takes it out of Potentials.txt.
+            Returns the cleaned domain that was blacklisted, if it is malicious.
+        '''
+        clean_domain = None
+
+        if (malicious):
+            print('{} is MALICIOUS!'.format(domain))
+
+            # Files are append only. Duplicates are never written.
+            clean_domain = self.domain_clean(domain)
+            if (clean_domain not in self.collector.blacklisted):
+                self.blk_writer.write(clean_domain + "\n")
+                self.collector.blacklisted.add(clean_domain)
+                self.collector.index.add(clean_domain)
+
+            # A url is blacklisted as its domain, but the url itself leaves the queue too.
+            self.collector.index.add(domain)
+
+        else:
+            print('{} is NOT malicious!'.format(domain))
+            if (domain not in self.collector.index):
+                self.processed_writer.write(domain + "\n")
+                self.collector.index.add(domain)
+
+        # Feeds that list it again are turned away at ingest.
+        self.collector.seen.add(domain)
+        if (clean_domain):
+            self.collector.seen.add(clean_domain)
+        return clean_domain
+
+    def record_verdict(self, domain, result, malicious=None):
+        '''
+            Given a domain and its VT result,
+            writes it to GlobalBlacklist.txt or Processed_file.txt,
+            its AV results to Full-Analysis.csv and both to the store.
+            malicious can be given when the batch was already scored.
+            Returns True if it is malicious.
+        '''
+        # Determine if domain is malicious
+        if (malicious is None):
+            malicious = self.is_malicious(result)
+        self.cache.put(domain, result, malicious)
+
+        clean_domain = self.classify(domain, malicious)
+        self.store.record(domain, result, malicious, blacklisted_as=clean_domain)
+
+        # Invalid urls have no AV results to write.
+        if (result):
+            self.csv_output(result)
+        return malicious
+
+    def record_cached(self, domain, malicious):
+        '''
+            A queued url with a fresh verdict in the cache.
+            Its AV results were recorded when it was scanned,
+            so only where it is filed and its status are updated.
+        '''
+        clean_domain = self.classify(domain, malicious)
+        self.store.set_status([domain], 'blacklisted' if (malicious) else 'processed')
+        if (clean_domain) and (clean_domain != domain):
+            self.store.set_status([clean_domain], 'blacklisted')
+        return malicious
     
     def reprocess(self):
-        self.processed = open(self.processed_file, 'r')
-        processed_list = self.processed.read().split()
+        '''
+            Rechecks processed domains for an hour,
+            the ones most likely to have turned malicious first.
+            Sleeps when none of them needs a scan yet.
+        '''
+        processed_list = self.store.processed()
         start = time.time()
-        time_lapsed = time.time()
+        tracker = self.report_tracker()
 
-        while ((time_lapsed - start) < 3600):
-            print("{}/{}".format(self.reprocess_line, len(processed_list)))
-            
-            try:
-                result = self.request(processed_list[self.reprocess_line])
+        # Only new domains need their Full-Analysis.csv rows looked up.
+        added = self.recheck.sync(processed_list)
+        self.recheck.seed_from_analysis(self.analysis_file, added)
+        self.recheck.seed_feeds(added, self.store.feed)
+        self.recheck.seed_times(added, self.store.history)
+
+        batch = []
+        sent = 0
+        next_expiry = None
+        for domain in self.recheck.ordered():
 
-                # Determine if domain is malicious
-                if (self.is_malicious(result)):
-                    print('{} is MALICIOUS!'.format(processed_list[self.reprocess_line]))
+            if ((time.time() - start) >= 3600):
+                break
 
-                    with open(self.blk_file, 'a') as self.blk:
-                        clean_domain = self.domain_clean(processed_list[self.reprocess_line])
-                        self.blk.write(clean_domain + "\n")
-                        self.blk.flush()
-                        os.fsync(self.blk.fileno())
+            # Scanned recently. Nothing to spend quota on.
+            if (self.cache.get(domain)):
+                expires = self.cache.expires(domain)
+                next_expiry = expires if (next_expiry is None) else min(next_expiry, expires)
+                continue
 
-                else:
-                    print('{} is NOT malicious!'.format(processed_list[self.reprocess_line]))
-                    with open(self.processed_file, 'a') as self.processed:
-                        self.processed.write(processed_list[self.reprocess_line] + "\n")
-                        self.processed.flush()
-                        os.fsync(self.processed.fileno())
+            print("Reprocessing {}".format(domain))
+            batch.append(domain)
+            sent += 1
+            if (len(batch) < self.batch_size()):
+                continue
 
-                self.csv_output(result)
+            # Verdicts on queued domains are passed to the recheck queue by record_batch(),
+            # whichever cycle their reports come back in.
+            try:
+                self.submit_batch(batch)
+                self.collect_reports()
 
             except:
                 print("Check reprocess...")
                 logging.debug("Check reprocess.\n")
                 pass
+            batch = []
 
-            # This ensure that the reporcess_line counter won't go past the range of number of lines in the file.
-            if (self.reprocess_line == len(processed_list)):
-                self.reprocess_line = 0
-            else:
-                self.reprocess_line +=1
+        try:
+            if (batch):
+                self.submit_batch(batch)
+            self.collect_reports()
 
-            time_lapsed = time.time()
+        except:
+            print("Check reprocess...")
+            logging.debug("Check reprocess.\n")
+            pass
 
+        self.commit_outputs()
+        self.recheck.save()
+        self.cache.save()
+        logging.info("Verdict cache: {}".format(self.cache.stats()))
+        logging.info("Recheck queue: {}".format(self.recheck.stats()))
+
+        # Nothing needed a scan. Rather than fetching the feeds again right away,
+        # waits for the first cached verdict to expire, the next report that is due,
+        # or for the rest of the hour.
+        if not (sent):
+            wait = 3600 - (time.time() - start)
+            if (next_expiry is not None):
+                wait = min(wait, next_expiry - time.time())
+            if (len(tracker)):
+                wait = min(wait, tracker.next_due())
+            if (wait > 0):
+                logging.info("Nothing to recheck. Sleeping {:.0f} seconds.".format(wait))
+                time.sleep(wait)
         return
 
     def csv_output(self, result):
         '''
             Writes to Full-Analysis.csv
+            Columns come from config/VT-AVs. See schema.py
         '''
         domain = result['url']
-        row = domain + ","
         ts = time.time()
-        timestamp = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
-        row += "{},,,,,,".format(timestamp) # This is the number of columns until the spreadsheet records AVs.
         scanResults = result['scans']
-        
-        for i in range(0, len(self.av_list)):
-            try:
-                row += self.cell(scanResults[self.av_list[i]])
-            except:
-                pass
-            row += ","
-        
-        row += "\n"
+
+        row, unseen = self.schema.row(domain, ts, scanResults)
         self.analysis.write(row)
-        self.analysis.flush()
-        os.fsync(self.analysis.fileno())
+        self.schema.write_unseen(unseen)
+        self.columnar.append(domain, ts, scanResults)
         return
     
-    def key_rotate(self):
-        if ((self.key_index) == 9):
-            self.key_index = 0
-            return
-        
-        else:
-            self.key_index += 1
-            return
+    def key_scheduler(self):
+        '''
+            Creates the token bucket scheduler once the keys are known.
+        '''
+        if (self.scheduler is None):
+            keys = self.keyring if (self.keyring) else [self.keyblade]
+            self.scheduler = keyscheduler.KeyScheduler(keys, premium=self.premium)
+        return self.scheduler
 
-    def request(self, url):
+    def report_tracker(self, shared=True):
+        '''
+            The tracker every batch shares, created once the key type is known.
+            shared=False gives a tracker of its own, for a single request().
+        '''
+        if (shared) and (self.reports is not None):
+            return self.reports
+
+        tracker = pending.PendingReports(self.batch_results, self.report_ready, batch_size=self.batch_size())
+        if (shared):
+            self.reports = tracker
+        return tracker
+
+    def request(self, url, cache=True):
         '''
             Given a url, will get the json results.
+            A fresh cached verdict is returned without spending quota.
+            It only has the AVs that didn't call the url clean. See verdictcache.py
+            Returns False for an invalid url, None if it couldn't be scanned.
         '''
+        if (cache):
+            cached = self.cache.get(url)
+            if (cached):
+                return cached
+
         # This section sends the url
         print("[ ] Sending url...{}".format(url))
-        
-        try:
-            addResponse = self.add_url(url)
-        
-        except:
-            print("request Waiting 60s...")
-            time.sleep(60)
-            #self.blk.flush()
-            #os.fsync(self.blk.fileno())
-            return self.request(url)
 
-        # This should help when addResponse returns nothing.
-        try:
+        # Failed submissions are retried a bounded number of times.
+        scan_id = self.add_urls([url]).get(url, False)
+        if (scan_id is None):
+            return False
+        if (scan_id is False):
+            return
 
-            if ('successfully' in addResponse['verbose_msg']):
-                print("[+] URL Added: {}".format(url))
-            
-                # This section you receive the JSON
-                results = self.results(addResponse['scan_id'])
-                return results
-            
-            elif ('Invalid' in addResponse['verbose_msg']):
-                # FIX THIS. if invalid, it create infinite loop.
-                results = False
-            
-            else:
-                time.sleep(30)
-                return self.request(url)
+        print("[+] URL Added: {}".format(url))
 
-        except:
-            logging.debug("addResponse: {}".format(addResponse))
-            #print(json_response['verbose_msg'])
-            return
+        # This section you receive the JSON
+        tracker = self.report_tracker(shared=False)
+        tracker.add(scan_id, url)
+        return tracker.wait().get(url)
 
+    def batch_size(self):
+        '''
+            url/scan and url/report accept up to 4 newline separated
+            urls/resources per call with a public key, 25 with a paid key.
+        '''
+        if (self.premium):
+            return 25
+        return 4
 
+    def as_list(self, response):
+        '''
+            VT answers a batch with a list, but a single url with a dict.
+        '''
+        if (type(response) == list):
+            return response
+        if (response):
+            return [response]
+        return []
 
-    
-    def reattack(self, response):
+    def add_urls(self, urls, retries=3):
         '''
-            Given the response from the server AND self.keyring exists,
-            this function will rotate the key, and send a new request.
+            Submits a batch of urls with a single url/scan call.
+            Only the entries that failed are submitted again.
+            Returns a dict of url: scan_id. Invalid urls get None.
         '''
+        scan_ids = {}
+        pending = list(urls)
 
-        return
+        for attempt in range(0, retries):
+            if not (pending):
+                break
 
-    def domain_clean(self, string):
+            failed = []
+            for i in range(0, len(pending), self.batch_size()):
+                batch = pending[i:i + self.batch_size()]
+
+                try:
+                    entries = self.as_list(self.add_url("\n".join(batch)))
+                except:
+                    logging.exception("message")
+                    entries = []
+
+                # Entries come back in the order the urls were sent.
+                for j in range(0, len(batch)):
+                    try:
+                        if ('successfully' in entries[j]['verbose_msg']):
+                            scan_ids[batch[j]] = entries[j]['scan_id']
+                            continue
+
+                        # Retrying an invalid url would never succeed.
+                        if ('Invalid' in entries[j]['verbose_msg']):
+                            logging.debug("Invalid url: {}".format(batch[j]))
+                            scan_ids[batch[j]] = None
+                            continue
+
+                    except (IndexError, KeyError, TypeError):
+                        pass
+                    failed.append(batch[j])
+
+            pending = failed
+
+        if (pending):
+            logging.debug("Could not submit: {}".format(pending))
+        return scan_ids
+
+    def batch_results(self, scan_ids):
         '''
-            Given a URL/URN, this function will return the domain [and [subdomain[s]]
+            Gets the reports of a batch of scan_ids with a single url/report call.
         '''
-        # Determines if port number specified
-        domain = urlparse(string)
+        return self.as_list(self.results("\n".join(scan_ids)))
 
-        if (":" in string):
-            regex_port = "(^\d*)"
-            port = re.match(regex_port, domain.path).group(0)
-            real_domain = domain.scheme
-            return real_domain + ":" + port
+    def report_ready(self, result):
+        if (result) and (result.get('response_code') == 1) and ('scans' in result):
+            return True
+        return False
 
-        if (domain.netloc):
-            return domain.netloc
+    def submit_batch(self, urls):
+        '''
+            Sends a batch of urls with as few url/scan calls as possible.
+            Cached and invalid urls are filed right away, the rest wait
+            in the report tracker. Urls that could not be scanned are left
+            out, so they stay queued.
+            Returns the (domain, result, malicious) that were recorded.
+        '''
+        recorded, uncached = self.file_cached(urls)
+        return recorded + self.track(self.add_urls(uncached))
 
-        elif (domain.path[0] != "/"):
+    def file_cached(self, urls):
+        '''
+            Files the urls that have a fresh verdict in the cache.
+            Returns (the (domain, result, malicious) recorded, the urls that still need a scan).
+        '''
+        hits = [(url, self.cache.get(url)) for url in urls]
+        hits = [(url, result) for url, result in hits if (result)]
+        recorded = self.record_batch(hits, cached=True)
 
-            if ("/" in domain.path):
-                # Get string until /
-                redomain = re.match("[^\/]*", domain.path).group(0)
-                return redomain
-            else:
-                return(domain.path)
+        cached = set(url for url, result in hits)
+        return (recorded, [url for url in urls if url not in cached])
 
-        else:
-            logging.debug("Error while cleaning a malicious domain before appending to blacklist\nDomain: {}".format(item))
+    def track(self, scan_ids):
+        '''
+            Given {url: scan_id} from add_urls(), puts the scans in the report
+            tracker and records the invalid urls.
+            Returns the (domain, result, malicious) that were recorded.
+        '''
+        tracker = self.report_tracker()
 
-        return
+        # Remembered before waiting on them, so a crash doesn't cost the scans.
+        self.store.submitted(dict((url, scan_id) for url, scan_id in scan_ids.items() if scan_id))
 
+        invalid = []
+        for url, scan_id in scan_ids.items():
+            # Invalid urls are recorded like request() does, with no result.
+            if not (scan_id):
+                invalid.append((url, None))
+                continue
+            tracker.add(scan_id, url)
 
-    def add_url(self, url):
+        return self.record_batch(invalid)
+
+    def collect_reports(self):
         '''
-            Adds a domain/url/ip to vt queue to analyze. 
+            Polls the reports that are due, without waiting on the ones that aren't.
+            Returns the (domain, result, malicious) that were recorded.
         '''
-        # These are for enabling key rotation
-        origin = time.time()
-        #self.new_key = True
+        return self.file_reports(self.report_tracker().poll())
 
-        # These are for the request to VT's server
-        if (self.keyring):
-            params = {'apikey': self.keyring[self.key_index], 'url': url}
-        
-        else:
-            params = {'apikey': self.keyblade, 'url': url}
+    def file_reports(self, ready):
+        '''
+            Given the (domain, result) the tracker has ready, records them,
+            and requeues the scans it gave up on.
+            Returns the (domain, result, malicious) that were recorded.
+        '''
+        tracker = self.report_tracker()
+        self.store.reported(ready)
 
-        print("params: {}".format(params))
-        
-        response = requests.post('https://www.virustotal.com/vtapi/v2/url/scan', data=params)
-        
-        print("response: {}".format(response))
+        # Scans that never got a report are sent again next cycle.
+        self.store.requeue(tracker.expired)
+        tracker.expired = []
+        return self.record_batch(ready)
 
-        if (response.status_code == 403):
-            logging.debug("403: {}".format(url))
-            print("403: ERROR WITH API-KEY") # DEBUGGING
-            sys.exit(0)       
+    def resume(self):
+        '''
+            Picks up the work a previous run left unfinished.
+            Reports that came back are recorded, and scans still waiting on
+            a report go back to the report tracker. Nothing is submitted again.
+        '''
+        unclassified = self.store.unclassified()
+        outstanding = self.store.outstanding()
+        tracker = self.report_tracker()
 
-        # THIS THE PROBLEM RIGHT HERE.
-        # THIS SHIT WON'T ROTATE KEYS CORRECTLY
-        if (response.status_code == 204):
-            logging.debug("204: {}".format(url))
+        # They were submitted before the restart, so they are polled right away.
+        for domain, scan_id in outstanding:
+            tracker.add(scan_id, domain, now=time.time() - tracker.first_poll)
 
-            # If they're multiple API keys
-            if (self.keyring):
+        if (unclassified) or (outstanding):
+            logging.info("Resuming {} reports and {} scans from the last run.".format(len(unclassified), len(outstanding)))
+        return self.record_batch(unclassified)
 
-                # Rotate key from 0 to 1.
-                self.key_rotate()
-                #self.new_key = True
-                if (self.key_index != 0):
-                    return self.add_url(url)
+    def record_batch(self, ready, cached=False):
+        '''
+            Given a list of (domain, result), scores them in one pass and records them.
+            cached=True for results from the verdict cache, which were recorded before.
+        '''
+        recorded = []
+        verdicts = self.scorer.is_malicious_batch([result for domain, result in ready])
 
-                else:
-                    try:
-                        self.collector.already_processed()
-                    except:
-                        pass
-                    end = time.time()
-                    time_lapsed = end - origin
-                    
-                    # If 60s has passed since the first key started, cooldown is over, reset keys and start over.
-                    if (time_lapsed > 60):
-                        #self.new_key = True
-                        return self.add_url(url)
-                    
-                    else:
-                        print("Keyring sleep: {}s".format(60-time_lapsed))
-                        time.sleep(60 - time_lapsed)
-                        response = requests.post('https://www.virustotal.com/vtapi/v2/url/scan', data=params)
+        for (domain, result), malicious in zip(ready, verdicts):
+            try:
+                if (cached):
+                    self.record_cached(domain, malicious)
+                    recorded.append((domain, result, malicious))
+                    continue
 
-                #else: # Branch to switch keys
-                    #self.new_key = True
-                    #self.key_rotate()
+                print("result: {}".format(result))
+                self.record_verdict(domain, result, malicious)
+                recorded.append((domain, result, malicious))
 
-            else:
-                print("add_url Waiting 60s...")
-                time.sleep(60)
-                response = requests.post('https://www.virustotal.com/vtapi/v2/url/scan', data=params)
-                    
-        json_response = response.json()
-        print(response.text)
-        return json_response
-    
-    def new_pdomains(self):
-        
-        # Input file for domain_list
-        try:
-            self.potentials = open(self.potentials_file, 'r')
+                # A scan of a processed domain is a recheck, whichever cycle it was sent in.
+                if (domain in self.recheck):
+                    self.recheck.checked(domain, result, malicious)
 
-        except FileNotFoundError:
-            logging.info("{} not found. Creating one now.".format(self.potentials_file))
-            self.potentials = open(self.potentials_file, 'a')
-            self.potentials.close()
-            self.potentials = open(self.potentials_file, 'r')
-            logging.exception("message")
-            pass     
+            except:
+                print("Check persistent analysis..")
+                logging.debug("Check persistent analysis.\n")
+                pass
+        return recorded
 
-        potentials_list = self.potentials.read().split()
-        self.potentials.close()        
+    def wait_for(self, domains):
+        '''
+            Waits on the reports of domains only, like the hosts the rollup needs
+            a verdict on. Other reports that come due meanwhile are recorded too.
+        '''
+        recorded = []
+        tracker = self.report_tracker()
+        domains = set(domains)
+        while (tracker.waiting(domains)):
+            time.sleep(tracker.next_due())
+            recorded += self.collect_reports()
+        return recorded
 
-        try:
-            blkout = open(self.blk_file, 'r')
-
-        except FileNotFoundError:
-            logging.info("{} not found. Creating one now.".format(self.blk_file))
-            blkout = open(self.blk_file, 'a')
-            blkout.close()
-            blkout = open(self.blk_file, 'r')
-            logging.exception("message")
-            pass
+    def reattack(self, response):
+        '''
+            Given the response from the server AND self.keyring exists,
+            this function will rotate the key, and send a new request.
+        '''
 
-        blkout_list = blkout.read().split()
-        blkout.close()
+        return
 
-        try:
-            processed = open(self.processed_file, 'r')
-
-        except FileNotFoundError:
-            logging.info("{} not found. Creating one now.".format(self.processed_file))
-            processed = open(self.processed_file, 'a')
-            processed.close()
-            processed = open(self.processed_file, 'r')
-            logging.exception("message")
-            pass
+    def domain_clean(self, string):
+        '''
+            Given a URL/URN, this function will return the domain [and [subdomain[s]]
+            and its port, if it has one. See normalize.py
+        '''
+        domain = normalize.domain(string)
 
-        processed_list = processed.read().split()
-        processed.close()
+        if (domain is None):
+            logging.debug("Error while cleaning a malicious domain before appending to blacklist\nDomain: {}".format(string))
+        return domain
 
-        temp_total_list = blkout_list + processed_list
-        if not (list(set(potentials_list) - set(temp_total_list))):
-            return False
-        return True
+
+    def add_url(self, url):
+        '''
+            Adds a domain/url/ip to vt queue to analyze. 
+        '''
+        while True:
+            # The scheduler hands out the key with the earliest available token
+            # and only sleeps when the whole keyring is spent.
+            key = self.key_scheduler().acquire()
+            params = {'apikey': key, 'url': url}
+
+            response = self.http.post(self.api + 'url/scan', data=params)
+
+            print("response: {}".format(response))
+
+            if (response.status_code == 403):
+                logging.debug("403: {}".format(url))
+                print("403: ERROR WITH API-KEY") # DEBUGGING
+                sys.exit(0)       
+
+            # VT disagrees with our count for this key. Drain it and try the next one.
+            if (response.status_code == 204):
+                logging.debug("204: {}".format(url))
+                self.scheduler.throttled(key)
+                continue
+
+            # The transport doesn't send url/scan twice, VT may have queued the urls.
+            # add_urls() submits the failed ones again, with a token of their own.
+            if (response.status_code >= 500):
+                logging.debug("{}: {}".format(response.status_code, url))
+                return
+
+            break
+                    
+        json_response = response.json()
+        print(response.text)
+        return json_response
+    
+    def new_pdomains(self):
+        '''
+            True if the store has domains that weren't processed yet.
+            A single indexed lookup, however long the history is.
+        '''
+        return self.store.has_pending()
 
     def results(self, scan_id):
         '''
             Gets the results of a domain/url/ip request.
         '''
         # These are for the request to VT's server
-        if (self.keyring):
-            params = {'apikey': self.keyring[self.key_index], 'resource':scan_id}
-        
-        else:
-            params = {'apikey': self.keyblade, 'resource':scan_id}
+        params = {'apikey': self.key_scheduler().acquire(), 'resource':scan_id}
 
-        headers = {"Accept-Encoding": "gzip, deflate",\
-            "User-Agent" : "gzip,  My Python requests library example client or username"}
-        response = requests.post('https://www.virustotal.com/vtapi/v2/url/report', params=params, headers=headers)
+        # Only reads a report, so it is safe to send again.
+        response = self.http.post(self.api + 'url/report', params=params, idempotent=True)
         
         # There's a case where the response is empty
         if not (response):
@@ -566,10 +843,14 @@ class VirusTotal:
             Don't get output_file and output_filename confused.
             output_file is open.
         '''
-        self.analysis = open(self.analysis_file, 'a')
-        self.analysis.write("Domain,Timestamp,Detected,Clean,Suspicious,Malware,Malicious,ADMINUSLabs,AegisLab WebGuard,AlienVault,Antiy-AVL,Avira,Baidu-International,BitDefender,Blueliv,C-SIRT,Certly,CLEAN MX,Comodo Site Inspector,CyberCrime,CyRadar,desenmascara.me,DNS8,Dr.Web,Emsisoft,ESET,Forcepoint ThreatSeeker,Fortinet,FraudScore,FraudSense,G-Data,Google Safebrowsing,K7AntiVirus,Kaspersky,Malc0de Database,Malekal,Malware Domain Blocklist,Malwarebytes hpHosts,Malwared,MalwareDomainList,MalwarePatrol,malwares.com URL checker,Nucleon,OpenPhish,Opera,Phishtank,Quttera,Rising,SCUMWARE.org,SecureBrain,securolytics,Spam404,Sucuri SiteCheck,Tencent,ThreatHive,Trustwave,Virusdie External Site Scan,VX Vault,Web Security Guard,Webutation,Yandex Safebrowsing,ZCloudsec,ZDB Zeus,ZeroCERT,Zerofox,ZeusTracker,zvelo,AutoShun,Netcraft,NotMining,PhishLabs,Sophos,StopBadware,URLQuery\n")
-        self.analysis.flush()
-        os.fsync(self.analysis.fileno())
+        self.analysis = groupcommit.GroupCommitWriter(self.analysis_file)
+        self.write_header()
+        return
+
+    def write_header(self):
+        self.analysis.write(self.schema.header())
+        self.analysis.commit()
+        self.schema.save()
         return
 
     def cell(self, av_result):
@@ -577,19 +858,9 @@ class VirusTotal:
             Given a single av_result by vt,
             this will format an output.
             ex. {'detected': False, 'result': 'clean site'}
-                'False/clean site'
+                'False;clean site'
         '''
-        cell = str(av_result['detected'])
-        cell += ";" + av_result['result']
-        
-        # Sometimes there aren't details.
-        try:
-            cell += ";" + av_result['detail']
-        except:
-            logging.exception("message")
-            pass
-
-        return cell
+        return schema.cell(av_result)
 
     def malcheck(self, url):
         result = self.request(url)
@@ -606,23 +877,16 @@ class VirusTotal:
     def is_malicious(self, result):
         '''
             Determines if a domain is malicious.
-            If both Forcepoint ThreatSeeker and Fortinet return True,
-            it is malicious.
+            The AVs that flagged it are weighed with config/AV-weights.
+            By default, if both Forcepoint ThreatSeeker and Fortinet
+            flag it, it is malicious.
         '''
         # If it receives a result that is False, it will return false through this function.
         # This is useful when a domain does not work in VT.
         if not (result):
             return False
-        
-		# Need to change this to Fortinet and not double Forcepoints.
-        try:
-            if ("clean" not in result['scans']['Forcepoint ThreatSeeker']['result']) & ("unrated" not in result['scans']['Forcepoint ThreatSeeker']['result']):
-                return True
-        except:
-            logging.warning("{} could not be determine as malicious or not. AVs on VT might not have analyzed domain.")
-            logging.exception("message")
-            pass
-        return False
+
+        return self.scorer.is_malicious_batch([result])[0]
 
 
 def main():
@@ -663,10 +927,20 @@ def main():
             pass
     
     
+    premium = input("Are your API keys premium (25 requests/minute)? (y/n) ")
+
+    if ((premium == 'y') or (premium == 'Y')):
+        c.premium = True
+
     update = input("Would you like to update your domains via malware_feed? (y/n) ")
 
     if ((keys == 'n') or (keys == 'N')):
         c.update = False
+
+    pipeline = input("Would you like to keep multiple scans in flight at once? (y/n) ")
+
+    if ((pipeline == 'y') or (pipeline == 'Y')):
+        c.async_mode = True
         
     # Start running the analysis
     c.persistent_analysis()